@@ -1,6 +1,10 @@
 from collections import OrderedDict, deque
+from functools import lru_cache
 import glob
+import h5py
+import json
 import logging
+import numpy as np
 import os
 from pathlib import Path
 import signal
@@ -8,12 +12,16 @@ import sys
 import threading
 from typing import Type, Dict, Union
 
+from caput import memh5
 from caput.config import Property, Reader
 from ch_pipeline.core.containers import RingMap
 from draco.core.containers import DelaySpectrum, RFIMask, SystemSensitivity
 
 from bondia.util.day import Day
 from bondia.util.exception import DataError
+from bondia.util.files import atomic_output
+from bondia.util.sketch import SKETCH_FILE_NAME, read_sketch
+from bondia.util.summary import SUMMARY_FILE_NAME, read_summary
 
 logger = logging.getLogger(__name__)
 
@@ -25,6 +33,14 @@ FILE_TYPES = {
     "sensitivity": "sensitivity_validation_lsd_*.h5",
     "rfi": "rfi_mask_lsd_*.h5",
 }
+# Optional single file per day holding all of the above as groups named by file type
+BUNDLE_FILE_NAME = "validation_bundle_lsd_{lsd}.h5"
+BUNDLE_FILE_TYPE = "validation_bundle_lsd_*.h5"
+# Readiness marker written by the preprocessing once all files of a day are complete
+READY_FILE_NAME = "ready.json"
+# Polarisation label of the XX/YY mean, in the plots and in preprocessed templates and
+# sketches
+MEAN_POL = "Mean(XX, YY)"
 CONTAINER_TYPES: Dict[str, Type[Union[DelaySpectrum, RingMap]]] = {
     "delayspectrum": DelaySpectrum,
     "delayspectrum_hpf": DelaySpectrum,
@@ -39,12 +55,26 @@ class DataLoader(Reader):
     path = Property(proptype=Path)
     interval = Property(proptype=int, default=600)
     max_days_in_memory = Property(proptype=int, default=10)
+    # File types to read lazily from disk (only the data a plot selects gets read)
+    ondisk = Property(proptype=list, default=[])
+    # Only index days with a readiness marker (see `write_ready_marker`)
+    require_ready = Property(proptype=bool, default=False)
 
     def __init__(self):
         self.num_days_in_memory = 0
         self._index = {}
         self._index_by_path = {}
         self._lru = {}
+        self._summary = {}
+        self._sketch = {}
+        self._failed = {}
+        # Files read so far and the number of the latest read of each, see `load_generation`
+        self._loads = 0
+        self._load_generation = {}
+        # Plots may load files in a background thread, see `HeatMapPlot.refine`. One lock
+        # per file is held while reading it, the other one only while updating the index.
+        self._lock = threading.Lock()
+        self._file_locks = {}
 
         # Set up periodic data file indexing
         self._periodic_indexer = None
@@ -106,6 +136,87 @@ class DataLoader(Reader):
         """
         return self.revisions[-1]
 
+    def summary(self, revision: str):
+        """
+        Get the per-day summary table of a revision.
+
+        The table is read from disk only once and re-read when the file changes.
+
+        Parameters
+        ----------
+        revision : str
+            Revision key
+
+        Returns
+        -------
+        Dict[str, np.ndarray] or None
+            Columns by name, sorted by `lsd`. None if there is no summary table.
+        """
+        if self.path is None:
+            return None
+        path = os.path.join(self.path, revision, SUMMARY_FILE_NAME)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+        if revision not in self._summary or self._summary[revision][0] != mtime:
+            logger.debug(f"Loading summary table for {revision} from {path}...")
+            try:
+                self._summary[revision] = (mtime, read_summary(path))
+            except (OSError, KeyError) as err:
+                logger.error(f"Failure reading summary table {path}: {err}")
+                return None
+        return self._summary[revision][1]
+
+    def sketch(self, revision: str, day: Day, file_type: str):
+        """
+        Get the quantile sketch of a file type for one day.
+
+        Sketches are written by the preprocessing (see `bondia.util.sketch`). They are
+        read from disk only once and re-read when the file changes.
+
+        Parameters
+        ----------
+        revision : str
+            Revision key
+        day : Day
+            Day
+        file_type : str
+            File type
+
+        Returns
+        -------
+        Dict[str, np.ndarray] or None
+            Sketch and labels, including the `percentiles`. None if there is no sketch.
+        """
+        try:
+            path = os.path.join(
+                self._index[revision][day]._path,
+                SKETCH_FILE_NAME.format(lsd=day.lsd),
+            )
+        except KeyError:
+            return None
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+        if path not in self._sketch or self._sketch[path][0] != mtime:
+            logger.debug(f"Loading sketches for {revision}, {day} from {path}...")
+            try:
+                sketches = read_sketch(path)
+            except (OSError, KeyError) as err:
+                logger.error(f"Failure reading sketch file {path}: {err}")
+                return None
+            self._sketch.pop(path, None)
+            self._sketch[path] = (mtime, sketches)
+            # Keep sketches of as many days as data files
+            while len(self._sketch) > self.max_days_in_memory:
+                self._sketch.pop(next(iter(self._sketch)))
+        sketches = self._sketch[path][1]
+        if file_type not in sketches:
+            return None
+        return {"percentiles": sketches["percentiles"], **sketches[file_type]}
+
     def index_files(self, dirs):
         """
         (Re)index data files.
@@ -149,6 +260,11 @@ class DataLoader(Reader):
                         self._index[rev] = {}
 
                     if day.lsd not in self.lsds(rev):
+                        if self.require_ready and not os.path.isfile(
+                            os.path.join(lsd_dir, READY_FILE_NAME)
+                        ):
+                            logger.debug(f"Skipping {rev}, {day}: not ready yet.")
+                            continue
                         if rev not in new_lsds:
                             new_lsds[rev] = []
                         try:
@@ -163,7 +279,14 @@ class DataLoader(Reader):
                             self._index[rev][day] = new_lsd
                     else:
                         # Update files in lsd
-                        self._index[rev][day]._glob_files()
+                        try:
+                            with self._lock:
+                                self._index[rev][day]._glob_files()
+                                self._lru_prune(rev, day)
+                        except DataError as err:
+                            logger.error(
+                                f"Failure updating data for {rev}, {day}: {err}"
+                            )
 
                 if rev in new_lsds and len(new_lsds[rev]) > 0:
                     logger.info(f"Found new {rev} data for day(s) {new_lsds[rev]}.")
@@ -179,31 +302,133 @@ class DataLoader(Reader):
         """
         Load the data of one day from disk.
 
-        Data is loaded from disk only once and then cached.
+        Data is loaded from disk only once and then cached. Files in memory are returned
+        without waiting for other files being read.
         """
+        container = self._cached(revision, day, file_type)
+        if container is not None:
+            return container
+        with self._file_lock(revision, day, file_type):
+            return self._load_file(revision, day, file_type)
+
+    def _file_lock(self, revision: str, day: Day, file_type: str):
+        with self._lock:
+            return self._file_locks.setdefault(
+                (revision, day, file_type), threading.Lock()
+            )
+
+    def _cached(self, revision: str, day: Day, file_type: str):
+        """Get a file in memory, or None if it isn't loaded."""
         try:
-            f = getattr(self._index[revision][day], file_type)
-        except AttributeError:
-            raise DataError(f"{file_type} for day {day}, {revision} not available.")
+            lsd = self._index[revision][day]
         except KeyError as not_found:
             raise DataError(
                 f"Couldn't find data for {not_found} when loading revision {revision}, day {day}"
             )
-        if f is not None:
-            self._lru_push(revision, day, file_type)
-            return f
+        with self._lock:
+            try:
+                container = getattr(lsd, file_type)
+            except AttributeError:
+                raise DataError(f"{file_type} for day {day}, {revision} not available.")
+            if container is not None:
+                self._lru_push(revision, day, file_type)
+            return container
+
+    def is_loaded(self, revision: str, day: Day, file_type: str):
+        """Tell if `load_file` would return without reading from disk."""
+        try:
+            return getattr(self._index[revision][day], file_type) is not None
+        except (AttributeError, KeyError):
+            return False
+
+    def load_generation(self, revision: str, day: Day, file_type: str):
+        """
+        Identify the last read of a file from disk, to key data computed from it.
+
+        Unlike the `id` of a container, this is never reused after the container is
+        freed: reading the file again gets a new number.
+
+        Returns
+        -------
+        int
+            0 if the file was never loaded.
+        """
+        return self._load_generation.get((revision, day, file_type), 0)
+
+    def read_preview(self, revision: str, day: Day, file_type: str, read):
+        """
+        Read a small part of a file directly, without loading (or caching) it.
+
+        Parameters
+        ----------
+        revision : str
+            Revision key
+        day : Day
+            Day
+        file_type : str
+            File type
+        read : Callable[[h5py.Group], Any]
+            Reads what's needed from the group holding the container (e.g. a strided
+            slice of a dataset).
+
+        Returns
+        -------
+        The return value of `read`.
+        """
+        try:
+            f = self._index[revision][day].files[file_type]
+            bundled = file_type in self._index[revision][day].bundled
+        except KeyError as not_found:
+            raise DataError(f"Couldn't find {not_found} for {revision}, day {day}")
+        if f is None:
+            raise DataError(f"No {file_type} files for day {day}, {revision} found.")
+        try:
+            with h5py.File(f, "r") as data:
+                return read(data[file_type] if bundled else data)
+        except (OSError, KeyError, ValueError) as err:
+            raise DataError(f"Failure reading preview of {file_type} file {f}: {err}")
+
+    def _load_file(self, revision: str, day: Day, file_type: str):
+        # Another thread may have loaded it while this one waited for the file lock
+        container = self._cached(revision, day, file_type)
+        if container is not None:
+            return container
         logger.debug(f"Loading {file_type} file for {revision}, {day}...")
         f = self._index[revision][day].files[file_type]
         if f is None:
             raise DataError(f"No {file_type} files for day {day}, {revision} found.")
-        self._free_oldest_file(file_type)
-        setattr(
-            self._index[revision][day],
-            file_type,
-            CONTAINER_TYPES[file_type].from_file(f),
-        )
-        self._lru_push(revision, day, file_type)
-        return getattr(self._index[revision][day], file_type)
+
+        # Don't retry reading a file that failed before, unless it changed since
+        try:
+            mtime = os.path.getmtime(f)
+        except OSError as err:
+            raise DataError(
+                f"Can't access {file_type} file for {revision}, {day}: {err}"
+            )
+        if self._failed.get((f, file_type)) == mtime:
+            raise DataError(f"Reading {file_type} file {f} failed before.")
+
+        with self._lock:
+            self._free_oldest_file(file_type)
+        try:
+            container = load_container(
+                CONTAINER_TYPES[file_type],
+                f,
+                group=file_type
+                if file_type in self._index[revision][day].bundled
+                else None,
+                ondisk=file_type in self.ondisk,
+            )
+        except (OSError, KeyError, ValueError) as err:
+            with self._lock:
+                self._failed[(f, file_type)] = mtime
+            raise DataError(f"Failure reading {file_type} file {f}: {err}")
+        with self._lock:
+            setattr(self._index[revision][day], file_type, container)
+            self._loads += 1
+            self._load_generation[(revision, day, file_type)] = self._loads
+            self._lru_push(revision, day, file_type)
+        return container
 
     def _free_oldest_file(self, file_type: str):
         """Remove the file from memory that had been loaded the longest time ago."""
@@ -212,6 +437,8 @@ class DataLoader(Reader):
             return
         if len(self._lru[file_type]) > self.max_days_in_memory - 1:
             i = self._lru_pop(file_type)
+            if file_type in self.ondisk:
+                close_container(getattr(self._index[i[0]][i[1]], file_type))
             setattr(self._index[i[0]][i[1]], file_type, None)
 
     def _lru_pop(self, file_type):
@@ -227,6 +454,16 @@ class DataLoader(Reader):
         logger.debug(f"Removing {file_type} for {i[0]}, day {i[1]} from memory")
         return i
 
+    def _lru_prune(self, revision: str, day: Day):
+        """Forget the files of a day that got dropped from memory (see `LSD`)."""
+        indices = (revision, day)
+        for file_type, lru in self._lru.items():
+            if (
+                indices in lru
+                and getattr(self._index[revision][day], file_type) is None
+            ):
+                lru.remove(indices)
+
     def _lru_push(self, revision: str, day: Day, file_type: str):
         """
         Signal recent usage of file indices.
@@ -266,35 +503,259 @@ class DataLoader(Reader):
             return self._index_by_path[path]
 
 
+def load_container(container, path: os.PathLike, group: str = None, ondisk=False):
+    """
+    Load a container from a file or from a group in a validation bundle file.
+
+    Parameters
+    ----------
+    container : Type[ContainerBase]
+        Container type.
+    path : os.PathLike
+        File path.
+    group : str, optional
+        Name of the group holding the container in a bundle file.
+    ondisk : bool
+        Read the data lazily from disk.
+
+    Returns
+    -------
+    ContainerBase
+        Container of the given type.
+    """
+    if group is None:
+        return container.from_file(path, ondisk=ondisk)
+
+    if ondisk:
+        # The file stays open for lazy reads, see `close_container`
+        data = h5py.File(path, "r")[group]
+    else:
+        data = memh5.MemGroup()
+        with h5py.File(path, "r") as f:
+            memh5.deep_group_copy(
+                f[group],
+                data,
+                convert_attribute_strings=True,
+                convert_dataset_strings=True,
+            )
+
+    # Skip the container initialiser like `from_file` does: it would create empty datasets
+    cont = container.__new__(container)
+    memh5.MemDiskGroup.__init__(cont, data_group=data)
+    return cont
+
+
+def close_container(cont):
+    """
+    Close the file a container reads from lazily (if any), see `load_container`.
+
+    Parameters
+    ----------
+    cont : ContainerBase
+        Container. It can't read any data after this.
+    """
+    data = getattr(cont, "_data", None)
+    if isinstance(data, h5py.Group):
+        logger.debug(f"Closing {data.file.filename}.")
+        data.file.close()
+
+
+@lru_cache(maxsize=32)
+def load_template(path: os.PathLike, beam, pol: str, freq: float):
+    """
+    Load one plane of a preprocessed ringmap template.
+
+    Templates are written by `val_preprocess.py template`. Only the selected plane gets
+    read. This function is cached.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Template file.
+    beam
+        Beam (value of the beam index map).
+    pol : str
+        Polarisation, or `MEAN_POL` for the mean of XX and YY.
+    freq : float
+        Frequency centre in MHz.
+
+    Returns
+    -------
+    np.ndarray
+        Template of shape (ra, el).
+    """
+    if not os.path.isfile(path):
+        raise DataError(f"Couldn't find a file at path '{path}'")
+    logger.debug(f"Loading template plane {beam}, {pol}, {freq} from '{path}'...")
+    with h5py.File(path, "r") as f:
+        pols = [p.decode() if isinstance(p, bytes) else p for p in f["index_map/pol"]]
+        sel_beam = np.flatnonzero(f["index_map/beam"][:] == beam)
+        sel_freq = np.flatnonzero(np.isclose(f["index_map/freq"]["centre"], freq))
+        if pol not in pols or len(sel_beam) == 0 or len(sel_freq) == 0:
+            raise DataError(
+                f"Template '{path}' has no data for beam {beam}, polarisation {pol}, "
+                f"frequency {freq}."
+            )
+        template = f["map"][sel_beam[0], pols.index(pol), sel_freq[0]]
+    # All callers share the cached template
+    template.flags.writeable = False
+    return template
+
+
+def write_ready_marker(path: os.PathLike):
+    """
+    Mark the files of one day as ready to be indexed.
+
+    Lists the files of all file types in the directory of a day (and the file types in
+    a bundle file) in a JSON file. The indexer reads this instead of globbing for files.
+    The marker is written atomically.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Directory of the day.
+    """
+    files = {}
+    bundled = []
+    bundle = glob.glob(os.path.join(path, BUNDLE_FILE_TYPE))
+    if len(bundle) == 1:
+        with h5py.File(bundle[0], "r") as f:
+            bundled = [file_type for file_type in FILE_TYPES if file_type in f]
+        files.update({file_type: os.path.basename(bundle[0]) for file_type in bundled})
+    for file_type, file_type_glob in FILE_TYPES.items():
+        if file_type in bundled:
+            continue
+        file = glob.glob(os.path.join(path, file_type_glob))
+        if len(file) == 1:
+            files[file_type] = os.path.basename(file[0])
+
+    with atomic_output(os.path.join(path, READY_FILE_NAME)) as tmp_file:
+        with open(tmp_file, "w") as f:
+            json.dump({"files": files, "bundled": bundled}, f, indent=1)
+
+
 class LSD:
     def __init__(self, path: os.PathLike, rev: str, day: Day):
         self._day = day
         self._rev = rev
+        self._path = path
+        self._ready_mtime = None
         self.files = {}
-        self._glob_files(path)
-
-    def _glob_files(self, path: os.PathLike):
-        for file_type, file_type_glob in FILE_TYPES.items():
-            file = glob.glob(os.path.join(path, file_type_glob))
-            if len(file) != 1:
-                # raise DataError(
-                logger.warn(
-                    f"Found {len(file)} {file_type} files in {path} (Expected 1)."
-                )
-                file = None
-            else:
-                file = file[0]
+        self.bundled = set()
+        self._glob_files()
 
-                logger.debug(f"Found {self._rev} file for lsd {self._day}: {file}")
+    def _read_ready_marker(self):
+        """
+        Get the files of this day from its readiness marker.
 
-                lsd = int(os.path.splitext(os.path.basename(file))[0][-4:])
-                if lsd != self._day.lsd:
-                    raise DataError(
-                        f"Found file for LSD {lsd} when expecting LSD {self._day.lsd}: {file}"
-                    )
+        Returns
+        -------
+        bool
+            False if there is no readiness marker.
+        """
+        marker = os.path.join(self._path, READY_FILE_NAME)
+        try:
+            mtime = os.path.getmtime(marker)
+        except OSError:
+            return False
+        if mtime == self._ready_mtime:
+            # Nothing changed: keep the files loaded already
+            return True
+
+        try:
+            with open(marker, "r") as f:
+                ready = json.load(f)
+        except (OSError, ValueError) as err:
+            raise DataError(f"Failure reading readiness marker {marker}: {err}")
+        logger.debug(f"Found {self._rev} readiness marker for lsd {self._day}: {ready}")
+
+        self.bundled = set(ready["bundled"])
+        for file_type in FILE_TYPES:
+            file = ready["files"].get(file_type)
+            if file is None:
+                logger.warn(f"No {file_type} file ready in {self._path}.")
+            else:
+                file = os.path.join(self._path, file)
+            self._set_file(file_type, file)
+        self._ready_mtime = mtime
+        return True
+
+    def _glob_bundle(self):
+        """Find the file types available in a validation bundle file."""
+        path = self._path
+        self.bundled = set()
+        file = glob.glob(os.path.join(path, BUNDLE_FILE_TYPE))
+        if len(file) != 1:
+            if file:
+                logger.warn(f"Found {len(file)} bundle files in {path} (Expected 1).")
+            return
+        file = file[0]
 
-            self.files[file_type] = file
-            setattr(self, file_type, None)
+        lsd = int(os.path.splitext(os.path.basename(file))[0][-4:])
+        if lsd != self._day.lsd:
+            raise DataError(
+                f"Found file for LSD {lsd} when expecting LSD {self._day.lsd}: {file}"
+            )
+
+        try:
+            with h5py.File(file, "r") as f:
+                groups = set(f.keys())
+        except OSError as err:
+            logger.error(f"Failure reading bundle file {file}: {err}")
+            return
+        logger.debug(f"Found {self._rev} bundle for lsd {self._day}: {file}")
+
+        for file_type in FILE_TYPES:
+            if file_type in groups:
+                self.bundled.add(file_type)
+                self._set_file(file_type, file)
+
+    def _glob_file(self, file_type: str):
+        """Find the file of a file type in the directory of this day (None if not 1)."""
+        path = self._path
+        file = glob.glob(os.path.join(path, FILE_TYPES[file_type]))
+        if len(file) != 1:
+            # raise DataError(
+            logger.warn(f"Found {len(file)} {file_type} files in {path} (Expected 1).")
+            return None
+        file = file[0]
+
+        logger.debug(f"Found {self._rev} file for lsd {self._day}: {file}")
+
+        lsd = int(os.path.splitext(os.path.basename(file))[0][-4:])
+        if lsd != self._day.lsd:
+            raise DataError(
+                f"Found file for LSD {lsd} when expecting LSD {self._day.lsd}: {file}"
+            )
+        return file
+
+    def _glob_files(self):
+        if self._read_ready_marker():
+            # Files added after the marker was written aren't listed in it
+            for file_type, file_type_glob in FILE_TYPES.items():
+                if self.files.get(file_type) is None and glob.glob(
+                    os.path.join(self._path, file_type_glob)
+                ):
+                    self._set_file(file_type, self._glob_file(file_type))
+            return
+        self._glob_bundle()
+        for file_type in FILE_TYPES:
+            if file_type in self.bundled:
+                continue
+            self._set_file(file_type, self._glob_file(file_type))
+
+    def _set_file(self, file_type: str, file: str):
+        """Set the file of a file type, dropping its loaded container if it changed."""
+        if file_type in self.files and self.files[file_type] == file:
+            return
+        container = getattr(self, file_type, None)
+        if container is not None:
+            logger.debug(
+                f"{file_type} file of {self._rev}, {self._day} changed: {file}"
+            )
+            close_container(container)
+        self.files[file_type] = file
+        setattr(self, file_type, None)
 
     def __repr__(self):
         return self._day.__repr__()
@@ -10,6 +10,7 @@ from bondia import opinion
 from bondia.plot.delayspectrum import DelaySpectrumPlot, DelaySpectrumPlotHPF
 from bondia.plot.ringmap import RingMapPlot
 from bondia.plot.sensitivity import SensitivityPlot
+from bondia.util.summary import anomaly_scores
 
 
 logger = logging.getLogger(__name__)
@@ -23,6 +24,7 @@ class BondiaGui(param.Parameterized):
     revision = param.ObjectSelector(label="Select Data Revision")
     filter_lsd = param.Boolean(default=False, label="Hide days I have voted for")
     sort_lsds = param.Boolean(default=False, label="Sort by number of opinions")
+    sort_anomaly = param.Boolean(default=False, label="Sort by anomaly score")
 
     def __init__(
         self,
@@ -67,7 +69,7 @@ class BondiaGui(param.Parameterized):
         self.param["lsd"].objects = list(self._data.days(self.revision))
         self.lsd = self._choose_lsd()
 
-    @param.depends("revision", "filter_lsd", "sort_lsds", watch=True)
+    @param.depends("revision", "filter_lsd", "sort_lsds", "sort_anomaly", watch=True)
     def update_days(self):
         """Update days depending on selected revision."""
 
@@ -83,8 +85,38 @@ class BondiaGui(param.Parameterized):
         if self.sort_lsds:
             days = opinion.sort_by_num_opinions(self.revision, days)
 
+        if self.sort_anomaly:
+            days = self._sort_by_anomaly(days)
+
         self.param["lsd"].objects = days
 
+    def _sort_by_anomaly(self, days):
+        """Sort days by anomaly score from the summary table, most unusual first."""
+        table = self._data.summary(self.revision)
+        if table is None:
+            logger.warning(f"No summary table for {self.revision}, can't sort days.")
+            return days
+        scores = anomaly_scores(table)
+        return sorted(days, key=lambda day: scores.get(day.lsd, 0), reverse=True)
+
+    @param.depends("revision", "lsd")
+    def day_overview(self):
+        """Summary statistics of all days of the selected revision."""
+        table = self._data.summary(self.revision)
+        if table is None:
+            return pn.pane.Markdown(f"No summary statistics for {self.revision}.")
+        curves = []
+        for column, values in table.items():
+            if column == "lsd":
+                continue
+            curve = hv.Curve((table["lsd"], values), "LSD", column).opts(
+                width=300, height=150, tools=["hover"], title=column
+            )
+            if self.lsd is not None:
+                curve *= hv.VLine(self.lsd.lsd).opts(color="red", line_width=1)
+            curves.append(curve)
+        return hv.Layout(curves).cols(4)
+
     @param.depends("lsd")
     def data_description(self):
         """A title over the plots showing the selected day and rev (and keep it updated)"""
@@ -94,21 +126,16 @@ class BondiaGui(param.Parameterized):
     async def update_plots(self):
         """Async refresh plots to new revision/lsd. Triggered
         when switching to a new day."""
-        # Hide all existing plots while we load new data
-        for plot in self._plot:
-            plot.panel_row = False
 
         async def _update_plot(plot):
-            # Link selected day, revision to plots
-            plot.lsd = self.lsd
-            plot.revision = self.revision
-            plot.panel_row = True
+            # Link selected day, revision to plots (renders each plot once)
+            plot.update_day(self.revision, self.lsd)
 
         coros = [_update_plot(p) for p in self._plot]
         await asyncio.gather(*coros)
 
     def _choose_lsd(self):
-        if self.sort_lsds:
+        if self.sort_lsds or self.sort_anomaly:
             day = self.param["lsd"].objects[0]
         else:
             selected_day = getattr(self, "lsd", None)
@@ -222,6 +249,8 @@ class BondiaGui(param.Parameterized):
         template.add_panel("day_filter_opinion_checkbox", self.param["filter_lsd"])
         # Checkbox to sort days by number of opinions
         template.add_panel("day_sort_checkbox", self.param["sort_lsds"])
+        # Checkbox to sort days by anomaly score
+        template.add_panel("day_sort_anomaly_checkbox", self.param["sort_anomaly"])
 
         # Fill the template with components
         template.add_panel("data_description", self.data_description)
@@ -276,6 +305,7 @@ class BondiaGui(param.Parameterized):
             template.add_panel(f"opinion_{decision}", self._opinion_buttons[decision])
 
         template.add_panel("day_stats", self._day_stats)
+        template.add_panel("day_overview", self.day_overview)
 
         self._plot = [
             DelaySpectrumPlot(self._data, self._config_plots.get("delayspectrum", {})),
@@ -287,8 +317,7 @@ class BondiaGui(param.Parameterized):
         ]
 
         for plot in self._plot:
-            plot.revision = self.revision
-            plot.lsd = self.lsd
+            plot.update_day(self.revision, self.lsd)
 
             # Fill in the plot selection toggle buttons
             self._toggle_plot[plot.id] = pn.widgets.Toggle(
@@ -358,7 +387,7 @@ class BondiaGui(param.Parameterized):
             self._opinion_warning.object = f"Opinion added for LSD {lsd.lsd}"
             self._update_opinion_warning()
 
-            if self.sort_lsds or self.filter_lsd:
+            if self.sort_lsds or self.sort_anomaly or self.filter_lsd:
                 self.update_days()
             # else:
             self.lsd = self._choose_lsd()
@@ -1,4 +1,4 @@
-import copy
+import hashlib
 import holoviews as hv
 import logging
 import panel
@@ -6,13 +6,17 @@ import param
 import numpy as np
 
 from holoviews.plotting.util import process_cmap
-from matplotlib import cm as matplotlib_cm
 
 from bondia.plot.heatmap import HeatMapPlot
+from bondia.util.cache import RenderCache, render_cache
 from bondia.util.exception import DataError
+from bondia.util.plotting import hv_quantized_image
 
 logger = logging.getLogger(__name__)
 
+# Minimum number of empty rows between cylinder separations in mosaic mode
+MOSAIC_SEPARATOR = 2
+
 
 class DelaySpectrumBase(HeatMapPlot):
     """
@@ -20,6 +24,11 @@ class DelaySpectrumBase(HeatMapPlot):
     ----------
     lsd : int
         Local stellar day.
+    helper_lines
+        Mark zero delay and N-S baseline. Default `True`.
+    mosaic
+        Show all cylinder separations in a single image (faster to render). Default
+        `False`.
     """
 
     # default value for colormap range
@@ -27,6 +36,11 @@ class DelaySpectrumBase(HeatMapPlot):
 
     # parameters
     helper_lines = param.Boolean(default=True)
+    mosaic = param.Boolean(default=False)
+
+    # axis names
+    axis_name_tau = "τ [nsec]"
+    axis_name_y = "y [m]"
 
     # Hide lsd, revision selectors by setting precedence < 0
     lsd = param.Selector(precedence=-1)
@@ -35,6 +49,7 @@ class DelaySpectrumBase(HeatMapPlot):
     def __init__(self, data, config, **params):
         self.data = data
         self.selections = None
+        self._mosaic_zeros = np.array([])
         self.__init_hook__(**params)
 
         # set default values
@@ -52,7 +67,9 @@ class DelaySpectrumBase(HeatMapPlot):
         "logarithmic_colorscale",
         "serverside_rendering",
         "colormap_range",
-        "helper_lines",
+        "colormap_auto",
+        "quantize_transfer",
+        "mosaic",
         "height",
     )
     def view(self):
@@ -65,76 +82,71 @@ class DelaySpectrumBase(HeatMapPlot):
                 f"Error: {str(err)}. Please report this problem."
             )
 
-        x, y = spectrum.index_map["baseline"].T
-
         # Index map for delay (x-axis)
         index_map_delay_nsec = spectrum.index_map["delay"] * 1e3
+        range_x = np.percentile(index_map_delay_nsec, [0, 100])
+
+        # Other sessions may have computed this already
+        generation = self.data.load_generation(self.revision, self.lsd, self._fname)
+        panels = render_cache.get(
+            render_cache.key(self, self._fname, generation),
+            lambda: self._cylinder_panels(spectrum),
+        )
+
+        # All panels share one color map range
+        if self.colormap_auto:
+            sketch = self.data.sketch(self.revision, self.lsd, self._fname)
+            if sketch is not None:
+                sketch = {
+                    "sketch": sketch["spectrum"],
+                    "percentiles": sketch["percentiles"],
+                }
+                clim = self.auto_colormap_range(sketch)
+            else:
+                clim = self.auto_colormap_range(
+                    data=np.concatenate([p[3].ravel() for p in panels] or [[]])
+                )
+        else:
+            clim = self.colormap_range
+
+        self.resolve_rendering((sum(p[3].size for p in panels),))
 
-        ux, uix = np.unique(np.round(x).astype(np.int), return_inverse=True)
+        if self.mosaic:
+            mosaic = render_cache.get(
+                render_cache.key(self, self._fname, generation, "mosaic"),
+                lambda: self._pack_mosaic(panels),
+            )
+            return self._mosaic_view(mosaic, index_map_delay_nsec, range_x, clim)
 
         # Fill a column with plots (one per pair of cylinders)
         imgs = {}
-        mplot = {}
         ylim = None
-        for pp, pux in reversed(list(enumerate(ux))):
-            # Get the baselines for this cylinder separation
-            this_cyl_sep = np.flatnonzero(uix == pp)
-
-            # Sort the indices by the N-S baseline distance
-            this_cyl_sep = this_cyl_sep[np.argsort(y[this_cyl_sep])]
-
-            # Determine span of data (y-axis)
-            range_y = np.percentile(y[this_cyl_sep], [0, 100])
-            range_x = np.percentile(index_map_delay_nsec, [0, 100])
-
-            # Discard baselines that are set to zero
-            this_cyl_sep = this_cyl_sep[
-                np.any(spectrum.spectrum[this_cyl_sep, :] > 0.0, axis=-1)
-            ]
-
-            # TODO: what do we do in this case?
-            # See https://github.com/chime-experiment/bondia/issues/23
-            if len(this_cyl_sep) == 0:
-                continue
-
-            # Index map for baseline (y-axis)
-            baseline_index = y[this_cyl_sep]
-
+        ux = sorted(p[0] for p in panels)
+        for pux, range_y, baseline_index, data in panels:
             # Plot for south-west baseline == 0 is done last. Keep the same y-axis range for it.
             if pux != 0 or ylim is None:
                 ylim_max = (range_y[0], range_y[-1])
             xlim = (range_x[0], range_x[-1])
             ylim = ylim_max
 
-            # axis names
-            axis_name_tau = "τ [nsec]"
-            axis_name_y = "y [m]"
-
             # Make image
             if self.transpose:
-                mplot[pp] = spectrum.spectrum[this_cyl_sep, :].T
+                data = data.T
                 index_x = baseline_index
                 index_y = index_map_delay_nsec
                 xlim, ylim = ylim, xlim
-                axis_names = [axis_name_y, axis_name_tau]
+                axis_names = [self.axis_name_y, self.axis_name_tau]
             else:
-                mplot[pp] = spectrum.spectrum[this_cyl_sep, :]
                 index_x = index_map_delay_nsec
                 index_y = baseline_index
-                axis_names = [axis_name_tau, axis_name_y]
+                axis_names = [self.axis_name_tau, self.axis_name_y]
 
             # holoviews checks for regular sampling before plotting an Image.
             # The CHIME baselines are not regularly sampled enough to pass through the default rtol
             # (1e-6), but we anyways want to plot the delay spectrum in an Image, not a QuadMesh.
-            img = hv.Image(
-                (index_x, index_y, mplot[pp]),
-                datatype=["image", "grid"],
-                kdims=axis_names,
-                rtol=2,
+            img = self._image(
+                index_x, index_y, data, clim, kdims=axis_names, rtol=2
             ).opts(
-                clim=self.colormap_range,
-                logz=self.logarithmic_colorscale,
-                cmap=process_cmap("inferno", provider="matplotlib"),
                 # Show colorbar only in rightmost plot (convert from numpy bool).
                 colorbar=bool(pux == ux[-1]),
                 # Show yaxis only in leftmost plot
@@ -144,39 +156,12 @@ class DelaySpectrumBase(HeatMapPlot):
                 ylim=ylim,
             )
 
-            if self.serverside_rendering is None:
-                if self.helper_lines:
-                    img = (img * hv.VLine(0) * hv.HLine(0)).opts(
-                        hv.opts.VLine(color="white", line_width=3, line_dash="dotted"),
-                        hv.opts.HLine(color="white", line_width=3, line_dash="dotted"),
-                    )
-            else:
-                # set colormap
-                cmap_inferno = copy.copy(matplotlib_cm.get_cmap("inferno"))
-                cmap_inferno.set_under("black")
-                cmap_inferno.set_bad("lightgray")
-
-                # Set z-axis normalization (other possible values are 'eq_hist', 'cbrt').
-                if self.logarithmic_colorscale:
-                    normalization = "log"
-                else:
-                    normalization = "linear"
-
-                # datashade/rasterize the image
-                img = self.serverside_rendering(
-                    img,
-                    cmap=cmap_inferno,
-                    precompute=True,
-                    x_range=xlim,
-                    y_range=ylim,
-                    normalization=normalization,
-                )
+            img = self.render(img, xlim, ylim)
 
-                if self.helper_lines:
-                    img = (img * hv.VLine(0) * hv.HLine(0)).opts(
-                        hv.opts.VLine(color="white", line_width=3, line_dash="dotted"),
-                        hv.opts.HLine(color="white", line_width=3, line_dash="dotted"),
-                    )
+            # Helper lines are toggled without rerunning the view
+            img = img * hv.DynamicMap(
+                self._helper_lines, streams=[self.stream("helper_lines")]
+            )
             img.opts(
                 # Fix height, but make width responsive
                 height=self.height,
@@ -191,6 +176,223 @@ class DelaySpectrumBase(HeatMapPlot):
         all_img = panel.Row(imgs, width_policy="max")
         return all_img
 
+    def _image(self, x, y, z, clim, **kwargs):
+        """Make an image, of color codes if `quantize_transfer` applies."""
+        if self._rendering is None and self.quantize_transfer:
+            return hv_quantized_image(
+                x, y, z, clim, log=self.logarithmic_colorscale, **kwargs
+            )
+        return hv.Image((x, y, z), datatype=["image", "grid"], **kwargs).opts(
+            clim=clim,
+            logz=self.logarithmic_colorscale,
+            cmap=process_cmap("inferno", provider="matplotlib"),
+        )
+
+    def _mosaic_view(self, mosaic, index_map_delay_nsec, range_x, clim):
+        """Show all cylinder separations in one image, see `_pack_mosaic`."""
+        data, ticks, titles, zeros = mosaic
+        if data.size == 0:
+            return panel.pane.Markdown("No baselines with data.")
+        self._mosaic_zeros = zeros
+
+        delay_lim = (range_x[0], range_x[-1])
+        column_lim = (-0.5, data.shape[0] - 0.5)
+        columns = np.arange(data.shape[0])
+        if self.transpose:
+            img = self._image(
+                columns,
+                index_map_delay_nsec,
+                data.T,
+                clim,
+                kdims=[self.axis_name_y, self.axis_name_tau],
+            )
+            xlim, ylim = column_lim, delay_lim
+            ticks = {"xticks": ticks}
+            titles = [hv.Text(c, delay_lim[1], t, valign="top") for c, t in titles]
+        else:
+            img = self._image(
+                index_map_delay_nsec,
+                columns,
+                data,
+                clim,
+                kdims=[self.axis_name_tau, self.axis_name_y],
+            )
+            xlim, ylim = delay_lim, column_lim
+            ticks = {"yticks": ticks}
+            titles = [hv.Text(delay_lim[0], c, t, halign="left") for c, t in titles]
+        img = img.opts(
+            colorbar=True,
+            xlim=xlim,
+            ylim=ylim,
+            **ticks,
+        )
+
+        img = self.render(img, xlim, ylim)
+
+        # Helper lines are toggled without rerunning the view
+        img = (
+            img
+            * hv.Overlay([t.opts(text_color="white") for t in titles])
+            * hv.DynamicMap(
+                self._mosaic_helper_lines, streams=[self.stream("helper_lines")]
+            )
+        )
+        img.opts(
+            # Fix height, but make width responsive
+            height=self.height,
+            responsive=True,
+            bgcolor="lightgray",
+        )
+        return panel.Row(img, width_policy="max")
+
+    def _mosaic_helper_lines(self, helper_lines):
+        """Lines at zero delay and baseline of each separation in the mosaic."""
+        opts = {
+            "color": "white",
+            "line_width": 3,
+            "line_dash": "dotted",
+            "alpha": 1 if helper_lines else 0,
+        }
+        if self.transpose:
+            lines = [hv.HLine(0)] + [hv.VLine(z) for z in self._mosaic_zeros]
+        else:
+            lines = [hv.VLine(0)] + [hv.HLine(z) for z in self._mosaic_zeros]
+        return hv.Overlay([line.opts(**opts) for line in lines])
+
+    @staticmethod
+    def _pack_mosaic(panels):
+        """
+        Pack the spectra of all cylinder separations into one array.
+
+        Separations are placed next to each other (smallest first), one row per N-S
+        baseline, with bands of NaN in between.
+
+        Parameters
+        ----------
+        panels : list
+            See `_cylinder_panels`.
+
+        Returns
+        -------
+        Tuple[np.ndarray, list, list, np.ndarray]
+            Spectra (row, delay), ticks (row, N-S baseline label), titles (centre row,
+            E-W separation label) and (fractional) rows of the zero N-S baselines.
+        """
+        panels = sorted(panels, key=lambda p: p[0])
+        nrows = sum(len(p[2]) for p in panels)
+        separator = max(MOSAIC_SEPARATOR, nrows // 50)
+        ndelay = panels[0][3].shape[1] if panels else 0
+        mosaic = np.full((nrows + separator * max(len(panels) - 1, 0), ndelay), np.nan)
+
+        ticks = []
+        titles = []
+        zeros = []
+        start = 0
+        for pux, _, y, data in panels:
+            end = start + len(y)
+            mosaic[start:end] = data
+            titles.append((0.5 * (start + end - 1), f"x = {pux} m"))
+            ticks.append((start, f"{y[0]:.0f}"))
+            if end - 1 > start:
+                ticks.append((end - 1, f"{y[-1]:.0f}"))
+            if y[0] <= 0 <= y[-1]:
+                zeros.append(start + np.interp(0, y, np.arange(len(y))))
+            start = end + separator
+        return mosaic, ticks, titles, np.array(zeros)
+
+    @staticmethod
+    def _helper_lines(helper_lines):
+        """Lines at zero delay and baseline (hidden if not selected)."""
+        opts = {
+            "color": "white",
+            "line_width": 3,
+            "line_dash": "dotted",
+            "alpha": 1 if helper_lines else 0,
+        }
+        return hv.VLine(0).opts(**opts) * hv.HLine(0).opts(**opts)
+
+    @staticmethod
+    def _cylinder_panels(spectrum):
+        """
+        Get the baselines and spectra of each cylinder separation.
+
+        Returns
+        -------
+        List[Tuple[int, np.ndarray, np.ndarray, np.ndarray]]
+            E-W separation, range of N-S baselines, N-S baselines with data (sorted) and
+            their spectra (baseline, delay) per cylinder separation, largest first.
+        """
+        layout = baseline_layout(spectrum.index_map["baseline"])
+
+        # Discard baselines that are set to zero
+        valid = np.any(spectrum.spectrum[:] > 0.0, axis=-1)
+
+        panels = []
+        for pux, range_y, y, index in layout:
+            this_cyl_sep = valid[index]
+
+            # TODO: what do we do in this case?
+            # See https://github.com/chime-experiment/bondia/issues/23
+            if not this_cyl_sep.any():
+                continue
+
+            panels.append(
+                (
+                    pux,
+                    range_y,
+                    y[this_cyl_sep],
+                    spectrum.spectrum[index[this_cyl_sep], :],
+                )
+            )
+        return panels
+
+
+def baseline_layout(baselines):
+    """
+    Group baselines by cylinder separation.
+
+    The layout is the same for all days and both delay spectrum products, so it's
+    cached by the content of the baseline index map.
+
+    Parameters
+    ----------
+    baselines : np.ndarray[:, 2]
+        E-W and N-S baseline distance in meters.
+
+    Returns
+    -------
+    List[Tuple[int, np.ndarray, np.ndarray, np.ndarray]]
+        E-W separation, range of N-S baselines, N-S baselines (sorted) and their indices
+        per cylinder separation, largest first.
+    """
+    baselines = np.ascontiguousarray(baselines)
+    digest = hashlib.sha1(baselines.tobytes()).hexdigest()
+    return _layouts.get(
+        (digest, baselines.shape, baselines.dtype.str),
+        lambda: _group_baselines(baselines),
+    )
+
+
+def _group_baselines(baselines):
+    x, y = baselines.T
+    ux, uix = np.unique(np.round(x).astype(int), return_inverse=True)
+
+    # Sort all baselines by cylinder separation, then N-S baseline distance
+    order = np.lexsort((y, uix))
+    bounds = np.searchsorted(uix[order], np.arange(len(ux) + 1))
+
+    layout = []
+    for pp in reversed(range(len(ux))):
+        index = order[bounds[pp] : bounds[pp + 1]]
+        layout.append(
+            (int(ux[pp]), np.array([y[index[0]], y[index[-1]]]), y[index], index)
+        )
+    return layout
+
+
+# Baseline layouts shared by all delay spectrum plots of this process
+_layouts = RenderCache(maxsize=8, max_age=float("inf"))
+
 
 class DelaySpectrumPlot(DelaySpectrumBase):
     def __init_hook__(self, **params):
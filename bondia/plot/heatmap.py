@@ -1,17 +1,98 @@
+import contextlib
+import copy
+import holoviews as hv
 import logging
 import numpy as np
 import panel
 import param
+import weakref
+import zlib
 
-from ch_util.ephemeris import csd_to_unix, unix_to_csd
+from concurrent.futures import ThreadPoolExecutor
+
+from ch_util.ephemeris import csd_to_unix
 from caput.config import Reader, Property
+from matplotlib import cm as matplotlib_cm
 
 from bondia.plot.base import BondiaPlot
-from bondia.util.flags import get_flags_cached, get_flags
+from bondia.util.cache import raster_cache
+from bondia.util.ephemeris import sun_times
+from bondia.util.flags import (
+    flag_index,
+    flag_index_mask,
+    get_flag_index_cached,
+    get_flags,
+)
+from bondia.util.rendering import RASTERIZE, RAW, rendering_strategy
+from bondia.util.sketch import sketch_range
 
 
 logger = logging.getLogger(__name__)
 
+# Loads data for full resolution plots in the background, see `HeatMapPlot.refine`
+_refine_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="refine")
+
+# Server-side rendered viewports are snapped outwards to tiles of this many pixels
+RASTER_TILE = 64
+
+
+def _snap_viewport(lim, pixels):
+    """
+    Snap an axis range to a grid of tiles, so that similar viewports render the same.
+
+    The resolution is rounded up to a power of two (pixels per data unit).
+
+    Returns
+    -------
+    lo, hi : float
+        Snapped range, containing `lim`.
+    pixels : int
+        Number of pixels to render for it.
+    """
+    lo, hi = sorted(lim)
+    if not hi > lo or not pixels:
+        return lo, hi, max(int(pixels or 1), 1)
+    resolution = 2.0 ** np.ceil(np.log2(pixels / (hi - lo)))
+    step = RASTER_TILE / resolution
+    lo = np.floor(lo / step) * step
+    hi = np.ceil(hi / step) * step
+    return float(lo), float(hi), int(round((hi - lo) * resolution))
+
+
+# Checksums of image data by id of the array, see `_fingerprint`
+_checksums = {}
+
+
+def _checksum(values):
+    """Checksum of an array, computed once while the array exists."""
+    key = id(values)
+    checksum = _checksums.get(key)
+    if checksum is None:
+        checksum = zlib.adler32(np.ascontiguousarray(values).reshape(-1).view(np.uint8))
+        _checksums[key] = checksum
+        # The id can get reused once the array is gone
+        weakref.finalize(values, _checksums.pop, key, None)
+    return checksum
+
+
+def _fingerprint(element):
+    """Identify the data and options of an image, see `HeatMapPlot.render`."""
+    if isinstance(element.data, np.ndarray):
+        # Panning passes the same element again: don't go over the data every time
+        values = element.data
+        checksum = _checksum(values)
+    else:
+        values = np.ascontiguousarray(element.dimension_values(2, flat=False))
+        checksum = zlib.adler32(values.reshape(-1).view(np.uint8))
+    return (
+        checksum,
+        values.shape,
+        values.dtype.str,
+        element.bounds.lbrt(),
+        tuple(d.name for d in element.kdims),
+        repr(sorted(element.opts.get().kwargs.items())),
+    )
+
 
 class HeatMapPlot(BondiaPlot, param.Parameterized):
     """
@@ -26,9 +107,18 @@ class HeatMapPlot(BondiaPlot, param.Parameterized):
     colormap_range
         (optional, if using datashader) Select limits of color map values (z-values). Default
         `None`.
+    colormap_auto
+        Pick the color map range automatically from robust percentiles of the data (see
+        `auto_percentiles`). Uses quantile sketches written by the preprocessing if
+        available. Default `False`.
     serverside_rendering
         True to use datashader. Automatically selects colormap for every zoom level, sends
-        pre-rendered images to client. Default `True`.
+        pre-rendered images to client. "auto" decides from the data size, plot size and
+        server load (see `bondia.util.rendering`). Default `rasterize`.
+    quantize_transfer
+        (if not using server-side rendering) Send color codes (uint8) mapped with the color
+        map range to the client, instead of the data. Hover tools then show the codes.
+        Default `False`.
     """
 
     # parameters
@@ -36,17 +126,38 @@ class HeatMapPlot(BondiaPlot, param.Parameterized):
     logarithmic_colorscale = param.Boolean(default=False)
     serverside_rendering = param.Selector()
     colormap_range = param.Range(constant=False)
+    colormap_auto = param.Boolean(default=False)
+    quantize_transfer = param.Boolean(default=False)
+
+    # Percentiles of the data used as color map range in auto mode
+    auto_percentiles = (1, 99)
+
+    # Width in pixels assumed for rendering until the plot reports its size
+    default_width = 1200
 
     def __init__(self, name: str, activated: bool = True, **params):
         BondiaPlot.__init__(self, name, activated)
         param.Parameterized.__init__(self, **params)
+        self._streams = {}
+        self._refine_future = None
+        self._refine_generation = 0
+        # Server-side rendering in use and the decision of the "auto" mode (if used)
+        self._rendering = None
+        self._decision = None
+        # Last width of the plot in pixels, see `plot_size`
+        self._plot_width = None
         self.colormap_range = self.zlim if hasattr(self, "zlim") else (-5, 5)
 
         # TODO: for some reason this has to be done before panel.serve
         # See https://discourse.holoviz.org/t/panel-serve-with-num-procs-breaks-if-importing-datashade/1353
         from holoviews.operation.datashader import datashade, rasterize
 
-        self.param["serverside_rendering"].objects = [None, rasterize, datashade]
+        self.param["serverside_rendering"].objects = [
+            None,
+            rasterize,
+            datashade,
+            "auto",
+        ]
         self.serverside_rendering = rasterize
 
     @param.depends("serverside_rendering", watch=True)
@@ -56,7 +167,292 @@ class HeatMapPlot(BondiaPlot, param.Parameterized):
         from holoviews.operation.datashader import datashade
 
         # Disable colormap range selection if using datashader (because it uses auto values)
-        self.param["colormap_range"].constant = self.serverside_rendering == datashade
+        self.param["colormap_range"].constant = (
+            self.serverside_rendering == datashade or self.colormap_auto
+        )
+
+    @param.depends("colormap_auto", watch=True)
+    def update_colormap_auto(self):
+        self.update_serverside_rendering()
+
+    def auto_colormap_range(self, sketch=None, data=None):
+        """
+        Get the color map range to use.
+
+        Parameters
+        ----------
+        sketch : Dict[str, np.ndarray]
+            `sketch` (one or more quantile sketches of the data shown) and `percentiles`
+            as written by the preprocessing.
+        data : np.ndarray
+            The data shown. Only used if no sketch is given.
+
+        Returns
+        -------
+        Tuple[float, float]
+            `colormap_range` unless `colormap_auto` is set and a range can be found.
+        """
+        if not self.colormap_auto:
+            return self.colormap_range
+        clim = None
+        if sketch is not None:
+            clim = sketch_range(
+                sketch["sketch"],
+                sketch["percentiles"],
+                self.auto_percentiles,
+                positive=self.logarithmic_colorscale,
+            )
+        if clim is None and data is not None:
+            logger.debug(f"No sketch for {self.name}, computing percentiles of data.")
+            data = np.asarray(data)
+            if self.logarithmic_colorscale:
+                data = data[data > 0]
+            else:
+                data = data[np.isfinite(data)]
+            if data.size:
+                clim = tuple(np.nanpercentile(data, self.auto_percentiles))
+        if clim is None or not clim[0] < clim[1]:
+            return self.colormap_range
+        return clim
+
+    def stream(self, *parameters):
+        """
+        Get a stream of parameter values of this plot.
+
+        Overlays driven by this stream get updated without calling `view`. There is only
+        one stream per set of parameters, so that views don't add watchers.
+
+        Parameters
+        ----------
+        parameters : str
+            Parameter names.
+
+        Returns
+        -------
+        hv.streams.Params
+        """
+        if parameters not in self._streams:
+            self._streams[parameters] = hv.streams.Params(self, list(parameters))
+        return self._streams[parameters]
+
+    def resolve_rendering(self, shape, pyramid: bool = False):
+        """
+        Pick the server-side rendering to use in this view.
+
+        Parameters
+        ----------
+        shape : Tuple[int, ...]
+            Shape of the data shown.
+        pyramid : bool
+            If the plot shows the data from a pyramid (see `bondia.util.pyramid`).
+
+        Returns
+        -------
+        The rendering operation, None for none.
+        """
+        if self.serverside_rendering != "auto":
+            self._decision = None
+            self._rendering = self.serverside_rendering
+            return self._rendering
+
+        from holoviews.operation.datashader import rasterize
+
+        width = self._plot_width or self.default_width
+        self._decision = rendering_strategy.choose(shape, (width, self.height), pyramid)
+        self._rendering = rasterize if self._decision == RASTERIZE else None
+        return self._rendering
+
+    def timed(self, shape):
+        """
+        Record the latency of the "auto" rendering decision, see `resolve_rendering`.
+
+        Only server-side rendering gets timed: raw data is drawn by the browser.
+        """
+        if self._decision in (None, RAW):
+            return contextlib.nullcontext()
+        return rendering_strategy.timed(self._decision, shape)
+
+    def plot_size(self, **params):
+        """
+        Get a stream of the size of the plot.
+
+        The width it reports is used by `resolve_rendering` when the view is rebuilt.
+        """
+        size = hv.streams.PlotSize(**params)
+        size.add_subscriber(self._update_plot_width)
+        return size
+
+    def _update_plot_width(self, width=None, **kwargs):
+        if width:
+            self._plot_width = width
+
+    def render(self, img, xlim, ylim, cmap="inferno", under="black", bad="lightgray"):
+        """
+        Apply the server-side rendering selected (if any) to an image.
+
+        Results are cached by data and viewport (snapped to a grid of tiles) in the
+        process-wide `raster_cache`, so that returning to a viewport or another session
+        looking at the same one doesn't aggregate the data again.
+
+        Parameters
+        ----------
+        img : hv.Image or hv.DynamicMap
+            The image.
+        xlim, ylim : Tuple[float, float]
+            Initial ranges of the axes.
+        cmap : str
+            Name of the matplotlib color map.
+        under, bad : str
+            Colors for values below the color map range and NaNs. Optional.
+
+        Returns
+        -------
+        The rendered image, or `img` (watched by `plot_size`) if there is no
+        server-side rendering (see `resolve_rendering`).
+        """
+        if self._rendering is None:
+            # Only watch the plot size
+            return img.apply(
+                lambda element, width, height, scale: element,
+                streams=[self.plot_size()],
+            )
+
+        # set colormap
+        colormap = copy.copy(matplotlib_cm.get_cmap(cmap))
+        if under is not None:
+            colormap.set_under(under)
+        if bad is not None:
+            colormap.set_bad(bad)
+
+        # Set z-axis normalization (other possible values are 'eq_hist', 'cbrt').
+        if self.logarithmic_colorscale:
+            normalization = "log"
+        else:
+            normalization = "linear"
+
+        # datashade/rasterize the image
+        operation = self._rendering.instance(
+            cmap=colormap,
+            precompute=True,
+            normalization=normalization,
+            dynamic=False,
+        )
+
+        def rendered(element, x_range, y_range, width, height, scale):
+            x_lo, x_hi, width = _snap_viewport(
+                x_range or xlim, (width or self.default_width) * scale
+            )
+            y_lo, y_hi, height = _snap_viewport(
+                y_range or ylim, (height or self.height) * scale
+            )
+
+            def compute():
+                return operation(
+                    element,
+                    x_range=(x_lo, x_hi),
+                    y_range=(y_lo, y_hi),
+                    width=width,
+                    height=height,
+                )
+
+            if not isinstance(element, hv.Image):
+                return compute()
+            fingerprint = _fingerprint(element)
+            key = (fingerprint, type(operation).__name__, normalization)
+            key += (cmap, under, bad, x_lo, x_hi, width, y_lo, y_hi, height)
+            # Shape of the image data
+            with self.timed(fingerprint[1]):
+                return raster_cache.get(key, compute).clone()
+
+        return img.apply(
+            rendered,
+            streams=[
+                hv.streams.RangeXY(x_range=xlim, y_range=ylim),
+                self.plot_size(),
+            ],
+        )
+
+    def refine(self, compute, show):
+        """
+        Run a slow computation in the background and show the result when done.
+
+        Only the latest refinement of a plot gets shown: starting a new one (or calling
+        `cancel_refine`) cancels the previous one if it didn't start yet and discards
+        its result otherwise.
+
+        Parameters
+        ----------
+        compute : Callable
+            Computes the result. Runs in another thread, so it shouldn't touch the plot.
+        show : Callable
+            Called with the result in the thread of the session.
+        """
+        self.cancel_refine()
+        generation = self._refine_generation
+        doc = panel.state.curdoc
+
+        def show_latest(result):
+            if generation == self._refine_generation:
+                show(result)
+
+        def done(future):
+            if future.cancelled() or generation != self._refine_generation:
+                return
+            try:
+                result = future.result()
+            except Exception:
+                logger.exception(f"Failure refining {self.name_} plot.")
+                return
+            if doc is None:
+                show_latest(result)
+            else:
+                doc.add_next_tick_callback(lambda: show_latest(result))
+
+        self._refine_future = _refine_executor.submit(compute)
+        self._refine_future.add_done_callback(done)
+
+    def cancel_refine(self):
+        """Cancel or discard the pending refinement, see `refine`."""
+        self._refine_generation += 1
+        if self._refine_future is not None:
+            self._refine_future.cancel()
+            self._refine_future = None
+
+    def update_day(self, revision: str, lsd):
+        """
+        Switch to another day.
+
+        The day and all selections depending on it are set in one batch, so that every
+        watcher (including the view) is called only once.
+
+        Parameters
+        ----------
+        revision : str
+            Revision
+        lsd : Day
+            Day
+        """
+        self.revision = revision
+        selections = {} if lsd is None else self.day_selections(revision, lsd)
+        self.param.update(lsd=lsd, **selections)
+
+    def day_selections(self, revision: str, lsd):
+        """
+        Update the selectors that depend on the day.
+
+        Parameters
+        ----------
+        revision : str
+            Revision
+        lsd : Day
+            Day
+
+        Returns
+        -------
+        dict
+            New values of the selectors.
+        """
+        return {}
 
     def make_selection(self, data, key):
         objects = list(data.index_map[key])
@@ -73,6 +469,8 @@ class RaHeatMapPlot(HeatMapPlot, param.Parameterized, Reader):
     _cache_reset_time = Property(
         proptype=int, key="flag_cache_reset_seconds", default=86400
     )
+    # File to persist the sun and moon events per day in (see `bondia.util.ephemeris`)
+    _ephemeris_path = Property(proptype=str, key="ephemeris_file")
 
     flag_mask = param.Boolean(default=True)
     flags = param.ListSelector(
@@ -121,17 +519,58 @@ class RaHeatMapPlot(HeatMapPlot, param.Parameterized, Reader):
         )
         return panel.Column(p)
 
+    def _day_time_spans(self, mark_day_time: bool, vertical: bool, ra_lim):
+        """
+        Get spans highlighting the day time.
+
+        There are always two spans (hidden ones where not needed), so that a
+        `DynamicMap` returning them keeps its structure.
+
+        Parameters
+        ----------
+        mark_day_time : bool
+            Show the spans.
+        vertical : bool
+            Use vertical spans (RA on the x-axis).
+        ra_lim : Tuple[float, float]
+            Limits of the RA axis.
+
+        Returns
+        -------
+        List[hv.VSpan or hv.HSpan]
+        """
+        # Highlight the day time data
+        opts = {
+            "color": "grey",
+            "alpha": 0.5,
+            "line_width": 1,
+            "line_color": "black",
+            "line_dash": "dashed",
+        }
+        hidden = dict(opts, alpha=0, line_width=0)
+        span = hv.VSpan if vertical else hv.HSpan
+        if not mark_day_time or self.lsd is None:
+            return [span(*ra_lim).opts(**hidden) for _ in range(2)]
+
+        # Calculate the sun rise/set times on this sidereal day
+        sun_rise, sun_set = sun_times(self.lsd.lsd, self._ephemeris_path)
+
+        if sun_rise < sun_set:
+            ranges = [(sun_rise, sun_set), None]
+        else:
+            ranges = [(ra_lim[0], sun_set), (sun_rise, ra_lim[-1])]
+        return [span(*(r or ra_lim)).opts(**(opts if r else hidden)) for r in ranges]
+
     def _flags_mask(self, index_map_ra):
         if self._cache_flags:
-            flag_time_spans = get_flags_cached(self.flags, self._cache_reset_time)
+            index = get_flag_index_cached(self.flags, self._cache_reset_time)
         else:
-            flag_time_spans = get_flags(
-                self.flags,
-                csd_to_unix(self.lsd.lsd),
-                csd_to_unix(self.lsd.lsd + 1),
+            index = flag_index(
+                get_flags(
+                    self.flags,
+                    csd_to_unix(self.lsd.lsd),
+                    csd_to_unix(self.lsd.lsd + 1),
+                )
             )
-        csd_arr = self.lsd.lsd + index_map_ra / 360.0
-        flag_mask = np.zeros_like(csd_arr, dtype=np.bool)
-        for type_, ca, cb in flag_time_spans:
-            flag_mask[(csd_arr > unix_to_csd(ca)) & (csd_arr < unix_to_csd(cb))] = True
-        return flag_mask[:, np.newaxis]
+        csd_arr = self.lsd.lsd + np.asarray(index_map_ra) / 360.0
+        return flag_index_mask(index, csd_arr)[:, np.newaxis]
@@ -1,4 +1,3 @@
-import copy
 import holoviews as hv
 import logging
 import numpy as np
@@ -8,15 +7,18 @@ import param
 import warnings
 
 from holoviews.plotting.util import process_cmap
-from matplotlib import cm as matplotlib_cm
 
 from caput.config import Reader, Property
 from ch_pipeline.core import containers as ccontainers
 from ch_util import tools
-from ch_util.ephemeris import csd_to_unix, unix_to_csd, skyfield_wrapper, chime
 
+from bondia.data import MEAN_POL, load_template
 from bondia.plot.heatmap import RaHeatMapPlot
+from bondia.util.ephemeris import moon_transit
+from bondia.util.cache import render_cache
 from bondia.util.exception import DataError
+from bondia.util.kernels import mask_plane, nanmedian_columns, subtract_plane
+from bondia.util.plotting import hv_quantized_image
 
 logger = logging.getLogger(__name__)
 
@@ -30,16 +32,21 @@ class RingMapPlot(RaHeatMapPlot, Reader):
     """
 
     # Display text for polarization option: mean of XX and YY
-    mean_pol_text = "Mean(XX, YY)"
+    mean_pol_text = MEAN_POL
 
     # Limits to display in ringmap heatmap
     xlim = (-1, 1)
     ylim = (0, 360)
+
+    # Approximate number of pixels along the longer axis of the preview image
+    preview_size = 256
     zlim = (-5, 5)
     zlim_intercyl = (-2, 2)
 
     # Config
     _stack_path = Property(proptype=str, key="stack")
+    # Stack preprocessed with `val_preprocess.py template` (preferred over `stack`)
+    _template_path = Property(proptype=str, key="template")
 
     # Parameters
     # Hide lsd, revision selectors by setting precedence < 0
@@ -59,6 +66,13 @@ class RingMapPlot(RaHeatMapPlot, Reader):
     def __init__(self, data, config, **params):
         self.data = data
         self.selections = None
+        # Last output of each view pipeline stage with the key it was computed for
+        self._stages = {}
+        self._buffers = {}
+        # Stream feeding the image, see `view` and `update_data`
+        self._pipe = None
+        self._data_shape = (0,)
+        self._message = panel.pane.Markdown("")
 
         RaHeatMapPlot.__init__(self, "Ringmap", activated=True, config=config, **params)
 
@@ -76,83 +90,62 @@ class RingMapPlot(RaHeatMapPlot, Reader):
         self.param.watch(self._changed_intercyl, "intercylinder_only", onlychanged=True)
 
     def _finalise_config(self):
-        if self._stack_path is None:
+        if self._template_path is not None:
+            if not os.path.isfile(self._template_path):
+                raise IOError(
+                    f"Ringmap template file not found in path {self._template_path}."
+                )
+        elif self._stack_path is None:
             logger.debug("No ringmap stack path supplied. Deactivating...")
             self.template_subtraction = False
             self.param["template_subtraction"].constant = True
         elif not os.path.isfile(self._stack_path):
             raise IOError(f"Ringmap stack file not found in path {self._stack_path}.")
 
-    # @param.depends("lsd", "revision", watch=True)
-    @param.depends("lsd", watch=True)
-    def update_freqs(self):
-        if self.lsd is None:
-            # Anyways make sure watchers are triggered
-            self.param.trigger("frequency")
-            return
+    def day_selections(self, revision, lsd):
+        """Get the available frequencies, beams and polarisations of a day."""
         try:
-            rm = self.data.load_file(self.revision, self.lsd, "ringmap")
+            rm = self.data.load_file(revision, lsd, "ringmap")
         except DataError as err:
-            logger.error(f"Unable to get available frequencies from file: {err}")
-            # Anyways make sure watchers are triggered
-            self.param.trigger("frequency")
-            return
-
-        freq = rm.index_map["freq"][0][0]
-
-        if freq != self.frequency:
-            self.param["frequency"].objects = [f[0] for f in rm.index_map["freq"]]
-            self.frequency = freq  # rm.index_map["freq"][0][0]
-        else:
-            # Trigger watchers also if value didn't change
-            self.param.trigger("frequency")
-
-    @param.depends("frequency", watch=True)
-    def update_beam(self):
-        if self.lsd is None:
-            # Anyways make sure watchers are triggered
-            self.param.trigger("beam")
-            return
-        try:
-            rm = self.data.load_file(self.revision, self.lsd, "ringmap")
-        except DataError as err:
-            logger.error(f"Unable to get available beams from file: {err}")
-            # Anyways make sure watchers are triggered
-            self.param.trigger("beam")
-            return
-
-        obj, beam = self.make_selection(rm, "beam")
-
-        if beam != self.beam:
-            self.param["beam"].objects, self.beam = obj, beam
-        else:
-            # Trigger watchers also if value didn't change
-            self.param.trigger("beam")
-
-    @param.depends("beam", watch=True)
-    def update_pol(self):
-        if self.lsd is None:
-            # Anyways make sure watchers are triggered
-            self.param.trigger("polarization")
-            return
-        try:
-            rm = self.data.load_file(self.revision, self.lsd, "ringmap")
-        except DataError as err:
-            logger.error(f"Unable to get available polarisations from file: {err}")
-            # Anyways make sure watchers are triggered
-            self.param.trigger("polarization")
-            return
-        objects, value = self.make_selection(rm, "pol")
-        if "XX" in objects and "YY" in objects:
-            objects.append(self.mean_pol_text)
-            value = self.mean_pol_text
-
-        if value != self.polarization:
-            self.param["polarization"].objects = objects
-            self.polarization = value
+            logger.error(f"Unable to get available selections from file: {err}")
+            return {}
+
+        self.param["frequency"].objects = [f[0] for f in rm.index_map["freq"]]
+        self.param["beam"].objects, beam = self.make_selection(rm, "beam")
+        pols, pol = self.make_selection(rm, "pol")
+        if "XX" in pols and "YY" in pols:
+            pols.append(self.mean_pol_text)
+            pol = self.mean_pol_text
+        self.param["polarization"].objects = pols
+        return {
+            "frequency": rm.index_map["freq"][0][0],
+            "beam": beam,
+            "polarization": pol,
+        }
+
+    def _sketch(self, name):
+        """Get the quantile sketch of the selected ringmap plane, or None."""
+        sketch = self.data.sketch(self.revision, self.lsd, name)
+        if sketch is None:
+            return None
+        sel_beam = np.flatnonzero(sketch["beam"] == self.beam)
+        sel_freq = np.flatnonzero(np.isclose(sketch["freq"], self.frequency))
+        if (
+            self.polarization not in sketch["pol"]
+            or len(sel_beam) == 0
+            or len(sel_freq) == 0
+        ):
+            return None
+        if self.crosstalk_removal:
+            dset = sketch["map_crosstalk_removed"]
         else:
-            # Trigger watchers also if value didn't change
-            self.param.trigger("polarization")
+            dset = sketch["map"]
+        return {
+            "sketch": dset[
+                sel_beam[0], sketch["pol"].index(self.polarization), sel_freq[0]
+            ],
+            "percentiles": sketch["percentiles"],
+        }
 
     @param.depends("weight_mask", watch=True)
     def update_weight_threshold_selection(self):
@@ -196,244 +189,434 @@ class RingMapPlot(RaHeatMapPlot, Reader):
 
                 self.colormap_range = self.zlim_intercyl
 
-    # No dependency on intercyl_only, because that changes the colormap range already which triggers view.
+    # No dependency on intercyl_only, because that changes the colormap range already which triggers this.
     @param.depends(
-        "transpose",
-        "logarithmic_colorscale",
-        "serverside_rendering",
-        "colormap_range",
+        "lsd",
+        "beam",
+        "frequency",
         "polarization",
-        "mark_day_time",
-        "mark_moon",
+        "colormap_range",
+        "colormap_auto",
         "crosstalk_removal",
         "template_subtraction",
         "weight_mask",
         "weight_mask_threshold",
         "flag_mask",
         "flags",
-        "height",
+        watch=True,
     )
-    def view(self):
+    def update_data(self):
+        """Send new data to the image shown (without rebuilding the figure)."""
+        # The view computes the data when (re)activated
+        if self._pipe is None or not self._panel_row_active:
+            return
+        self._send_data()
+
+    def _send_data(self):
+        if self.lsd is None or self.data.is_loaded(
+            self.revision, self.lsd, self._file_name()
+        ):
+            self.cancel_refine()
+            self._show_data(self._image_data())
+            return
+
+        # Show a coarse preview while loading the file in the background
+        name = self._file_name()
+        preview = self._preview_data(name)
+        if preview is not None:
+            self._show_data(preview, "Preview, loading full resolution...")
+
+        revision, lsd = self.revision, self.lsd
+
+        def load():
+            try:
+                self.data.load_file(revision, lsd, name)
+            except DataError:
+                # The error gets shown by `_image_data`
+                pass
+
+        self.refine(load, lambda _: self._show_data(self._image_data()))
+
+    def _show_data(self, data, message=""):
+        if isinstance(data, str):
+            self._message.object = data
+        else:
+            self._message.object = message
+            self._pipe.send(data)
+
+    def _file_name(self):
+        if self.intercylinder_only:
+            return "ringmap_intercyl"
+        return "ringmap"
+
+    def _preview_data(self, name):
+        """
+        Read a coarse image directly from the file (without loading it).
+
+        Only masks flagged (zero) data and removes crosstalk.
+
+        Returns
+        -------
+        dict or None
+            See `_image_data`. None if reading the preview failed.
+        """
+
+        def read(group):
+            rmap = group["map"]
+            step = max(1, max(rmap.shape[-2:]) // self.preview_size)
+            beams = list(group["index_map/beam"][:])
+            pols = [
+                p.decode() if isinstance(p, bytes) else p
+                for p in group["index_map/pol"][:]
+            ]
+            freqs = [f[0] for f in group["index_map/freq"][:]]
+            if self.polarization == self.mean_pol_text:
+                sel_pol = [pols.index("XX"), pols.index("YY")]
+            else:
+                sel_pol = [pols.index(self.polarization)]
+            sel_beam = beams.index(self.beam)
+            sel_freq = freqs.index(self.frequency)
+            planes = [
+                rmap[sel_beam, p, sel_freq, ::step, ::step].astype(np.float64)
+                for p in sel_pol
+            ]
+            for plane in planes:
+                plane[plane == 0] = np.nan
+            with warnings.catch_warnings():
+                warnings.filterwarnings("ignore", r"Mean of empty slice")
+                plane = np.nanmean(planes, axis=0)
+            # The full resolution image decides how to render
+            self._data_shape = rmap.shape[-2:]
+            return group["index_map/ra"][::step], group["index_map/el"][::step], plane
+
+        try:
+            index_map_ra, index_map_el, rmap = self.data.read_preview(
+                self.revision, self.lsd, name, read
+            )
+        except DataError as err:
+            logger.debug(f"No preview of {name} for {self.lsd}: {err}")
+            return None
+
+        if self.crosstalk_removal:
+            rmap = rmap - nanmedian_columns(rmap)
+
+        if self.colormap_auto and not self.template_subtraction:
+            clim = self.auto_colormap_range(self._sketch(name), rmap)
+        else:
+            clim = self.auto_colormap_range(data=rmap)
+
+        if self.transpose:
+            return {"x": index_map_ra, "y": index_map_el, "z": rmap.T, "clim": clim}
+        return {"x": index_map_el, "y": index_map_ra, "z": rmap, "clim": clim}
+
+    def _image_data(self):
+        """
+        Compute the data of the ringmap image.
+
+        Returns
+        -------
+        dict or str
+            Coordinates, values and color map range of the image, or an error message.
+        """
         if self.lsd is None:
-            return panel.pane.Markdown("No data selected.")
+            return "No data selected."
+        name = self._file_name()
         try:
-            if self.intercylinder_only:
-                name = "ringmap_intercyl"
-            else:
-                name = "ringmap"
             container = self.data.load_file(self.revision, self.lsd, name)
         except DataError as err:
-            return panel.pane.Markdown(
-                f"Error: {str(err)}. Please report this problem."
-            )
+            return f"Error: {str(err)}. Please report this problem."
 
         # Index map for ra (x-axis)
         index_map_ra = container.index_map["ra"]
-        axis_name_ra = "RA [degrees]"
 
         # Index map for sin(ZA)/sin(theta) (y-axis)
         index_map_el = container.index_map["el"]
-        axis_name_el = "sin(\u03B8)"
 
-        # Apply data selections
-        sel_beam = np.where(container.index_map["beam"] == self.beam)[0]
-        sel_freq = np.where(
-            [f[0] for f in container.index_map["freq"]] == self.frequency
-        )[0]
-        if self.polarization == self.mean_pol_text:
-            sel_pol = np.where(
-                (container.index_map["pol"] == "XX")
-                | (container.index_map["pol"] == "YY")
-            )[0]
-            rmap = np.squeeze(container.map[sel_beam, sel_pol, sel_freq])
-            rmap = np.nanmean(rmap, axis=0)
+        # Each stage is memoised on the parameters it depends on (and the stages before)
+        try:
+            rmap = self._cleaned_map(container, name)
+        except DataError as err:
+            return f"Error: {str(err)}. Please report this problem."
+        self._data_shape = rmap.shape
+
+        # The sketches don't know about the template
+        if self.colormap_auto and not self.template_subtraction:
+            clim = self.auto_colormap_range(self._sketch(name), rmap)
         else:
-            sel_pol = np.where(container.index_map["pol"] == self.polarization)[0]
-            rmap = np.squeeze(container.map[sel_beam, sel_pol, sel_freq])
+            clim = self.auto_colormap_range(data=rmap)
 
-        if self.flag_mask:
-            rmap = np.where(self._flags_mask(container.index_map["ra"]), np.nan, rmap)
+        if self.transpose:
+            return {"x": index_map_ra, "y": index_map_el, "z": rmap.T, "clim": clim}
+        return {"x": index_map_el, "y": index_map_ra, "z": rmap, "clim": clim}
 
-        if self.weight_mask:
-            try:
-                rms = np.squeeze(container.rms[sel_pol, sel_freq])
-            except IndexError:
-                logger.error(
-                    f"rms dataset of ringmap file for rev {self.revision} lsd "
-                    f"{self.lsd} is missing [{sel_pol}, {sel_freq}] (polarization, "
-                    f"frequency). rms has shape {container.rms.shape}"
-                )
-                self.weight_mask = False
-            else:
-                rmap = np.where(self._weights_mask(rms), np.nan, rmap)
+    def _image(self, data):
+        """Build the image from data sent by `update_data`."""
+        if self.transpose:
+            axis_names = ["RA [degrees]", "sin(\u03B8)"]
+            xlim, ylim = self.ylim, self.xlim
+        else:
+            axis_names = ["sin(\u03B8)", "RA [degrees]"]
+            xlim, ylim = self.xlim, self.ylim
+        if data is None:
+            data = {"x": xlim, "y": ylim, "z": np.full((2, 2), np.nan)}
+            data["clim"] = self.colormap_range
+
+        if self._rendering is None and self.quantize_transfer:
+            # Send color codes instead of the data to the client
+            img = hv_quantized_image(
+                data["x"],
+                data["y"],
+                data["z"],
+                data["clim"],
+                log=self.logarithmic_colorscale,
+                cmap="inferno",
+                kdims=axis_names,
+            )
+        else:
+            img = hv.Image(
+                (data["x"], data["y"], data["z"]),
+                datatype=["image", "grid"],
+                kdims=axis_names,
+            ).opts(
+                clim=data["clim"],
+                logz=self.logarithmic_colorscale,
+                cmap=process_cmap("inferno", provider="matplotlib"),
+            )
+        return img.opts(colorbar=True, xlim=xlim, ylim=ylim)
 
-        # Set flagged data to nan
-        rmap = np.where(rmap == 0, np.nan, rmap)
+    # Only parameters changing the structure of the figure rebuild it
+    @param.depends(
+        "transpose",
+        "logarithmic_colorscale",
+        "serverside_rendering",
+        "quantize_transfer",
+        "height",
+    )
+    def view(self):
+        # The image is persistent, new data gets pushed to it by `update_data`
+        self._pipe = hv.streams.Pipe(data=None)
+        self._send_data()
+        self.resolve_rendering(self._data_shape)
+        img = hv.DynamicMap(self._image, streams=[self._pipe])
 
-        if self.crosstalk_removal:
-            # The mean of an all-nan slice (masked?) is nan. We don't need a warning about that.
-            with warnings.catch_warnings():
-                warnings.filterwarnings("ignore", r"All-NaN slice encountered")
-                rmap -= np.nanmedian(rmap, axis=0)
+        if self.transpose:
+            xlim, ylim = self.ylim, self.xlim
+        else:
+            xlim, ylim = self.xlim, self.ylim
 
-        if self.template_subtraction:
-            try:
-                rm_stack = self.data.load_file_from_path(
-                    self._stack_path, ccontainers.RingMap
-                )
-            except DataError as err:
-                return panel.pane.Markdown(
-                    f"Error: {str(err)}. Please report this problem."
-                )
+        img = self.render(img, xlim, ylim)
 
-            # The stack file has all polarizations, so we can't reuse sel_pol
-            if self.polarization == self.mean_pol_text:
-                stack_sel_pol = np.where(
-                    (rm_stack.index_map["pol"] == "XX")
-                    | (rm_stack.index_map["pol"] == "YY")
-                )[0]
-            else:
-                stack_sel_pol = np.where(
-                    rm_stack.index_map["pol"] == self.polarization
-                )[0]
+        # Markers are updated without rerunning the view
+        img = img * hv.DynamicMap(
+            self._markers,
+            streams=[self.stream("lsd", "mark_moon", "mark_day_time")],
+        )
 
-            try:
-                rm_stack = np.squeeze(rm_stack.map[sel_beam, stack_sel_pol, sel_freq])
-            except IndexError as err:
-                logger.error(
-                    f"map dataset of ringmap stack file "
-                    f"is missing [{sel_beam}, {stack_sel_pol}, {sel_freq}] (beam, polarization, "
-                    f"frequency). map has shape {rm_stack.map.shape}:\n{err}"
-                )
-                self.template_subtraction = False
-            else:
-                if self.polarization == self.mean_pol_text:
-                    rm_stack = np.nanmean(rm_stack, axis=0)
+        img.opts(
+            # Fix height, but make width responsive
+            height=self.height,
+            responsive=True,
+            shared_axes=True,
+            bgcolor="lightgray",
+        )
 
-                # FIXME: this is a hack. remove when rinmap stack file fixed.
-                rmap -= rm_stack.reshape(rm_stack.shape[0], -1, 2).mean(axis=-1)
+        return panel.Column(
+            self._message, panel.Row(img, width_policy="max"), width_policy="max"
+        )
 
+    def _markers(self, lsd, mark_moon, mark_day_time):
+        """Overlay marking the moon transit and day time (hidden if not selected)."""
+        # Put a ring around the location of the moon if it transits on this day
+        moon = None if lsd is None else moon_transit(lsd.lsd, self._ephemeris_path)
+        lunar_ra, lunar_za = (0, 0) if moon is None else moon
         if self.transpose:
-            rmap = rmap.T
-            index_x = index_map_ra
-            index_y = index_map_el
-            axis_names = [axis_name_ra, axis_name_el]
-            xlim, ylim = self.ylim, self.xlim
+            ellipse = hv.Ellipse(lunar_ra, lunar_za, (5.5, 0.15))
         else:
-            index_x = index_map_el
-            index_y = index_map_ra
-            axis_names = [axis_name_el, axis_name_ra]
-            xlim, ylim = self.xlim, self.ylim
+            ellipse = hv.Ellipse(lunar_za, lunar_ra, (0.04, 21))
+        ellipse = ellipse.opts(alpha=1 if mark_moon and moon is not None else 0)
 
-        img = hv.Image(
-            (index_x, index_y, rmap),
-            datatype=["image", "grid"],
-            kdims=axis_names,
-        ).opts(
-            clim=self.colormap_range,
-            logz=self.logarithmic_colorscale,
-            cmap=process_cmap("inferno", provider="matplotlib"),
-            colorbar=True,
-            xlim=xlim,
-            ylim=ylim,
+        spans = self._day_time_spans(
+            mark_day_time and lsd is not None, self.transpose, self.ylim
+        )
+        return hv.Overlay([ellipse] + spans)
+
+    def _memo(self, stage, key, compute):
+        """
+        Get the output of a view pipeline stage, recomputing it only if its key changed.
+
+        Only the last output of each stage is kept. Outputs must not be modified in place.
+        """
+        cached = self._stages.get(stage)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        value = compute()
+        self._stages[stage] = (key, value)
+        return value
+
+    def _buffer(self, stage, shape, dtype):
+        """Get the reusable output array of a view pipeline stage."""
+        buffer = self._buffers.get(stage)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = np.empty(shape, dtype=dtype)
+            self._buffers[stage] = buffer
+        return buffer
+
+    def _selection_key(self, name):
+        return (
+            self.data.load_generation(self.revision, self.lsd, name),
+            self.revision,
+            self.lsd.lsd,
+            name,
+            self.beam,
+            self.polarization,
+            self.frequency,
         )
 
-        if self.serverside_rendering is not None:
-            # set colormap
-            cmap_inferno = copy.copy(matplotlib_cm.get_cmap("inferno"))
-            cmap_inferno.set_under("black")
-            cmap_inferno.set_bad("lightgray")
+    def _selected_map(self, container, name):
+        """Select the plane of the ringmap to show."""
 
-            # Set z-axis normalization (other possible values are 'eq_hist', 'cbrt').
-            if self.logarithmic_colorscale:
-                normalization = "log"
+        def compute():
+            # Select beam and frequency by integer index, so that only the selected plane
+            # gets read if the file is loaded lazily (h5py supports only one index array).
+            freqs = np.array([f[0] for f in container.index_map["freq"]])
+            pols = container.index_map["pol"]
+            if self.polarization == self.mean_pol_text:
+                sel_pol = np.flatnonzero((pols == "XX") | (pols == "YY"))
             else:
-                normalization = "linear"
-
-            # datashade/rasterize the image
-            img = self.serverside_rendering(
-                img,
-                cmap=cmap_inferno,
-                precompute=True,
-                x_range=xlim,
-                y_range=ylim,
-                normalization=normalization,
-            )
-
-        if self.mark_moon:
-            # Put a ring around the location of the moon if it transits on this day
-            eph = skyfield_wrapper.ephemeris
+                sel_pol = np.flatnonzero(pols == self.polarization)
+            sel_beam = np.flatnonzero(container.index_map["beam"] == self.beam)
+            sel_freq = np.flatnonzero(np.isclose(freqs, self.frequency))
+            if len(sel_beam) == 0 or len(sel_pol) == 0 or len(sel_freq) == 0:
+                raise DataError(
+                    f"{name} file for {self.revision}, {self.lsd} has no data for beam "
+                    f"{self.beam}, polarisation {self.polarization}, frequency "
+                    f"{self.frequency}"
+                )
+            sel_beam, sel_freq = sel_beam[0], sel_freq[0]
+            rmap = np.squeeze(container.map[sel_beam, sel_pol, sel_freq])
+            if self.polarization == self.mean_pol_text:
+                rmap = np.nanmean(rmap, axis=0)
+            return rmap, sel_beam, sel_pol, sel_freq
+
+        return self._memo("selected", self._selection_key(name), compute)
+
+    def _masked_map(self, container, name):
+        """Mask flagged data and data with low weights (by setting it to NaN)."""
+        key = self._selection_key(name) + (
+            self.flag_mask,
+            tuple(self.flags),
+            self.weight_mask,
+            self.weight_mask_threshold,
+        )
 
-            # Start and end times of the CSD
-            st = csd_to_unix(self.lsd.lsd)
-            et = csd_to_unix(self.lsd.lsd + 1)
+        def compute():
+            rmap, sel_beam, sel_pol, sel_freq = self._selected_map(container, name)
+
+            row_mask = np.zeros(rmap.shape[0], dtype=bool)
+            if self.flag_mask:
+                row_mask |= self._flags_mask(container.index_map["ra"])[:, 0]
+
+            if self.weight_mask:
+                try:
+                    rms = np.squeeze(container.rms[sel_pol, sel_freq])
+                except IndexError:
+                    logger.error(
+                        f"rms dataset of ringmap file for rev {self.revision} lsd "
+                        f"{self.lsd} is missing [{sel_pol}, {sel_freq}] (polarization, "
+                        f"frequency). rms has shape {container.rms.shape}"
+                    )
+                    self.weight_mask = False
+                else:
+                    row_mask |= self._weights_mask(rms)[:, 0]
 
-            moon_time, moon_dec = chime.transit_times(
-                eph["moon"], st, et, return_dec=True
+            # Set masked and flagged data to nan in one pass. The output buffer is reused:
+            # only the next stage reads it, and that one always makes a new array.
+            out = self._buffer(
+                "masked", rmap.shape, np.result_type(rmap.dtype, np.float32)
             )
+            return mask_plane(rmap, row_mask, out)
+
+        return self._memo("masked", key, compute)
+
+    def _cleaned_map(self, container, name):
+        """Remove crosstalk and subtract the template."""
+        key = self._selection_key(name) + (
+            self.flag_mask,
+            tuple(self.flags),
+            self.weight_mask,
+            self.weight_mask_threshold,
+            self.crosstalk_removal,
+            self.template_subtraction,
+        )
 
-            if len(moon_time):
-                lunar_transit = unix_to_csd(moon_time[0])
-                lunar_dec = moon_dec[0]
-                lunar_ra = (lunar_transit % 1) * 360.0
-                lunar_za = np.sin(np.radians(lunar_dec - 49.0))
-                if self.transpose:
-                    img *= hv.Ellipse(lunar_ra, lunar_za, (5.5, 0.15))
-                else:
-                    img *= hv.Ellipse(lunar_za, lunar_ra, (0.04, 21))
+        def compute():
+            rmap = self._masked_map(container, name)
+            column_offset = np.zeros(0, dtype=rmap.dtype)
+            template = np.zeros((0, 0), dtype=rmap.dtype)
 
-        if self.mark_day_time:
-            # Calculate the sun rise/set times on this sidereal day
+            if self.crosstalk_removal:
+                # The median of an all-nan slice (masked?) is nan.
+                column_offset = nanmedian_columns(rmap)
 
-            # Start and end times of the CSD
-            start_time = csd_to_unix(self.lsd.lsd)
-            end_time = csd_to_unix(self.lsd.lsd + 1)
+            if self.template_subtraction and self._template_path is not None:
+                template = load_template(
+                    self._template_path, self.beam, self.polarization, self.frequency
+                )
+            elif self.template_subtraction:
+                template = self._stack_plane(container, name)
+            if template.shape != rmap.shape and template.size:
+                logger.error(
+                    f"Ringmap template has shape {template.shape}, but ringmap for rev "
+                    f"{self.revision} lsd {self.lsd} has shape {rmap.shape}."
+                )
+                self.template_subtraction = False
+                template = np.zeros((0, 0), dtype=rmap.dtype)
 
-            times, rises = chime.rise_set_times(
-                skyfield_wrapper.ephemeris["sun"],
-                start_time,
-                end_time,
-                diameter=-10,
+            # Subtract both in one pass into a new array (the plot keeps it)
+            rmap = subtract_plane(rmap, column_offset, template, np.empty_like(rmap))
+
+            # Options switched off for lack of data apply to every session
+            return rmap, self.weight_mask, self.template_subtraction
+
+        def shared():
+            # Other sessions may have computed this already
+            rmap, self.weight_mask, self.template_subtraction = render_cache.get(
+                render_cache.key(self, *key, self._template_path, self._stack_path),
+                compute,
             )
-            sun_rise = 0
-            sun_set = 0
-            for t, r in zip(times, rises):
-                if r:
-                    sun_rise = (unix_to_csd(t) % 1) * 360
-                else:
-                    sun_set = (unix_to_csd(t) % 1) * 360
-
-            # Highlight the day time data
-            opts = {
-                "color": "grey",
-                "alpha": 0.5,
-                "line_width": 1,
-                "line_color": "black",
-                "line_dash": "dashed",
-            }
-            if self.transpose:
-                if sun_rise < sun_set:
-                    img *= hv.VSpan(sun_rise, sun_set).opts(**opts)
-                else:
-                    img *= hv.VSpan(self.ylim[0], sun_set).opts(**opts)
-                    img *= hv.VSpan(sun_rise, self.ylim[1]).opts(**opts)
+            return rmap
 
-            else:
-                if sun_rise < sun_set:
-                    img *= hv.HSpan(sun_rise, sun_set).opts(**opts)
-                else:
-                    img *= hv.HSpan(self.ylim[0], sun_set).opts(**opts)
-                    img *= hv.HSpan(sun_rise, self.ylim[1]).opts(**opts)
+        return self._memo("cleaned", key, shared)
 
-        img.opts(
-            # Fix height, but make width responsive
-            height=self.height,
-            responsive=True,
-            shared_axes=True,
-            bgcolor="lightgray",
-        )
+    def _stack_plane(self, container, name):
+        """Get the plane of the (not preprocessed) ringmap stack to subtract."""
+        _, sel_beam, _, sel_freq = self._selected_map(container, name)
+        rm_stack = self.data.load_file_from_path(self._stack_path, ccontainers.RingMap)
+
+        # The stack file has all polarizations, so we can't reuse sel_pol
+        if self.polarization == self.mean_pol_text:
+            stack_sel_pol = np.where(
+                (rm_stack.index_map["pol"] == "XX")
+                | (rm_stack.index_map["pol"] == "YY")
+            )[0]
+        else:
+            stack_sel_pol = np.where(rm_stack.index_map["pol"] == self.polarization)[0]
+
+        try:
+            rm_stack = np.squeeze(rm_stack.map[sel_beam, stack_sel_pol, sel_freq])
+        except IndexError as err:
+            logger.error(
+                f"map dataset of ringmap stack file "
+                f"is missing [{sel_beam}, {stack_sel_pol}, {sel_freq}] (beam, polarization, "
+                f"frequency). map has shape {rm_stack.map.shape}:\n{err}"
+            )
+            self.template_subtraction = False
+            return np.zeros((0, 0))
+        if self.polarization == self.mean_pol_text:
+            rm_stack = np.nanmean(rm_stack, axis=0)
 
-        return panel.Row(img, width_policy="max")
+        # FIXME: this is a hack. remove when rinmap stack file fixed.
+        return rm_stack.reshape(rm_stack.shape[0], -1, 2).mean(axis=-1)
 
     def _weights_mask(self, rms):
         if self.polarization == self.mean_pol_text:
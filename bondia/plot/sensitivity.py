@@ -1,4 +1,3 @@
-import copy
 import holoviews as hv
 import logging
 import numpy as np
@@ -6,15 +5,18 @@ import panel
 import param
 
 from holoviews.plotting.util import process_cmap
-from matplotlib import cm as matplotlib_cm
 
 from caput.config import Reader, Property
 from ch_pipeline.core.containers import RFIMask
-from ch_util.ephemeris import chime, csd, skyfield_wrapper, csd_to_unix, unix_to_csd
+from ch_util.ephemeris import csd
 
+from bondia.data import MEAN_POL
 from bondia.plot.heatmap import RaHeatMapPlot
+from bondia.util.cache import render_cache
 from bondia.util.exception import DataError
-from bondia.util.plotting import hv_image_with_gaps
+from bondia.util.kernels import mask_sensitivity
+from bondia.util.plotting import hv_quantized_image, pad_gaps
+from bondia.util.pyramid import Pyramid
 
 logger = logging.getLogger(__name__)
 
@@ -28,7 +30,7 @@ class SensitivityPlot(RaHeatMapPlot, Reader):
     """
 
     # Display text for polarization option: mean of XX and YY
-    mean_pol_text = "Mean(XX, YY)"
+    mean_pol_text = MEAN_POL
 
     # Limits to display in ringmap heatmap
     ylim = (400, 800)
@@ -78,35 +80,105 @@ class SensitivityPlot(RaHeatMapPlot, Reader):
                     self.param.trigger("colormap_range")
                 self.colormap_range = self.zlim_estimate
 
-    # @param.depends("lsd", "revision", watch=True)
-    @param.depends("lsd", watch=True)
-    def update_pol(self):
-        if self.lsd is None:
-            return
+    def day_selections(self, revision, lsd):
+        """Get the available polarisations of a day."""
         try:
-            rm = self.data.load_file(self.revision, self.lsd, "sensitivity")
+            rm = self.data.load_file(revision, lsd, "sensitivity")
         except DataError as err:
             logger.error(f"Unable to get available polarisations from file: {err}")
-            return
+            return {}
         objects, value = self.make_selection(rm, "pol")
         if "XX" in objects and "YY" in objects:
             objects.append(self.mean_pol_text)
             value = self.mean_pol_text
+        self.param["polarization"].objects = objects
+        return {"polarization": value}
+
+    def _masked_sensitivity(self, sens_container, rfi_container, index_map_ra):
+        """
+        Select the polarisation, apply masks and divide by the estimate if requested.
+
+        Returns
+        -------
+        sens : np.ndarray
+            Sensitivity (frequency, time).
+        rfi_percentage : int or None
+            Percentage of data masked as RFI.
+        """
+        # Apply data selections
+        if self.polarization == self.mean_pol_text:
+            sel_pol = np.where(
+                (sens_container.index_map["pol"] == "XX")
+                | (sens_container.index_map["pol"] == "YY")
+            )[0]
+            sens = np.squeeze(sens_container.measured[:, sel_pol])
+            sens = np.squeeze(np.nanmean(sens, axis=1))
+        else:
+            sel_pol = np.where(sens_container.index_map["pol"] == self.polarization)[0]
+            sens = np.squeeze(sens_container.measured[:, sel_pol])
 
-        if value != self.polarization:
-            self.param["polarization"].objects = objects
-            self.polarization = value
+        if self.flag_mask:
+            time_mask = self._flags_mask(index_map_ra)[:, 0]
         else:
-            self.param.trigger("polarization")
+            time_mask = np.zeros(sens.shape[-1], dtype=bool)
+
+        rfi = np.zeros((0, 0), dtype=bool)
+        rfi_percentage = None
+        if rfi_container is not None:
+            rfi = np.squeeze(rfi_container.mask[:])
+
+            # This is expected to be either ch_pipeline.core.containers RFIMask or
+            # draco.core.containers.RFIMask. The first is true for data free of RFI,
+            # the second is true for data affected by RFI.
+            if isinstance(rfi_container, RFIMask):
+                logger.debug(
+                    f"Inverting rfi mask, because container is a {type(rfi_container)}."
+                )
+                rfi = ~rfi
+
+            # calculate percentage masked to print later
+            rfi_percentage = round(np.count_nonzero(rfi) / rfi.size * 100)
+            rfi = np.broadcast_to(rfi, sens.shape)
+
+        estimate = np.zeros((0, 0), dtype=sens.dtype)
+        if self.divide_by_estimate:
+            estimate = np.squeeze(sens_container.radiometer[:, sel_pol])
+            if self.polarization == self.mean_pol_text:
+                estimate = np.squeeze(np.nanmean(estimate, axis=1))
+
+        # Mask flags, flagged (zero) data and RFI and divide by the estimate in one pass
+        sens = mask_sensitivity(
+            sens,
+            time_mask,
+            rfi,
+            estimate,
+            np.empty(sens.shape, dtype=np.result_type(sens.dtype, np.float32)),
+        )
+        return sens, rfi_percentage
+
+    def _sketch(self):
+        """Get the quantile sketch of the selected polarisation, or None."""
+        sketch = self.data.sketch(self.revision, self.lsd, "sensitivity")
+        if sketch is None or self.polarization not in sketch["pol"]:
+            return None
+        if self.divide_by_estimate:
+            dset = sketch["measured_over_radiometer"]
+        else:
+            dset = sketch["measured"]
+        return {
+            "sketch": dset[sketch["pol"].index(self.polarization)],
+            "percentiles": sketch["percentiles"],
+        }
 
     @param.depends(
-        # "lsd",
+        "lsd",
         "transpose",
         "logarithmic_colorscale",
         "serverside_rendering",
+        "quantize_transfer",
         "colormap_range",
+        "colormap_auto",
         "polarization",
-        "mark_day_time",
         "mask_rfi",
         "flag_mask",
         "flags",
@@ -131,24 +203,7 @@ class SensitivityPlot(RaHeatMapPlot, Reader):
         index_map_f = np.linspace(800.0, 400.0, 1024, endpoint=False)
         axis_name_f = "Frequency [MHz]"
 
-        # Apply data selections
-        if self.polarization == self.mean_pol_text:
-            sel_pol = np.where(
-                (sens_container.index_map["pol"] == "XX")
-                | (sens_container.index_map["pol"] == "YY")
-            )[0]
-            sens = np.squeeze(sens_container.measured[:, sel_pol])
-            sens = np.squeeze(np.nanmean(sens, axis=1))
-        else:
-            sel_pol = np.where(sens_container.index_map["pol"] == self.polarization)[0]
-            sens = np.squeeze(sens_container.measured[:, sel_pol])
-
-        if self.flag_mask:
-            sens = np.where(self._flags_mask(index_map_ra).T, np.nan, sens)
-
-        # Set flagged data to nan
-        sens = np.where(sens == 0, np.nan, sens)
-
+        rfi_container = None
         if self.mask_rfi:
             try:
                 rfi_container = self.data.load_file(self.revision, self.lsd, "rfi")
@@ -156,28 +211,31 @@ class SensitivityPlot(RaHeatMapPlot, Reader):
                 return panel.pane.Markdown(
                     f"Error: {str(err)}. Please report this problem."
                 )
-            rfi = np.squeeze(rfi_container.mask[:])
-
-            # This is expected to be either ch_pipeline.core.containers RFIMask or
-            # draco.core.containers.RFIMask. The first is true for data free of RFI,
-            # the second is true for data affected by RFI.
-            if isinstance(rfi_container, RFIMask):
-                logger.debug(
-                    f"Inverting rfi mask, because container is a {type(rfi_container)}."
-                )
-                rfi = ~rfi
 
-            # calculate percentage masked to print later
-            rfi_percentage = round(np.count_nonzero(rfi) / rfi.size * 100)
-
-            sens *= np.where(rfi, np.nan, 1)
+        # Other sessions may have computed this already
+        key = render_cache.key(
+            self,
+            self.data.load_generation(self.revision, self.lsd, "sensitivity"),
+            self.data.load_generation(self.revision, self.lsd, "rfi")
+            if self.mask_rfi
+            else None,
+            self.polarization,
+            self.flag_mask,
+            self.flags,
+            self.mask_rfi,
+            self.divide_by_estimate,
+        )
+        sens, rfi_percentage = render_cache.get(
+            key,
+            lambda: self._masked_sensitivity(
+                sens_container, rfi_container, index_map_ra
+            ),
+        )
 
-        if self.divide_by_estimate:
-            estimate = np.squeeze(sens_container.radiometer[:, sel_pol])
-            if self.polarization == self.mean_pol_text:
-                estimate = np.squeeze(np.nanmean(estimate, axis=1))
-            estimate = np.where(estimate == 0, np.nan, estimate)
-            sens = sens / estimate
+        if self.colormap_auto:
+            clim = self.auto_colormap_range(self._sketch(), sens)
+        else:
+            clim = self.colormap_range
 
         if self.transpose:
             sens = sens.T
@@ -192,9 +250,6 @@ class SensitivityPlot(RaHeatMapPlot, Reader):
             xlim, ylim = self.xlim, self.ylim
 
         image_opts = {
-            "clim": self.colormap_range,
-            "logz": self.logarithmic_colorscale,
-            "cmap": process_cmap("viridis", provider="matplotlib"),
             "colorbar": True,
             "xticks": [0, 60, 120, 180, 240, 300, 360],
         }
@@ -206,68 +261,61 @@ class SensitivityPlot(RaHeatMapPlot, Reader):
             "ylim": ylim,
         }
 
-        # Fill in missing data
-        img = hv_image_with_gaps(
-            index_x, index_y, sens, opts=image_opts, kdims=axis_names
-        ).opts(**overlay_opts)
-
-        if self.serverside_rendering is not None:
-            # set colormap
-            cmap_inferno = copy.copy(matplotlib_cm.get_cmap("viridis"))
-
-            # Set z-axis normalization (other possible values are 'eq_hist', 'cbrt').
-            if self.logarithmic_colorscale:
-                normalization = "log"
-            else:
-                normalization = "linear"
-
-            # datashade/rasterize the image
-            img = self.serverside_rendering(
-                img,
-                cmap=cmap_inferno,
-                precompute=True,
-                x_range=xlim,
-                y_range=ylim,
-                normalization=normalization,
-                # TODO: set xticks like above
-            )
+        # Fill in missing data and downsample when needed (once for all sessions)
+        pyramid = render_cache.get(
+            key + (self.transpose, "pyramid"),
+            lambda: Pyramid(*pad_gaps(index_x, index_y, sens)),
+        )
 
-        if self.mark_day_time:
-            # Calculate the sun rise/set times on this sidereal day
+        def image(x_range, y_range, width, height, scale):
+            with self.timed(sens.shape):
+                # Full resolution only if zoomed in far enough to see it
+                x, y, z = pyramid.select(
+                    x_range,
+                    y_range,
+                    (width or self.default_width) * scale,
+                    (height or self.height) * scale,
+                )
+                if self._rendering is None and self.quantize_transfer:
+                    # Send color codes instead of the data to the client
+                    img = hv_quantized_image(
+                        x,
+                        y,
+                        z,
+                        clim,
+                        log=self.logarithmic_colorscale,
+                        cmap="viridis",
+                        bad_color="transparent",
+                        kdims=axis_names,
+                    )
+                else:
+                    img = hv.Image(
+                        (x, y, z), datatype=["image", "grid"], kdims=axis_names
+                    ).opts(
+                        clim=clim,
+                        logz=self.logarithmic_colorscale,
+                        cmap=process_cmap("viridis", provider="matplotlib"),
+                    )
+                return img.opts(**image_opts)
+
+        self.resolve_rendering(sens.shape, pyramid=True)
+        img = hv.DynamicMap(
+            image,
+            streams=[
+                hv.streams.RangeXY(x_range=xlim, y_range=ylim),
+                hv.streams.PlotSize(scale=1.0),
+            ],
+        ).opts(**overlay_opts)
 
-            # Start and end times of the CSD
-            start_time = csd_to_unix(self.lsd.lsd)
-            end_time = csd_to_unix(self.lsd.lsd + 1)
+        img = self.render(img, xlim, ylim, cmap="viridis", under=None, bad=None)
 
-            times, rises = chime.rise_set_times(
-                skyfield_wrapper.ephemeris["sun"],
-                start_time,
-                end_time,
-                diameter=-10,
-            )
-            sun_rise = 0
-            sun_set = 0
-            for t, r in zip(times, rises):
-                if r:
-                    sun_rise = (unix_to_csd(t) % 1) * 360
-                else:
-                    sun_set = (unix_to_csd(t) % 1) * 360
-
-            # Highlight the day time data
-            opts = {
-                "color": "grey",
-                "alpha": 0.5,
-                "line_width": 1,
-                "line_color": "black",
-                "line_dash": "dashed",
-            }
-
-            span = hv.HSpan if self.transpose else hv.VSpan
-            if sun_rise < sun_set:
-                img *= span(sun_rise, sun_set).opts(**opts)
-            else:
-                img *= span(self.xlim[0], sun_set).opts(**opts)
-                img *= span(sun_rise, self.xlim[-1]).opts(**opts)
+        # Day time is highlighted without rerunning the view
+        img = img * hv.DynamicMap(
+            lambda mark_day_time: hv.Overlay(
+                self._day_time_spans(mark_day_time, not self.transpose, self.xlim)
+            ),
+            streams=[self.stream("mark_day_time")],
+        )
 
         img.opts(
             # Fix height, but make width responsive
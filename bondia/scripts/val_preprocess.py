@@ -1,38 +1,187 @@
 import click
+import h5py
+import json
 import logging
+import numpy as np
 import sys
+import tempfile
+import time
 
 from pathlib import Path
 
+from caput import fileformats
 from ch_pipeline.core import containers as ccontainers
 from draco.core import containers
 
+from bondia.data import BUNDLE_FILE_NAME, MEAN_POL, write_ready_marker
+from bondia.util import ephemeris as ephemeris_table
+from bondia.util import sketch, summary
+from bondia.util.files import atomic_output
+
 in_dir = "/project/rpp-chime/chime/chime_processed/daily"
 out_dir = "/project/rpp-chime/chime/chime_processed/validation_preprocess"
+shard_dir = Path(out_dir) / "shards"
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+# Data selections applied to the daily products
+RINGMAP_FREQS = slice(399, 746, 345)
+RINGMAP_POLS = slice(0, 4, 3)
+SENSITIVITY_POLS = slice(0, 3, 2)
+
+# Products to preprocess: input file glob, output file name and data selections.
+PRODUCTS = {
+    "ringmap": {
+        "file_name": "ringmap_lsd_*.*",
+        "file_out_name": "ringmap_validation_freqs_lsd",
+        "selections": {"freq_sel": RINGMAP_FREQS, "pol_sel": RINGMAP_POLS},
+    },
+    "ringmap_intercyl": {
+        "file_name": "ringmap_intercyl_lsd_*.*",
+        "file_out_name": "ringmap_intercyl_validation_freqs_lsd",
+        "selections": {"freq_sel": RINGMAP_FREQS, "pol_sel": RINGMAP_POLS},
+    },
+    "sensitivity": {
+        "file_name": "sensitivity_lsd_*.h5",
+        "file_out_name": "sensitivity_validation_lsd",
+        "selections": {"pol_sel": SENSITIVITY_POLS},
+    },
+}
+
+# Products copied without selections, only into validation bundles
+BUNDLE_EXTRAS = {
+    "rfi": {"file_name": "rfi_mask_lsd_*.h5", "selections": {}},
+    "delayspectrum": {"file_name": "delayspectrum_lsd_*.h5", "selections": {}},
+    "delayspectrum_hpf": {"file_name": "delayspectrum_hpf_lsd_*.h5", "selections": {}},
+}
+
+# Chunk shapes aligned with the slices the bondia plots read. Keys are axis names, a
+# missing axis is not chunked (the chunk covers its full extent).
+# - ringmap: `RingMapPlot` reads one (beam, pol, freq) plane of all RA and el.
+# - sensitivity: `SensitivityPlot` reads one pol of all freq and time.
+PLOT_CHUNKS = {
+    "ringmap": {"beam": 1, "pol": 1, "freq": 1},
+    "ringmap_intercyl": {"beam": 1, "pol": 1, "freq": 1},
+    "sensitivity": {"freq": 64, "pol": 1},
+}
+
+# Output profiles: chunking and compression of the written datasets.
+OUTPUT_PROFILES = {
+    # caput defaults (contiguous, uncompressed)
+    "default": {},
+    # plot-aligned chunks without compression
+    "plot": {"chunks": PLOT_CHUNKS},
+    # plot-aligned chunks with bitshuffle + LZ4 compression
+    "plot_bitshuffle": {
+        "chunks": PLOT_CHUNKS,
+        "compression": fileformats.H5FILTER,
+        "compression_opts": {
+            "blocksize": 0,
+            "compression": fileformats.H5_COMPRESS_LZ4,
+        },
+    },
+}
+
+# Slices read by the plots, used to benchmark the output profiles.
+PLOT_SLICES = {
+    "ringmap": lambda f: f["map"][0, 0, 0],
+    "ringmap_intercyl": lambda f: f["map"][0, 0, 0],
+    "sensitivity": lambda f: f["measured"][:, 0],
+}
+
 
 @click.group()
 def cli():
     """Preprocessing of daily pipeline products for daily validation."""
 
 
-@cli.command(help="Just print number of files that would get processed.")
-@click.option(
-    "--newest/--all",
-    help="Only process data for the most recent revision.",
-    default=True,
+bundle_option = click.option(
+    "--bundle/--no-bundle",
+    help="Write one validation bundle file per day instead of one file per product.",
+    default=False,
     show_default=True,
 )
-def dryrun(newest):
-    total = len(list_files(most_recent_only=newest))
+
+
+def parse_lsd_range(ctx, param, value):
+    if value is None:
+        return None
+    try:
+        start, end = (int(lsd) for lsd in value.split(":"))
+    except ValueError:
+        raise click.BadParameter("Expected format START:END.")
+    return start, end
+
+
+def parse_shard(ctx, param, value):
+    if value is None:
+        return None
+    try:
+        index, num = (int(i) for i in value.split("/"))
+    except ValueError:
+        raise click.BadParameter("Expected format INDEX/NUMBER, e.g. 0/8.")
+    if not 0 <= index < num:
+        raise click.BadParameter(f"Shard index {index} not in [0, {num}).")
+    return index, num
+
+
+def selection_options(func):
+    """Options selecting which days to process."""
+    options = [
+        click.option(
+            "--newest/--all",
+            help="Only process data for the most recent revision.",
+            default=True,
+            show_default=True,
+        ),
+        click.option(
+            "--rev", help="Only process this revision (overrides --newest/--all)."
+        ),
+        click.option(
+            "--lsd-range",
+            callback=parse_lsd_range,
+            help="Only process days START:END (inclusive).",
+        ),
+        click.option(
+            "--shard",
+            callback=parse_shard,
+            help="Only process shard INDEX/NUMBER of the days, e.g. 0/8 for an array "
+            "job task. Days are assigned to shards by LSD modulo NUMBER.",
+        ),
+    ]
+    for option in reversed(options):
+        func = option(func)
+    return func
+
+
+@cli.command(help="Just print number of files that would get processed.")
+@selection_options
+@bundle_option
+def dryrun(newest, rev, lsd_range, shard, bundle):
+    total = len(
+        list_files(
+            most_recent_only=newest,
+            bundle=bundle,
+            rev=rev,
+            lsd_range=lsd_range,
+            shard=shard,
+        )
+    )
     print(f"Would have processed {total} files.")
     if total == 0:
         sys.exit(1)
 
 
+profile_option = click.option(
+    "--profile",
+    type=click.Choice(list(OUTPUT_PROFILES)),
+    help="Chunking and compression of the output files.",
+    default="plot",
+    show_default=True,
+)
+
+
 @cli.command()
 @click.option(
     "--force/--noforce",
@@ -40,22 +189,255 @@ def dryrun(newest):
     default=False,
     show_default=True,
 )
+@selection_options
+@profile_option
 @click.option(
-    "--newest/--all",
-    help="Only process data for the most recent revision.",
-    default=True,
+    "--stream/--no-stream",
+    help="Copy datasets block by block instead of loading the whole selection.",
+    default=False,
+    show_default=True,
+)
+@click.option(
+    "--max-block-mb",
+    help="Memory ceiling for a block copied in streaming mode (MiB).",
+    default=64,
     show_default=True,
 )
-def run(force, newest):
-    todo_list = list_files(force, newest)
+@bundle_option
+def run(force, newest, rev, lsd_range, shard, profile, stream, max_block_mb, bundle):
+    todo_list = list_files(force, newest, bundle, rev, lsd_range, shard)
+    days = set()
+    processed = []
     for d in todo_list:
-        process(**d)
+        days.add((d.pop("rev"), d.pop("lsd")))
+        processed.append({"out_file": str(d["out_file"])})
+        if bundle:
+            process_bundle(**d, profile=profile, max_block_mb=max_block_mb)
+        elif stream:
+            stream_process(**d, profile=profile, max_block_mb=max_block_mb)
+        else:
+            process(**d, profile=profile)
+    summaries = []
+    for revision, lsd in sorted(days):
+        update_sketch(revision, lsd)
+
+        # Tell the indexer which files of the day are complete
+        write_ready_marker(Path(out_dir) / revision / str(lsd))
+
+        # Shards running in parallel can't share the summary table: leave it to `merge`
+        stats = update_summary(revision, lsd, write=shard is None)
+        summaries.append({"rev": revision, "lsd": lsd, "stats": stats})
+    if shard is not None:
+        write_shard_manifest(shard, processed, summaries)
     print(f"Processed {len(todo_list)} files.")
 
 
-def list_files(force=False, most_recent_only=False):
+@cli.command(help="Merge the manifests and logs of a sharded run.")
+@click.option("--shards", help="Number of shards.", type=int, required=True)
+@click.option(
+    "--log-pattern",
+    help="Glob pattern for the per-shard log files in the output directory.",
+    default="jobout_*.log",
+    show_default=True,
+)
+@click.option(
+    "--log",
+    help="Merged log file name in the output directory (appended to).",
+    default="jobout.log",
+    show_default=True,
+)
+def merge(shards, log_pattern, log):
+    manifests = sorted(shard_dir.glob(f"manifest_*_of_{shards}.json"))
+    if len(manifests) != shards:
+        logger.warning(
+            f"Found manifests of {len(manifests)} out of {shards} shards in {shard_dir}."
+        )
+
+    processed = []
+    for manifest in manifests:
+        with manifest.open() as f:
+            shard = json.load(f)
+        processed += shard["processed"]
+        for day in shard["summary"]:
+            if day["stats"]:
+                summary.append_summary(
+                    Path(out_dir) / day["rev"] / summary.SUMMARY_FILE_NAME,
+                    day["lsd"],
+                    day["stats"],
+                )
+
+    # Keep a record of everything processed in sharded runs (adding to earlier runs)
+    manifest_file = Path(out_dir) / "manifest.json"
+    record = {}
+    if manifest_file.is_file():
+        with manifest_file.open() as f:
+            record = {p["out_file"]: p for p in json.load(f)["processed"]}
+    record.update({p["out_file"]: p for p in processed})
+    with atomic_output(manifest_file) as tmp_file, tmp_file.open("w") as f:
+        json.dump({"shards": shards, "processed": list(record.values())}, f, indent=1)
+    for manifest in manifests:
+        manifest.unlink()
+
+    log_files = sorted(Path(out_dir).glob(log_pattern))
+    with (Path(out_dir) / log).open("a") as merged:
+        for log_file in log_files:
+            merged.write(f"=== {log_file.name} ===\n")
+            merged.write(log_file.read_text())
+            log_file.unlink()
+    print(
+        f"Merged {len(manifests)} manifests ({len(processed)} files) and "
+        f"{len(log_files)} logs."
+    )
+
+
+@cli.command(
+    help="(Re)compute the per-day summary tables and sketches from preprocessed files."
+)
+@click.option(
+    "--newest/--all",
+    help="Only summarize data for the most recent revision.",
+    default=True,
+    show_default=True,
+)
+def summarise(newest):
+    rev_dirs = sorted(Path(out_dir).glob("rev_*"))
+    if newest:
+        rev_dirs = rev_dirs[-1:]
+    for rev_dir in rev_dirs:
+        for lsd_dir in sorted(rev_dir.glob("*")):
+            try:
+                lsd = int(lsd_dir.name)
+            except ValueError as err:
+                logger.debug(f"Skipping dir {lsd_dir}: {err}")
+                continue
+            update_summary(rev_dir.name, lsd)
+            update_sketch(rev_dir.name, lsd)
+
+
+@cli.command(help="Precompute the sun and moon events for a range of days.")
+@click.argument("out_file", type=click.Path(dir_okay=False))
+@click.option(
+    "--lsd-range",
+    help="Range of days START:END (inclusive).",
+    callback=parse_lsd_range,
+    required=True,
+)
+def ephemeris(out_file, lsd_range):
+    start, end = lsd_range
+    ephemeris_table.get_table(out_file).precompute(start, end)
+    print(f"Wrote ephemeris of LSD {start} to {end} to {out_file}.")
+
+
+@cli.command(help="Benchmark reading a plot-shaped slice for each output profile.")
+@click.argument("in_file", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--product",
+    type=click.Choice(list(PRODUCTS)),
+    help="Type of the daily product in IN_FILE.",
+    required=True,
+)
+@click.option(
+    "--rev",
+    help="Revision of IN_FILE (selects the ringmap container type).",
+    default=None,
+)
+@click.option(
+    "--repeats", help="Number of reads per profile.", default=10, show_default=True
+)
+@click.option(
+    "--tmp-dir",
+    type=click.Path(file_okay=False),
+    help="Where to write the test files. Should be on the filesystem you want to test.",
+    default=None,
+)
+def benchmark(in_file, product, rev, repeats, tmp_dir):
+    container = product_container(product, rev)
+    selections = PRODUCTS[product]["selections"]
+    read_slice = PLOT_SLICES[product]
+
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as tmp:
+        for profile in OUTPUT_PROFILES:
+            out_file = Path(tmp) / f"{product}_{profile}.h5"
+            start = time.perf_counter()
+            process(in_file, tmp, out_file, container, product, profile, **selections)
+            t_write = time.perf_counter() - start
+
+            t_read = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                with h5py.File(out_file, "r") as f:
+                    read_slice(f)
+                t_read.append(time.perf_counter() - start)
+
+            size = out_file.stat().st_size / 2**20
+            print(
+                f"{profile:>16}: {size:8.1f} MiB, write {t_write:6.2f}s, read slice "
+                f"median {np.median(t_read) * 1e3:8.2f}ms, min {np.min(t_read) * 1e3:8.2f}ms"
+            )
+
+
+@cli.command(help="Convert a ringmap stack to a template for the validation ringmaps.")
+@click.argument("stack_file", type=click.Path(exists=True, dir_okay=False))
+@click.argument("reference_file", type=click.Path(exists=True, dir_okay=False))
+@click.argument("out_file", type=click.Path(dir_okay=False))
+@profile_option
+def template(stack_file, reference_file, out_file, profile):
+    """
+    Convert a ringmap stack to a template aligned with preprocessed ringmaps.
+
+    STACK_FILE is the ringmap stack, REFERENCE_FILE a preprocessed ringmap defining
+    frequencies, polarisations, RA and elevation grid of the template.
+    """
+    process_template(stack_file, reference_file, out_file, profile)
+
+
+def product_container(product, rev=None):
+    """Get the container type of a daily product in a given revision."""
+    if product == "sensitivity":
+        return containers.SystemSensitivity
+
+    # TODO: clean this up
+    if rev in {"rev_00", "rev_01", "rev_02", "rev_03", "rev_04"}:
+        return ccontainers.RingMap
+    return containers.RingMap
+
+
+def list_files(
+    force=False,
+    most_recent_only=False,
+    bundle=False,
+    rev=None,
+    lsd_range=None,
+    shard=None,
+):
+    """
+    List the files to process.
+
+    Parameters
+    ----------
+    force : bool
+        Also list files that were processed already.
+    most_recent_only : bool
+        Only list files of the most recent revision.
+    bundle : bool
+        List days to write validation bundles for, instead of single files.
+    rev : str, optional
+        Only list files of this revision.
+    lsd_range : Tuple[int, int], optional
+        Only list files of days in this range (inclusive).
+    shard : Tuple[int, int], optional
+        Shard index and number of shards: only list days with `lsd % number == index`.
+        The days of a revision are partitioned deterministically this way.
+
+    Returns
+    -------
+    list(dict)
+        Arguments to `process` (or `process_bundle`) and the revision and lsd.
+    """
     rev_dirs = sorted(Path(in_dir).glob("rev_*"))
-    if most_recent_only:
+    if rev is not None:
+        rev_dirs = [rev_dir for rev_dir in rev_dirs if rev_dir.name == rev]
+    elif most_recent_only:
         rev_dirs = [rev_dirs[-1]]
     logger.debug(f"Found revisions: {[i.name for i in rev_dirs]}")
     todo_list = []
@@ -63,13 +445,7 @@ def list_files(force=False, most_recent_only=False):
         if not rev_dir.is_dir():
             logger.debug(f"Skipping {rev_dir} because it's not a (revision) directory.")
             continue
-        rev = rev_dir.parts[-1]
-
-        # TODO: clean this up
-        if rev in {"rev_00", "rev_01", "rev_02", "rev_03", "rev_04"}:
-            ringmap_container = ccontainers.RingMap
-        else:
-            ringmap_container = containers.RingMap
+        revision = rev_dir.parts[-1]
 
         lsd_dirs = sorted(rev_dir.glob("*"))
 
@@ -80,74 +456,46 @@ def list_files(force=False, most_recent_only=False):
             except ValueError as err:
                 logger.debug(f"Skipping dir {lsd_dir}: {err}")
                 continue
-            if rev not in index:
-                index[rev] = {}
-            if lsd in index[rev]:
+            if revision not in index:
+                index[revision] = {}
+            if lsd in index[revision]:
                 logger.error(f"Tried to add {lsd} twice")
                 sys.exit(1)
+            if lsd_range is not None and not lsd_range[0] <= lsd <= lsd_range[1]:
+                continue
+            if shard is not None and lsd % shard[1] != shard[0]:
+                continue
 
-            ringmap_freqs = slice(399, 746, 345)
-            ringmap_pols = slice(0, 4, 3)
-            sensitivity_pols = slice(0, 3, 2)
-
-            out = check_file(
-                rev,
-                lsd,
-                lsd_dir,
-                "ringmap",
-                "ringmap_lsd_*.*",
-                "ringmap_validation_freqs_lsd",
-                force,
-            )
-            if out is not None:
-                out.update(
-                    {
-                        "container": ringmap_container,
-                        "freq_sel": ringmap_freqs,
-                        "pol_sel": ringmap_pols,
-                    }
-                )
-                todo_list.append(out)
-            out = check_file(
-                rev,
-                lsd,
-                lsd_dir,
-                "ringmap_intercyl",
-                "ringmap_intercyl_lsd_*.*",
-                "ringmap_intercyl_validation_freqs_lsd",
-                force,
-            )
-            if out is not None:
-                out.update(
-                    {
-                        "container": ringmap_container,
-                        "freq_sel": ringmap_freqs,
-                        "pol_sel": ringmap_pols,
-                    }
-                )
-                todo_list.append(out)
-            out = check_file(
-                rev,
-                lsd,
-                lsd_dir,
-                "sensitivity",
-                "sensitivity_lsd_*.h5",
-                "sensitivity_validation_lsd",
-                force,
-            )
-            if out is not None:
-                out.update(
-                    {
-                        "container": containers.SystemSensitivity,
-                        "pol_sel": sensitivity_pols,
-                    }
+            if bundle:
+                out = check_bundle(revision, lsd, lsd_dir, force)
+                if out is not None:
+                    todo_list.append(out)
+                continue
+
+            for name, product in PRODUCTS.items():
+                out = check_file(
+                    revision,
+                    lsd,
+                    lsd_dir,
+                    name,
+                    product["file_name"],
+                    product["file_out_name"],
+                    force,
                 )
-                todo_list.append(out)
+                if out is not None:
+                    out.update(
+                        {
+                            "container": product_container(name, revision),
+                            "name": name,
+                            **product["selections"],
+                        }
+                    )
+                    todo_list.append(out)
 
     return todo_list
 
 
-def check_file(rev, lsd, path, name, file_name, file_out_name, force):
+def find_input_file(lsd, path, name, file_name):
     in_file = list(path.glob(file_name))
     if not in_file:
         logger.info(f"Found 0 {name} files in {path} (Expected 1).")
@@ -165,6 +513,13 @@ def check_file(rev, lsd, path, name, file_name, file_out_name, force):
             f"Found file for LSD {lsd} when expecting LSD {lsd_from_filename}: {in_file}"
         )
         sys.exit(1)
+    return in_file
+
+
+def check_file(rev, lsd, path, name, file_name, file_out_name, force):
+    in_file = find_input_file(lsd, path, name, file_name)
+    if in_file is None:
+        return None
 
     full_out_dir = Path(out_dir) / rev / str(lsd)
     out_file = full_out_dir / f"{file_out_name}_{lsd}.h5"
@@ -176,13 +531,491 @@ def check_file(rev, lsd, path, name, file_name, file_out_name, force):
     logger.info(
         f"Processing {rev} {name} file for lsd {lsd}: {in_file}, outfile: {out_file}"
     )
-    return {"in_file": in_file, "full_out_dir": full_out_dir, "out_file": out_file}
+    return {
+        "rev": rev,
+        "lsd": lsd,
+        "in_file": in_file,
+        "full_out_dir": full_out_dir,
+        "out_file": out_file,
+    }
+
+
+def check_bundle(rev, lsd, path, force):
+    """Find the products of a day that are missing in its validation bundle."""
+    products = {}
+    for name, product in {**PRODUCTS, **BUNDLE_EXTRAS}.items():
+        in_file = find_input_file(lsd, path, name, product["file_name"])
+        if in_file is not None:
+            products[name] = {"in_file": in_file, **product["selections"]}
+    if not products:
+        return None
+
+    full_out_dir = Path(out_dir) / rev / str(lsd)
+    out_file = full_out_dir / BUNDLE_FILE_NAME.format(lsd=lsd)
+    if out_file.is_file() and not force:
+        with h5py.File(out_file, "r") as f:
+            products = {
+                name: product for name, product in products.items() if name not in f
+            }
+        if not products:
+            logger.debug(f"Skipping {rev} bundle for lsd {lsd}, outfile: {out_file}")
+            return None
+    logger.info(
+        f"Processing {rev} bundle for lsd {lsd} ({', '.join(products)}), "
+        f"outfile: {out_file}"
+    )
+    return {
+        "rev": rev,
+        "lsd": lsd,
+        "full_out_dir": full_out_dir,
+        "out_file": out_file,
+        "products": products,
+    }
+
+
+def day_sources(rev, lsd):
+    """
+    Find the files holding the data products of one day.
+
+    Preprocessed products are taken from the bundle or the preprocessed files of the
+    day. The RFI mask and delay spectra are read from the daily products if they are
+    not in a bundle.
+
+    Parameters
+    ----------
+    rev : str
+        Revision.
+    lsd : int
+        Day.
+
+    Yields
+    ------
+    Tuple[str, Path, str]
+        Product name, file and group in the file.
+    """
+    full_out_dir = Path(out_dir) / rev / str(lsd)
+    bundle = full_out_dir / BUNDLE_FILE_NAME.format(lsd=lsd)
+    bundled = set()
+    if bundle.is_file():
+        with h5py.File(bundle, "r") as f:
+            bundled = set(f.keys())
+
+    for name, product in PRODUCTS.items():
+        if name in bundled:
+            yield name, bundle, name
+        else:
+            file = full_out_dir / f"{product['file_out_name']}_{lsd}.h5"
+            if file.is_file():
+                yield name, file, "/"
+    for name, product in BUNDLE_EXTRAS.items():
+        if name in bundled:
+            yield name, bundle, name
+        else:
+            file = find_input_file(
+                lsd, Path(in_dir) / rev / str(lsd), name, product["file_name"]
+            )
+            if file is not None:
+                yield name, file, "/"
+
+
+def update_summary(rev, lsd, write=True):
+    """
+    Compute summary statistics of one day and add them to the revision's summary table.
+
+    The statistics are computed from the preprocessed files (or bundle) of the day, right
+    after they got written (see `day_sources`).
+
+    Parameters
+    ----------
+    rev : str
+        Revision.
+    lsd : int
+        Day.
+    write : bool
+        Add the statistics to the summary table. Otherwise only return them.
+
+    Returns
+    -------
+    Dict[str, float]
+        Summary statistics.
+    """
+    stats = {}
+    for name, file, group in day_sources(rev, lsd):
+        # The delay spectra are not summarised: don't open them
+        if name not in PRODUCTS and name != "rfi":
+            continue
+        with h5py.File(file, "r") as f:
+            data = f[group]
+            if name == "sensitivity":
+                stats.update(summary.sensitivity_stats(data))
+            elif name == "rfi":
+                # The ch_pipeline RFIMask is True for good data (see SensitivityPlot)
+                subclass = data.attrs.get("__memh5_subclass", "")
+                if isinstance(subclass, bytes):
+                    subclass = subclass.decode()
+                invert = subclass.startswith("ch_pipeline")
+                stats.update(summary.rfi_stats(data, invert=invert))
+            elif name in PRODUCTS:
+                stats.update(summary.ringmap_stats(data, prefix=name))
+
+    stats = {key: float(value) for key, value in stats.items()}
+    if stats and write:
+        summary_file = Path(out_dir) / rev / summary.SUMMARY_FILE_NAME
+        logger.info(f"Adding summary of {rev} lsd {lsd} to {summary_file}")
+        summary.append_summary(summary_file, lsd, stats)
+    return stats
+
+
+def update_sketch(rev, lsd):
+    """
+    Write quantile sketches of the data planes of one day.
+
+    The plots use them to find a colour map range without reading the data (see
+    `bondia.util.sketch`).
+
+    Parameters
+    ----------
+    rev : str
+        Revision.
+    lsd : int
+        Day.
+    """
+    sketches = {}
+    for name, file, group in day_sources(rev, lsd):
+        with h5py.File(file, "r") as f:
+            data = f[group]
+            if name in PRODUCTS and name.startswith("ringmap"):
+                sketches[name] = sketch.ringmap_sketch(data, MEAN_POL)
+            elif name == "sensitivity":
+                sketches[name] = sketch.sensitivity_sketch(data, MEAN_POL)
+            elif name.startswith("delayspectrum"):
+                sketches[name] = sketch.delayspectrum_sketch(data)
+    if sketches:
+        sketch_file = (
+            Path(out_dir) / rev / str(lsd) / sketch.SKETCH_FILE_NAME.format(lsd=lsd)
+        )
+        logger.info(f"Writing sketches of {rev} lsd {lsd} to {sketch_file}")
+        sketch.write_sketch(sketch_file, sketches)
+
+
+def write_shard_manifest(shard, processed, summaries):
+    """Record the files processed and the summary statistics of a shard."""
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    index, num = shard
+    manifest_file = shard_dir / f"manifest_{index}_of_{num}.json"
+    with manifest_file.open("w") as f:
+        json.dump(
+            {"shard": f"{index}/{num}", "processed": processed, "summary": summaries},
+            f,
+            indent=1,
+        )
+    logger.info(f"Wrote manifest of shard {index}/{num} to {manifest_file}")
+
 
+def process_bundle(
+    full_out_dir, out_file, products, profile="default", max_block_mb=64
+):
+    """
+    Copy the products of one day into groups of a validation bundle file.
 
-def process(in_file, full_out_dir, out_file, container, **kwargs):
+    The products are streamed (see `stream_process`) into groups named by product.
+    Groups that already exist in the bundle get replaced.
+    """
+    Path(full_out_dir).mkdir(parents=True, exist_ok=True)
+    with atomic_output(out_file, keep_existing=True) as tmp_file, h5py.File(
+        tmp_file, "a"
+    ) as fout:
+        for name, product in products.items():
+            if name in fout:
+                del fout[name]
+            selections = {
+                key[: -len("_sel")]: sel
+                for key, sel in product.items()
+                if key.endswith("_sel")
+            }
+            with h5py.File(product["in_file"], "r") as fin:
+                copy_group(
+                    fin,
+                    fout.create_group(name),
+                    selections,
+                    name,
+                    profile,
+                    max_block_mb * 2**20,
+                )
+
+
+def process(
+    in_file, full_out_dir, out_file, container, name, profile="default", **kwargs
+):
     Path(full_out_dir).mkdir(parents=True, exist_ok=True)
     rm = container.from_file(in_file, **kwargs)
-    rm.to_disk(out_file)
+    apply_profile(rm, name, profile)
+    with atomic_output(out_file) as tmp_file:
+        rm.to_disk(tmp_file)
+
+
+def stream_process(
+    in_file,
+    full_out_dir,
+    out_file,
+    container,
+    name,
+    profile="default",
+    max_block_mb=64,
+    **kwargs,
+):
+    """
+    Apply data selections to a file, copying it block by block.
+
+    Unlike `process`, this never holds more than `max_block_mb` of a dataset in memory.
+    The container type is not needed, because the file structure is copied as is.
+
+    Parameters
+    ----------
+    in_file, full_out_dir, out_file, container, name, profile
+        See `process`.
+    max_block_mb : int
+        Maximum size of a block of data read at once (MiB).
+    kwargs
+        Selections by axis as accepted by `container.from_file`, e.g. `freq_sel`.
+    """
+    Path(full_out_dir).mkdir(parents=True, exist_ok=True)
+    selections = {
+        key[: -len("_sel")]: sel for key, sel in kwargs.items() if key.endswith("_sel")
+    }
+    with atomic_output(out_file) as tmp_file, h5py.File(in_file, "r") as fin, h5py.File(
+        tmp_file, "w"
+    ) as fout:
+        copy_group(fin, fout, selections, name, profile, max_block_mb * 2**20)
+
+
+def copy_group(src, dst, selections, name, profile, max_block_bytes):
+    """Recursively copy an HDF5 group, applying selections to all datasets."""
+    for key, value in src.attrs.items():
+        dst.attrs[key] = value
+    for key, item in src.items():
+        if isinstance(item, h5py.Group):
+            copy_group(
+                item,
+                dst.create_group(key),
+                selections,
+                name,
+                profile,
+                max_block_bytes,
+            )
+        else:
+            copy_dataset(item, dst, key, selections, name, profile, max_block_bytes)
+
+
+def dataset_axes(dset):
+    """Get the axis names of a dataset in a caput container file."""
+    if "axis" in dset.attrs:
+        return [
+            ax.decode() if isinstance(ax, bytes) else str(ax)
+            for ax in dset.attrs["axis"]
+        ]
+    # The index maps describe the axis they are named after
+    if dset.parent.name.endswith("/index_map"):
+        return [dset.name.rsplit("/", 1)[-1]]
+    return []
+
+
+def copy_dataset(dset, dst, key, selections, name, profile, max_block_bytes):
+    """
+    Copy a dataset applying selections, reading at most `max_block_bytes` at once.
+
+    The dataset is copied in blocks spanning its trailing axes: the outer axes are
+    iterated over until the remaining ones fit into the memory ceiling. Selections are
+    slices or increasing lists of indices.
+    """
+    axes = dataset_axes(dset)
+    sel = [selections.get(ax, slice(None)) for ax in axes]
+    sel += [slice(None)] * (dset.ndim - len(sel))
+    index = [np.arange(n)[s] for n, s in zip(dset.shape, sel)]
+    shape = tuple(len(i) for i in index)
+
+    kwargs = {}
+    if "axis" in dset.attrs and dset.ndim > 0:
+        kwargs = h5py_dataset_kwargs(axes, shape, name, profile)
+    out = dst.create_dataset(key, shape=shape, dtype=dset.dtype, **kwargs)
+    for akey, value in dset.attrs.items():
+        out.attrs[akey] = value
+
+    if dset.ndim == 0:
+        out[()] = dset[()]
+        return
+
+    # h5py reads with at most one list of indices, which has to be increasing
+    fancy = [i for i, s in enumerate(sel) if not isinstance(s, slice)]
+    for i in fancy:
+        if np.any(np.diff(index[i]) <= 0):
+            raise ValueError(
+                f"Selection of axis {axes[i]} of {dset.name} isn't increasing: {sel[i]}"
+            )
+
+    # Find the outermost axis from which on a block fits into memory (and has only one
+    # list selection)
+    nsplit = fancy[-2] + 1 if len(fancy) > 1 else 0
+    while (
+        nsplit < len(shape)
+        and np.prod(shape[nsplit:], dtype=int) * dset.dtype.itemsize > max_block_bytes
+    ):
+        nsplit += 1
+
+    for out_index in np.ndindex(*shape[:nsplit]):
+        in_index = tuple(int(index[i][j]) for i, j in enumerate(out_index))
+        out[out_index] = dset[in_index + tuple(sel[nsplit:])]
+
+
+def h5py_dataset_kwargs(axes, shape, name, profile):
+    """Get chunking and compression arguments for `h5py.Group.create_dataset`."""
+    profile = OUTPUT_PROFILES[profile]
+    kwargs = {}
+    axis_chunks = profile.get("chunks", {}).get(name)
+    if axis_chunks is not None:
+        kwargs["chunks"] = chunk_shape(axes, shape, axis_chunks)
+    if profile.get("compression") == fileformats.H5FILTER:
+        opts = profile["compression_opts"]
+        kwargs["compression"] = fileformats.H5FILTER
+        kwargs["compression_opts"] = (opts["blocksize"], opts["compression"])
+    elif "compression" in profile:
+        kwargs["compression"] = profile["compression"]
+        kwargs["compression_opts"] = profile["compression_opts"]
+    return kwargs
+
+
+def chunk_shape(axes, shape, axis_chunks):
+    """
+    Get the chunk shape of a dataset.
+
+    Parameters
+    ----------
+    axes : list(str)
+        Axis names of the dataset.
+    shape : tuple(int)
+        Shape of the dataset.
+    axis_chunks : dict
+        Chunk length by axis name. Axes not in here are not chunked.
+
+    Returns
+    -------
+    tuple(int)
+        Chunk shape.
+    """
+    return tuple(max(min(axis_chunks.get(ax) or n, n), 1) for ax, n in zip(axes, shape))
+
+
+def apply_profile(container, name, profile):
+    """Set chunking and compression of all datasets in a container."""
+    profile = OUTPUT_PROFILES[profile]
+    axis_chunks = profile.get("chunks", {}).get(name)
+    for dname, dset in container.datasets.items():
+        if axis_chunks is not None and "axis" in dset.attrs:
+            dset.chunks = chunk_shape(dset.attrs["axis"], dset.shape, axis_chunks)
+            logger.debug(f"Chunking {name} dataset {dname} as {dset.chunks}")
+        if "compression" in profile:
+            dset.compression = profile["compression"]
+            dset.compression_opts = profile["compression_opts"]
+
+
+def _decode(values):
+    return [v.decode() if isinstance(v, bytes) else str(v) for v in values]
+
+
+def _regrid(plane, axis, x_in, x_out, period=None):
+    """Linearly interpolate a 2D plane along one axis."""
+    plane = np.moveaxis(plane, axis, -1)
+    out = np.empty(plane.shape[:-1] + (len(x_out),), dtype=plane.dtype)
+    for i in range(plane.shape[0]):
+        out[i] = np.interp(x_out, x_in, plane[i], period=period)
+    return np.moveaxis(out, -1, axis)
+
+
+def process_template(stack_file, reference_file, out_file, profile="plot"):
+    """
+    Convert a ringmap stack into a template for the validation ringmaps.
+
+    The template has the frequencies, polarisations, RA and elevation grid of a
+    preprocessed ringmap, plus the mean of the XX and YY polarisations. Subtracting it
+    from a ringmap plane at runtime is a single slice read.
+
+    The stack is read one (beam, pol, freq) plane at a time. Its elevation axis is
+    averaged down (or interpolated) and its RA axis interpolated to the reference grid.
+    """
+    with h5py.File(stack_file, "r") as stack, h5py.File(reference_file, "r") as ref:
+        ref_freq = ref["index_map/freq"][:]
+        ref_pol = _decode(ref["index_map/pol"][:])
+        ref_ra = ref["index_map/ra"][:]
+        ref_el = ref["index_map/el"][:]
+        stack_freq = stack["index_map/freq"][:]
+        stack_pol = _decode(stack["index_map/pol"][:])
+        stack_ra = stack["index_map/ra"][:]
+        stack_el = stack["index_map/el"][:]
+        stack_map = stack["map"]
+        beams = stack["index_map/beam"][:]
+
+        # Match frequencies by their centre
+        sel_freq = []
+        for f in ref_freq:
+            i = np.argmin(np.abs(stack_freq["centre"] - f["centre"]))
+            if np.abs(stack_freq["centre"][i] - f["centre"]) > f["width"] / 2:
+                logger.error(f"No frequency close to {f['centre']} MHz in stack file.")
+                sys.exit(1)
+            sel_freq.append(i)
+        try:
+            sel_pol = [stack_pol.index(p) for p in ref_pol]
+        except ValueError as err:
+            logger.error(f"Polarisation missing in stack file: {err}")
+            sys.exit(1)
+
+        pols = list(ref_pol)
+        mean_pol = "XX" in ref_pol and "YY" in ref_pol
+        if mean_pol:
+            pols.append(MEAN_POL)
+
+        def regrid(plane):
+            """Bring a (ra, el) plane of the stack to the reference grid."""
+            if len(stack_el) == len(ref_el):
+                pass
+            elif len(stack_el) % len(ref_el) == 0:
+                factor = len(stack_el) // len(ref_el)
+                plane = plane.reshape(plane.shape[0], -1, factor).mean(axis=-1)
+            else:
+                plane = _regrid(plane, 1, stack_el, ref_el)
+            if len(stack_ra) != len(ref_ra) or not np.allclose(stack_ra, ref_ra):
+                plane = _regrid(plane, 0, stack_ra, ref_ra, period=360.0)
+            return plane
+
+        axes = ["beam", "pol", "freq", "ra", "el"]
+        shape = (len(beams), len(pols), len(ref_freq), len(ref_ra), len(ref_el))
+        Path(out_file).parent.mkdir(parents=True, exist_ok=True)
+        with atomic_output(out_file) as tmp_file, h5py.File(tmp_file, "w") as fout:
+            fout.create_dataset("index_map/beam", data=beams)
+            fout.create_dataset("index_map/pol", data=np.array(pols, dtype="S"))
+            fout.create_dataset("index_map/freq", data=ref_freq)
+            fout.create_dataset("index_map/ra", data=ref_ra)
+            fout.create_dataset("index_map/el", data=ref_el)
+            out = fout.create_dataset(
+                "map",
+                shape=shape,
+                dtype=stack_map.dtype,
+                **h5py_dataset_kwargs(axes, shape, "ringmap", profile),
+            )
+            out.attrs["axis"] = np.array(axes, dtype="S")
+            fout.attrs["stack_file"] = str(stack_file)
+            fout.attrs["reference_file"] = str(reference_file)
+
+            for ibeam in range(len(beams)):
+                for ifreq, jfreq in enumerate(sel_freq):
+                    planes = {}
+                    for ipol, jpol in enumerate(sel_pol):
+                        planes[ref_pol[ipol]] = regrid(stack_map[ibeam, jpol, jfreq])
+                        out[ibeam, ipol, ifreq] = planes[ref_pol[ipol]]
+                    if mean_pol:
+                        out[ibeam, len(pols) - 1, ifreq] = np.nanmean(
+                            [planes["XX"], planes["YY"]], axis=0
+                        )
+    logger.info(f"Wrote ringmap template to {out_file}")
 
 
 if __name__ == "__main__":
@@ -29,4 +29,9 @@ set -e
 python "$ENV"/daily_validation_preprocessing/val_preprocess.py dryrun &> "$PROCESSED"/validation_preprocess/jobout.log
 
 cd "$ENV"/daily_validation_preprocessing/
-sbatch val_preprocess.sbatch
+# Process the days in a job array and merge the shards' manifests and logs afterwards.
+# To run locally instead:
+#   seq 0 7 | xargs -P 8 -I{} python val_preprocess.py run --shard {}/8
+#   python val_preprocess.py merge --shards 8
+JOB_ID=$(sbatch --parsable val_preprocess.sbatch)
+SHARDS=8 sbatch --dependency=afterany:"$JOB_ID" val_preprocess_merge.sbatch
@@ -6,7 +6,9 @@ import logging
 import panel as pn
 
 from bondia.data import DataLoader
+from bondia.util.cache import raster_cache, render_cache
 from bondia.util.exception import ConfigError
+from bondia.util.rendering import rendering_strategy
 from bondia.gui import BondiaGui
 
 logger = logging.getLogger(__name__)
@@ -17,6 +19,12 @@ class BondiaServer(Reader):
     logging = logging_config(default={"root": "INFO"})
     _config_data = Property({}, proptype=dict, key="data")
     _config_plots = Property({}, proptype=dict, key="plots")
+    # Options of the plot data cache shared by all sessions: maxsize, max_age (seconds)
+    _config_render_cache = Property({}, proptype=dict, key="render_cache")
+    # Options of the cache of server-side rendered viewports: maxsize, max_age (seconds)
+    _config_raster_cache = Property({}, proptype=dict, key="raster_cache")
+    # Thresholds of the "auto" rendering mode and latency log file, see RenderingStrategy
+    _config_rendering = Property({}, proptype=dict, key="rendering")
     _template_name = Property("mdl", proptype=str, key="html_template")
     _width_drawer_widgets = Property(220, int)
     _root_url = Property(proptype=str, default="", key="root_url")
@@ -45,6 +53,13 @@ class BondiaServer(Reader):
         except TemplateNotFound:
             raise ConfigError(f"Can't find template '{self._template_name}'.")
 
+        render_cache.configure(**self._config_render_cache)
+        raster_cache.configure(**self._config_raster_cache)
+        try:
+            rendering_strategy.configure(**self._config_rendering)
+        except ValueError as err:
+            raise ConfigError(err)
+
         self.data = DataLoader.from_config(self._config_data)
         if not self.data.index:
             raise ConfigError("No data available.")
@@ -0,0 +1,138 @@
+"""Process-wide cache of plot data shared by all sessions."""
+
+import logging
+import numpy as np
+import threading
+import time
+
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize(value):
+    """Make a parameter value hashable and independent of its (numpy) type."""
+    if isinstance(value, (list, tuple)):
+        return tuple(_normalize(v) for v in value)
+    if isinstance(value, np.generic):
+        return value.item()
+    if hasattr(value, "lsd"):
+        # bondia.util.day.Day
+        return value.lsd
+    return value
+
+
+def _freeze(value):
+    """Make arrays read-only, so that no session can change them for the others."""
+    if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            _freeze(v)
+    elif isinstance(value, dict):
+        for v in value.values():
+            _freeze(v)
+    return value
+
+
+class RenderCache:
+    """
+    Thread-safe LRU cache of computed plot data.
+
+    Values are plain arrays (and tuples, lists or dicts of them) or rasterized HoloViews
+    elements, not Bokeh objects. Arrays are made read-only when cached.
+
+    Parameters
+    ----------
+    maxsize : int
+        Maximum number of entries.
+    max_age : float
+        Seconds after which an entry gets recomputed (e.g. to get new data flags).
+    """
+
+    def __init__(self, maxsize: int = 64, max_age: float = 3600):
+        self.maxsize = maxsize
+        self.max_age = max_age
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def configure(self, maxsize: int = None, max_age: float = None):
+        """Change the size or maximum age of entries."""
+        with self._lock:
+            if maxsize is not None:
+                self.maxsize = maxsize
+            if max_age is not None:
+                self.max_age = max_age
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _evict(self):
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    @staticmethod
+    def key(plot, *values):
+        """
+        Build a cache key for plot data.
+
+        Parameters
+        ----------
+        plot : HeatMapPlot
+            The plot. Its class, revision and day are part of the key.
+        values
+            All other parameter values (or data identifiers) the data depends on.
+
+        Returns
+        -------
+        tuple
+        """
+        return (
+            type(plot).__name__,
+            plot.revision,
+            _normalize(plot.lsd),
+        ) + _normalize(values)
+
+    def get(self, key, compute):
+        """
+        Get a cached value, or compute and cache it.
+
+        Parameters
+        ----------
+        key : tuple
+            Cache key, see `key`.
+        compute : Callable
+            Computes the value. Called without holding the lock, so sessions can compute
+            different entries at the same time.
+
+        Returns
+        -------
+        The cached or computed value.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] < self.max_age:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        value = _freeze(compute())
+        with self._lock:
+            self._entries[key] = (now, value)
+            self._entries.move_to_end(key)
+            self._evict()
+        logger.debug(f"Render cache: {self.hits} hits, {self.misses} misses.")
+        return value
+
+
+# Shared by all plots of all sessions of this process
+render_cache = RenderCache()
+
+# Server-side rendering results by data and viewport, see `HeatMapPlot.render`
+raster_cache = RenderCache(maxsize=256)
@@ -0,0 +1,207 @@
+"""Table of sun and moon events per sidereal day, shared by the plot overlays."""
+
+import h5py
+import logging
+import numpy as np
+import os
+import threading
+
+from ch_util.ephemeris import chime, csd_to_unix, skyfield_wrapper, unix_to_csd
+
+from bondia.util.files import atomic_output
+
+logger = logging.getLogger(__name__)
+
+# Number of days computed in one batch
+CHUNK_DAYS = 256
+
+# Columns of the table
+COLUMNS = ("sun_rise", "sun_set", "moon_ra", "moon_za")
+
+# Tables by file path (None for tables kept in memory only)
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+class EphemerisTable:
+    """
+    Sun and moon events for each LSD.
+
+    Events are computed in batches of `CHUNK_DAYS` days and optionally persisted to an
+    HDF5 file, with one group per batch. Lookups are O(1) once a batch is computed.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        File to persist the table in. It is read on creation and updated with every new
+        batch. Optional.
+    """
+
+    def __init__(self, path: os.PathLike = None):
+        self._path = path
+        self._chunks = {}
+        self._lock = threading.Lock()
+        if path is not None and os.path.isfile(path):
+            try:
+                with h5py.File(path, "r") as f:
+                    for chunk, group in f.items():
+                        self._chunks[int(chunk)] = {c: group[c][:] for c in COLUMNS}
+            except (OSError, KeyError, ValueError) as err:
+                logger.error(f"Failure reading ephemeris table {path}: {err}")
+            logger.debug(f"Loaded {len(self._chunks)} ephemeris batches from {path}.")
+
+    @staticmethod
+    def _compute(chunk: int):
+        """Compute the events of one batch of days with a single call per body."""
+        start_lsd = chunk * CHUNK_DAYS
+        start_time = csd_to_unix(start_lsd)
+        end_time = csd_to_unix(start_lsd + CHUNK_DAYS)
+        logger.debug(f"Computing ephemeris for LSD {start_lsd}+{CHUNK_DAYS}...")
+
+        table = {
+            "sun_rise": np.zeros(CHUNK_DAYS),
+            "sun_set": np.zeros(CHUNK_DAYS),
+            "moon_ra": np.full(CHUNK_DAYS, np.nan),
+            "moon_za": np.full(CHUNK_DAYS, np.nan),
+        }
+
+        eph = skyfield_wrapper.ephemeris
+        times, rises = chime.rise_set_times(
+            eph["sun"], start_time, end_time, diameter=-10
+        )
+        csd = unix_to_csd(np.asarray(times))
+        days = np.floor(csd).astype(int) - start_lsd
+        # Keep the last rise and set of a day
+        for day, ra, rise in zip(days, (csd % 1) * 360, rises):
+            if 0 <= day < CHUNK_DAYS:
+                table["sun_rise" if rise else "sun_set"][day] = ra
+
+        moon_time, moon_dec = chime.transit_times(
+            eph["moon"], start_time, end_time, return_dec=True
+        )
+        csd = unix_to_csd(np.asarray(moon_time))
+        days = np.floor(csd).astype(int) - start_lsd
+        # Keep the first transit of a day
+        for day, ra, dec in reversed(list(zip(days, (csd % 1) * 360, moon_dec))):
+            if 0 <= day < CHUNK_DAYS:
+                table["moon_ra"][day] = ra
+                table["moon_za"][day] = np.sin(np.radians(dec - 49.0))
+        return table
+
+    def _persist(self, chunk: int):
+        # Several processes could do this at the same time. In that case a batch may get
+        # lost and is recomputed by the next process that needs it.
+        with atomic_output(self._path, keep_existing=True) as tmp_file, h5py.File(
+            tmp_file, "a"
+        ) as f:
+            if str(chunk) in f:
+                del f[str(chunk)]
+            group = f.create_group(str(chunk))
+            for column in COLUMNS:
+                group.create_dataset(column, data=self._chunks[chunk][column])
+
+    def precompute(self, start_lsd: int, end_lsd: int):
+        """
+        Make sure the events of a range of days are in the table.
+
+        Parameters
+        ----------
+        start_lsd, end_lsd : int
+            First and last day.
+        """
+        for chunk in range(start_lsd // CHUNK_DAYS, end_lsd // CHUNK_DAYS + 1):
+            self._get_chunk(chunk)
+
+    def _get_chunk(self, chunk: int):
+        with self._lock:
+            if chunk not in self._chunks:
+                self._chunks[chunk] = self._compute(chunk)
+                if self._path is not None:
+                    try:
+                        self._persist(chunk)
+                    except OSError as err:
+                        logger.error(
+                            f"Failure writing ephemeris table {self._path}: {err}"
+                        )
+            return self._chunks[chunk]
+
+    def lookup(self, lsd: int):
+        """
+        Get the events of one day.
+
+        Parameters
+        ----------
+        lsd : int
+            Day.
+
+        Returns
+        -------
+        Dict[str, float]
+            RA (in degrees) of the sun rise and set (0 if there is none), RA and sin(ZA)
+            of the moon transit (NaN if there is none).
+        """
+        lsd = int(lsd)
+        chunk = self._get_chunk(lsd // CHUNK_DAYS)
+        return {column: chunk[column][lsd % CHUNK_DAYS] for column in COLUMNS}
+
+
+def get_table(path: os.PathLike = None):
+    """
+    Get the (process-wide) ephemeris table persisted in a file.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        File of the table. If None, the table is only kept in memory.
+
+    Returns
+    -------
+    EphemerisTable
+    """
+    with _tables_lock:
+        if path not in _tables:
+            _tables[path] = EphemerisTable(path)
+        return _tables[path]
+
+
+def sun_times(lsd: int, path: os.PathLike = None):
+    """
+    Get the sun rise and set on a day.
+
+    Parameters
+    ----------
+    lsd : int
+        Day.
+    path : os.PathLike
+        File of the ephemeris table. Optional.
+
+    Returns
+    -------
+    Tuple[float, float]
+        RA of sun rise and sun set in degrees.
+    """
+    events = get_table(path).lookup(lsd)
+    return events["sun_rise"], events["sun_set"]
+
+
+def moon_transit(lsd: int, path: os.PathLike = None):
+    """
+    Get the moon transit on a day.
+
+    Parameters
+    ----------
+    lsd : int
+        Day.
+    path : os.PathLike
+        File of the ephemeris table. Optional.
+
+    Returns
+    -------
+    Tuple[float, float] or None
+        RA in degrees and sin(ZA) of the moon transit. None if the moon doesn't transit
+        on this day.
+    """
+    events = get_table(path).lookup(lsd)
+    if np.isnan(events["moon_ra"]):
+        return None
+    return events["moon_ra"], events["moon_za"]
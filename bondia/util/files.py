@@ -0,0 +1,41 @@
+"""File writing utilities."""
+
+import os
+import shutil
+
+from contextlib import contextmanager
+from pathlib import Path
+
+
+@contextmanager
+def atomic_output(path: os.PathLike, keep_existing: bool = False):
+    """
+    Write a file under a temporary name and rename it when done.
+
+    The temporary file is hidden (its name starts with a dot), so that globbing for the
+    output never finds a half-written file. It replaces `path` in an atomic rename only
+    if writing it succeeded, otherwise it gets removed.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Output file.
+    keep_existing : bool
+        Start the temporary file as a copy of an existing output file (to modify it).
+
+    Yields
+    ------
+    Path
+        The temporary file to write to.
+    """
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.stem}.tmp{path.suffix}")
+    if keep_existing and path.is_file():
+        shutil.copyfile(path, tmp_path)
+    try:
+        yield tmp_path
+    except BaseException:
+        if tmp_path.exists():
+            tmp_path.unlink()
+        raise
+    os.replace(tmp_path, path)
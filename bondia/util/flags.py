@@ -1,10 +1,12 @@
 import logging
+import numpy as np
 import threading
 import time
 
 from functools import lru_cache
-from typing import List
+from typing import List, Tuple
 
+from ch_util.ephemeris import unix_to_csd
 from chimedb import dataflag as df
 
 logger = logging.getLogger(__name__)
@@ -71,6 +73,7 @@ def get_flags_cached(flag_types: List[str], cache_reset_time: int = -1):
         if cache_reset_time != -1 and now - cache_ts > cache_reset_time:
             logger.debug(f"Resetting data flag cache...")
             get_one_flag_type.cache_clear()
+            _flag_index_of_types.cache_clear()
             cache_ts = now
 
     flags = []
@@ -103,3 +106,102 @@ def get_one_flag_type(flag_type: str):
         .where(df.DataFlagType.name << [flag_type])
     )
     return [(f.type.name, f.start_time, f.finish_time) for f in flags]
+
+
+def flag_index(flag_time_spans: List[Tuple[str, float, float]]):
+    """
+    Build an index of flagged time in CSD.
+
+    Parameters
+    ----------
+    flag_time_spans : List[Tuple[str, float, float]]
+        Flags as returned by `get_flags`: type name with start and end time. A missing
+        end time means the flag is still open.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        Start and end CSD of disjoint flagged intervals, sorted.
+    """
+    if not flag_time_spans:
+        return np.zeros(0), np.zeros(0)
+    times = np.array(
+        [(ca, np.nan if cb is None else cb) for _, ca, cb in flag_time_spans],
+        dtype=np.float64,
+    )
+    start = unix_to_csd(times[:, 0])
+    end = np.where(np.isnan(times[:, 1]), np.inf, unix_to_csd(times[:, 1]))
+
+    order = np.argsort(start)
+    start, end = start[order], end[order]
+
+    # An interval starts a new group unless it overlaps with one before
+    new_group = np.ones(len(start), dtype=bool)
+    new_group[1:] = start[1:] >= np.maximum.accumulate(end)[:-1]
+    first = np.flatnonzero(new_group)
+    return start[first], np.maximum.reduceat(end, first)
+
+
+def flag_index_mask(index: Tuple[np.ndarray, np.ndarray], csd: np.ndarray):
+    """
+    Find flagged samples.
+
+    Parameters
+    ----------
+    index : Tuple[np.ndarray, np.ndarray]
+        Index as returned by `flag_index`.
+    csd : np.ndarray
+        Sample times in CSD.
+
+    Returns
+    -------
+    np.ndarray
+        True for samples inside (and not on the edge of) a flagged interval.
+    """
+    start, end = index
+    csd = np.asarray(csd)
+    if csd.size == 0 or start.size == 0:
+        return np.zeros(csd.shape, dtype=bool)
+
+    # Only look at the intervals overlapping the samples
+    first = np.searchsorted(end, csd.min(), side="right")
+    last = np.searchsorted(start, csd.max(), side="left")
+    start, end = start[first:last], end[first:last]
+
+    # Last interval starting before each sample
+    i = np.searchsorted(start, csd, side="left") - 1
+    mask = i >= 0
+    mask[mask] = csd[mask] < end[i[mask]]
+    return mask
+
+
+def get_flag_index_cached(flag_types: List[str], cache_reset_time: int = -1):
+    """
+    Get an index of CHIME data flags from the database.
+
+    The index is built once per set of flag types. It is reset together with the
+    cache of `get_flags_cached`.
+
+    Parameters
+    ----------
+    flag_types: List[str]
+        Types of flags to request.
+    cache_reset_time: int
+        Seconds after which to reset the cache to get fresh flags.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        Index as returned by `flag_index`.
+    """
+    # Resets the caches if they are too old
+    get_flags_cached([], cache_reset_time)
+    return _flag_index_of_types(tuple(sorted(flag_types)))
+
+
+@lru_cache(maxsize=16)
+def _flag_index_of_types(flag_types: Tuple[str]):
+    flags = []
+    for ft in flag_types:
+        flags += get_one_flag_type(ft)
+    return flag_index(flags)
@@ -0,0 +1,192 @@
+"""Compiled kernels for preparing plot data in a single pass."""
+
+import numba
+import numpy as np
+
+
+@numba.njit(cache=True)
+def mask_plane(data, row_mask, out):
+    """
+    Mask rows and flagged (zero) samples of a 2D array.
+
+    Parameters
+    ----------
+    data : np.ndarray[:, :]
+        Input data.
+    row_mask : np.ndarray[:]
+        True for rows to mask (length of the first axis of `data`).
+    out : np.ndarray[:, :]
+        Output, NaN where masked. May be `data`.
+
+    Returns
+    -------
+    np.ndarray[:, :]
+        `out`
+    """
+    nrow, ncol = data.shape
+    for i in range(nrow):
+        if row_mask[i]:
+            for j in range(ncol):
+                out[i, j] = np.nan
+        else:
+            for j in range(ncol):
+                value = data[i, j]
+                out[i, j] = np.nan if value == 0 else value
+    return out
+
+
+@numba.njit(cache=True)
+def subtract_plane(data, column_offset, template, out):
+    """
+    Subtract an offset per column and a template from a 2D array.
+
+    Parameters
+    ----------
+    data : np.ndarray[:, :]
+        Input data.
+    column_offset : np.ndarray[:]
+        Subtracted from each column (length of the second axis of `data`). Skipped if
+        empty.
+    template : np.ndarray[:, :]
+        Subtracted from the data (same shape). Skipped if empty.
+    out : np.ndarray[:, :]
+        Output. May be `data`.
+
+    Returns
+    -------
+    np.ndarray[:, :]
+        `out`
+    """
+    nrow, ncol = data.shape
+    use_offset = column_offset.size > 0
+    use_template = template.size > 0
+    for i in range(nrow):
+        for j in range(ncol):
+            value = data[i, j]
+            if use_offset:
+                value -= column_offset[j]
+            if use_template:
+                value -= template[i, j]
+            out[i, j] = value
+    return out
+
+
+@numba.njit(cache=True)
+def mask_sensitivity(data, column_mask, rfi, estimate, out):
+    """
+    Mask and normalise a sensitivity array (frequency, time).
+
+    Parameters
+    ----------
+    data : np.ndarray[:, :]
+        Measured sensitivity.
+    column_mask : np.ndarray[:]
+        True for time samples to mask.
+    rfi : np.ndarray[:, :]
+        True for RFI (same shape as `data`). Skipped if empty.
+    estimate : np.ndarray[:, :]
+        Data is divided by this (same shape as `data`), where it's zero the output is
+        NaN. Skipped if empty.
+    out : np.ndarray[:, :]
+        Output, NaN where masked or flagged (zero). May be `data`.
+
+    Returns
+    -------
+    np.ndarray[:, :]
+        `out`
+    """
+    nrow, ncol = data.shape
+    use_rfi = rfi.size > 0
+    use_estimate = estimate.size > 0
+    for i in range(nrow):
+        for j in range(ncol):
+            value = data[i, j]
+            if column_mask[j] or value == 0 or (use_rfi and rfi[i, j]):
+                out[i, j] = np.nan
+            elif use_estimate:
+                out[i, j] = np.nan if estimate[i, j] == 0 else value / estimate[i, j]
+            else:
+                out[i, j] = value
+    return out
+
+
+@numba.njit(cache=True)
+def _select(values, n, k):
+    """Partially sort `values[:n]` in place so that `values[k]` is the k-th smallest."""
+    left = 0
+    right = n - 1
+    while left < right:
+        # Median of three as pivot
+        mid = (left + right) // 2
+        if values[mid] < values[left]:
+            values[mid], values[left] = values[left], values[mid]
+        if values[right] < values[left]:
+            values[right], values[left] = values[left], values[right]
+        if values[right] < values[mid]:
+            values[right], values[mid] = values[mid], values[right]
+        pivot = values[mid]
+
+        i = left
+        j = right
+        while i <= j:
+            while values[i] < pivot:
+                i += 1
+            while pivot < values[j]:
+                j -= 1
+            if i <= j:
+                values[i], values[j] = values[j], values[i]
+                i += 1
+                j -= 1
+        if k <= j:
+            right = j
+        elif k >= i:
+            left = i
+        else:
+            break
+    return values[k]
+
+
+@numba.njit(parallel=True, cache=True)
+def nanmedian_columns(data):
+    """
+    Median of each column of a 2D array, ignoring NaNs.
+
+    Equivalent to `np.nanmedian(data, axis=0)`, but uses selection instead of sorting
+    and processes the columns in parallel. Columns without valid data are NaN (without a
+    warning).
+
+    Parameters
+    ----------
+    data : np.ndarray[:, :]
+        Input data.
+
+    Returns
+    -------
+    np.ndarray[:]
+        Median per column.
+    """
+    nrow, ncol = data.shape
+    out = np.empty(ncol, dtype=np.float64)
+    for j in numba.prange(ncol):
+        values = np.empty(nrow, dtype=np.float64)
+        n = 0
+        for i in range(nrow):
+            value = data[i, j]
+            if not np.isnan(value):
+                values[n] = value
+                n += 1
+        if n == 0:
+            out[j] = np.nan
+            continue
+        k = n // 2
+        upper = _select(values, n, k)
+        if n % 2:
+            out[j] = upper
+        else:
+            # The largest value below the upper median is the lower median
+            lower = values[0]
+            for i in range(1, k):
+                if values[i] > lower:
+                    lower = values[i]
+            out[j] = 0.5 * (lower + upper)
+    return out
@@ -3,9 +3,59 @@
 import holoviews as hv
 import numpy as np
 
+from bokeh.models import FixedTicker
+from holoviews.plotting.util import process_cmap
 
-def hv_image_with_gaps(x, y, z, gap_scale=0.1, opts=None, *args, **kwargs):
-    """Produce an overlay with images accounting for gaps in the data.
+# Number of colors of quantised images (code 0 is reserved for missing data)
+QUANTIZED_COLORS = 255
+
+
+def find_splits(ax, gap_scale=0.1):
+    """Find the uninterruptedly sampled sections of an axis.
+
+    Parameters
+    ----------
+    ax : np.ndarray[:]
+        Location of pixel centres.
+    gap_scale : float, optional
+        If there is an extra gap between pixels of this amount times the nominal
+        separation, consider this a gap in the data.
+
+    Returns
+    -------
+    splits : list
+        Start and end index of each section.
+    """
+    if len(ax) < 2:
+        return [(0, len(ax))]
+    d = np.diff(ax)
+    md = np.median(d)
+
+    cuts = np.flatnonzero(np.abs(d - md) > np.abs(gap_scale * md)) + 1
+    bounds = np.concatenate(([0], cuts, [len(ax)]))
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+
+def _pad_axis(ax, gap_scale):
+    """Get the position of each pixel on a regular grid, and the grid coordinates."""
+    if len(ax) < 2:
+        return np.arange(len(ax)), np.asarray(ax)
+    d = np.diff(ax)
+    md = np.median(d)
+
+    # Number of missing pixels in each gap (none within sections, or if the gap is
+    # smaller than the nominal separation)
+    missing = np.round(d / md).astype(int) - 1
+    missing[(np.abs(d - md) <= np.abs(gap_scale * md)) | (missing < 0)] = 0
+
+    pos = np.arange(len(ax))
+    pos[1:] += np.cumsum(missing)
+    grid = np.interp(np.arange(pos[-1] + 1), pos, ax)
+    return pos, grid
+
+
+def pad_gaps(x, y, z, gap_scale=0.1):
+    """Put data with gaps onto a regular grid, with NaN where data is missing.
 
     Parameters
     ----------
@@ -16,35 +66,65 @@ def hv_image_with_gaps(x, y, z, gap_scale=0.1, opts=None, *args, **kwargs):
     gap_scale : float, optional
         If there is an extra gap between pixels of this amount times the nominal
         separation, consider this a gap in the data.
-    opts : dict
-
 
     Returns
     -------
-    overlay : list
-        holoviews Overlay with an Image for each uninterruptedly sampled section.
+    x, y : np.ndarray[:]
+        Location of pixel centres on the regular grid.
+    z : np.ndarray[:, :]
+        Pixel values, NaN in the gaps. This is the input array if there are no gaps.
     """
+    x_pos, x_grid = _pad_axis(x, gap_scale)
+    y_pos, y_grid = _pad_axis(y, gap_scale)
+    if len(x_grid) == len(x) and len(y_grid) == len(y):
+        return x_grid, y_grid, z
 
-    def _find_splits(ax):
-        d = np.diff(ax)
-        md = np.median(d)
+    padded = np.full(
+        (len(y_grid), len(x_grid)), np.nan, dtype=np.result_type(z.dtype, np.float32)
+    )
+    padded[np.ix_(y_pos, x_pos)] = z
+    return x_grid, y_grid, padded
 
-        ranges = []
 
-        last_cut = 0
-        for ii, di in enumerate(d):
-            if np.abs(di - md) > np.abs(gap_scale * md):
-                ranges.append((last_cut, ii + 1))
-                last_cut = ii + 1
+def hv_image_with_gaps(
+    x, y, z, gap_scale=0.1, opts=None, *args, single_image=False, **kwargs
+):
+    """Produce an overlay with images accounting for gaps in the data.
 
-        ranges.append((last_cut, len(ax)))
-        return ranges
+    Parameters
+    ----------
+    x, y : np.ndarray[:]
+        Location of pixel centres in each direction
+    z : np.ndarray[:, :]
+        Pixel (z-)values
+    gap_scale : float, optional
+        If there is an extra gap between pixels of this amount times the nominal
+        separation, consider this a gap in the data.
+    opts : dict
+    single_image : bool, optional
+        Instead of an overlay, return one image with the gaps filled with NaN (see
+        `pad_gaps`). The cost of rendering it doesn't depend on the number of gaps.
 
+    Returns
+    -------
+    overlay : holoviews.Overlay or holoviews.Image
+        holoviews Overlay with an Image for each uninterruptedly sampled section, or a
+        single Image if `single_image` is set.
+    """
     if opts is None:
         opts = {}
+
+    if single_image:
+        return hv.Image(
+            pad_gaps(x, y, z, gap_scale),
+            datatype=["image", "grid"],
+            *args,
+            **kwargs,
+        ).opts(**opts)
+
     overlay = None
-    x_splits = _find_splits(x)
-    y_splits = _find_splits(y)
+    x_splits = find_splits(x, gap_scale)
+    y_splits = find_splits(y, gap_scale)
     for xs, xe in x_splits:
         for ys, ye in y_splits:
             xa = x[xs:xe]
@@ -65,3 +145,96 @@ def hv_image_with_gaps(x, y, z, gap_scale=0.1, opts=None, *args, **kwargs):
                 overlay *= img
 
     return overlay
+
+
+def quantize(z, clim, log=False):
+    """Map values onto uint8 color codes, to send images to the browser compactly.
+
+    Parameters
+    ----------
+    z : np.ndarray
+        Values.
+    clim : Tuple[float, float]
+        Color map range. Values outside of it get the first or last color.
+    log : bool, optional
+        Logarithmic color scale. Non-positive values are treated as missing.
+
+    Returns
+    -------
+    codes : np.ndarray
+        0 for NaN (missing data), 1 to `QUANTIZED_COLORS` over the color map range.
+    """
+    lo, hi = clim
+    z = np.asarray(z, dtype=np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if log:
+            z, lo, hi = np.log10(z), np.log10(lo), np.log10(hi)
+        codes = np.rint(1 + (z - lo) / (hi - lo) * (QUANTIZED_COLORS - 1))
+    codes = np.clip(codes, 1, QUANTIZED_COLORS)
+    codes[~np.isfinite(z)] = 0
+    return codes.astype(np.uint8)
+
+
+def quantized_ticks(clim, log=False, n=5):
+    """Colorbar ticks of a quantised image, see `quantize`.
+
+    Returns
+    -------
+    ticks : dict
+        Labels of the values by color code.
+    """
+    lo, hi = clim
+    if log:
+        values = 10.0 ** np.arange(np.ceil(np.log10(lo)), np.floor(np.log10(hi)) + 1)
+        if len(values) < 2:
+            values = np.geomspace(lo, hi, n)
+    else:
+        values = np.linspace(lo, hi, n)
+    codes = quantize(values, clim, log)
+    return {float(c): f"{v:.3g}" for c, v in zip(codes, values)}
+
+
+def hv_quantized_image(
+    x, y, z, clim, log=False, cmap="inferno", bad_color="lightgray", *args, **kwargs
+):
+    """Produce an image of uint8 color codes with a colorbar labelled in data values.
+
+    This is an eighth of the size of a float64 image when rendered by the browser.
+
+    Parameters
+    ----------
+    x, y : np.ndarray[:]
+        Location of pixel centres in each direction
+    z : np.ndarray[:, :]
+        Pixel (z-)values
+    clim : Tuple[float, float]
+        Color map range.
+    log : bool, optional
+        Logarithmic color scale.
+    cmap : str, optional
+        Name of the matplotlib color map.
+    bad_color : str, optional
+        Color of missing data.
+
+    Returns
+    -------
+    image : hv.Image
+    """
+    if log and clim[0] <= 0:
+        log = False
+    ticks = quantized_ticks(clim, log)
+    return hv.Image(
+        (x, y, quantize(z, clim, log)),
+        datatype=["image", "grid"],
+        *args,
+        **kwargs,
+    ).opts(
+        cmap=process_cmap(cmap, ncolors=QUANTIZED_COLORS, provider="matplotlib"),
+        clim=(0.5, QUANTIZED_COLORS + 0.5),
+        logz=False,
+        clipping_colors={"min": bad_color},
+        colorbar_opts={
+            "ticker": FixedTicker(ticks=list(ticks)),
+            "major_label_overrides": ticks,
+        },
+    )
@@ -0,0 +1,152 @@
+"""Multi-resolution pyramids of images, to show large arrays at screen resolution."""
+
+import logging
+import numpy as np
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Levels get downsampled until both axes are at most this long
+MIN_SIZE = 128
+
+
+def downsample(data, factor_y: int, factor_x: int):
+    """
+    Downsample a 2D array by averaging blocks, ignoring NaNs.
+
+    Parameters
+    ----------
+    data : np.ndarray[:, :]
+        Input data.
+    factor_y, factor_x : int
+        Block size along each axis. A trailing partial block gets averaged over the
+        samples it has.
+
+    Returns
+    -------
+    np.ndarray[:, :]
+        Block means, NaN for blocks without valid data.
+    """
+    ny, nx = data.shape
+    pad = ((0, -ny % factor_y), (0, -nx % factor_x))
+    data = np.pad(data.astype(np.float64), pad, constant_values=np.nan)
+    blocks = data.reshape(
+        data.shape[0] // factor_y, factor_y, data.shape[1] // factor_x, factor_x
+    )
+    valid = np.isfinite(blocks)
+    count = valid.sum(axis=(1, 3))
+    total = np.where(valid, blocks, 0).sum(axis=(1, 3))
+    with np.errstate(invalid="ignore"):
+        return total / count
+
+
+def _downsample_axis(ax, factor: int):
+    """Pixel centres of the downsampled axis."""
+    starts = np.arange(0, len(ax), factor)
+    return np.add.reduceat(ax, starts) / np.diff(np.append(starts, len(ax)))
+
+
+def _visible(ax, lim, margin: float):
+    """Slice of an axis within a range, widened by `margin` times the range each side."""
+    if lim is None or None in lim:
+        return slice(None)
+    lo, hi = sorted(lim)
+    lo, hi = lo - margin * (hi - lo), hi + margin * (hi - lo)
+    inside = np.flatnonzero((ax >= lo) & (ax <= hi))
+    if len(inside) == 0:
+        return slice(0, 0)
+    # Keep the neighbours, so that the range is covered up to the edge
+    return slice(max(inside[0] - 1, 0), inside[-1] + 2)
+
+
+class Pyramid:
+    """
+    Downsampled versions of an image, computed when needed.
+
+    Every level halves each axis longer than `min_size`, until no axis is.
+
+    Parameters
+    ----------
+    x, y : np.ndarray[:]
+        Pixel centres (regularly sampled).
+    data : np.ndarray[:, :]
+        Pixel values (y, x), NaN where masked.
+    min_size : int
+        Length below which an axis doesn't get downsampled further.
+    """
+
+    def __init__(self, x, y, data, min_size: int = MIN_SIZE):
+        self.min_size = min_size
+        self._levels = [(x, y, data)]
+        self._lock = threading.Lock()
+
+    def _factors(self, shape):
+        return tuple(2 if n > self.min_size else 1 for n in shape)
+
+    def level(self, index: int):
+        """
+        Get a level of the pyramid.
+
+        Parameters
+        ----------
+        index : int
+            0 is the full resolution. Higher levels than available return the coarsest.
+
+        Returns
+        -------
+        x, y : np.ndarray[:]
+            Pixel centres.
+        data : np.ndarray[:, :]
+            Pixel values.
+        """
+        with self._lock:
+            while len(self._levels) <= index:
+                x, y, data = self._levels[-1]
+                factor_y, factor_x = self._factors(data.shape)
+                if factor_y == factor_x == 1:
+                    break
+                logger.debug(f"Downsampling {data.shape} by {factor_y, factor_x}.")
+                self._levels.append(
+                    (
+                        _downsample_axis(x, factor_x),
+                        _downsample_axis(y, factor_y),
+                        downsample(data, factor_y, factor_x),
+                    )
+                )
+            return self._levels[min(index, len(self._levels) - 1)]
+
+    def select(self, x_range, y_range, width: int, height: int, margin: float = 0.5):
+        """
+        Get the coarsest level that still has a pixel per screen pixel in the viewport.
+
+        Parameters
+        ----------
+        x_range, y_range : Tuple[float, float]
+            Viewport. Either may be None for the whole axis.
+        width, height : int
+            Size of the viewport in screen pixels.
+        margin : float
+            Also return data this many times the viewport size around it (to pan into).
+
+        Returns
+        -------
+        x, y : np.ndarray[:]
+            Pixel centres.
+        data : np.ndarray[:, :]
+            Pixel values.
+        """
+        index = 0
+        while True:
+            x, y, data = self.level(index + 1)
+            if data is self.level(index)[2]:
+                break
+            sx = _visible(x, x_range, 0)
+            sy = _visible(y, y_range, 0)
+            if len(x[sx]) < width or len(y[sy]) < height:
+                break
+            index += 1
+
+        x, y, data = self.level(index)
+        sx = _visible(x, x_range, margin)
+        sy = _visible(y, y_range, margin)
+        return x[sx], y[sy], data[sy, sx]
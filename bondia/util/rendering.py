@@ -0,0 +1,160 @@
+"""Choice of how to render a plot, from the data size, viewport and server load."""
+
+import json
+import logging
+import numpy as np
+import os
+import threading
+import time
+
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Send the data to the browser as it is
+RAW = "raw"
+# Aggregate the data to the viewport on the server
+RASTERIZE = "rasterize"
+# Send a level of a precomputed pyramid matching the viewport
+PYRAMID = "pyramid"
+
+# Number of latencies kept per decision
+HISTORY = 1000
+
+
+class RenderingStrategy:
+    """
+    Decide per plot whether to send raw data, rasterize or use a pyramid level.
+
+    Parameters
+    ----------
+    raw_ratio : float
+        Send data raw if it has at most this many pixels per screen pixel.
+    max_raw_pixels : int
+        Send data with up to this many pixels raw if the server is loaded.
+    max_load : float
+        Server load (1 minute load average per CPU) above which to avoid rasterizing.
+    log_file : os.PathLike
+        Append every latency measured to this file (JSON lines). Optional.
+    """
+
+    def __init__(
+        self,
+        raw_ratio: float = 4,
+        max_raw_pixels: int = 4_000_000,
+        max_load: float = 0.8,
+        log_file: os.PathLike = None,
+    ):
+        self.raw_ratio = raw_ratio
+        self.max_raw_pixels = max_raw_pixels
+        self.max_load = max_load
+        self.log_file = log_file
+        self._latency = {}
+        self._lock = threading.Lock()
+
+    def configure(self, **kwargs):
+        """Change the thresholds or log file (see the class parameters)."""
+        for key, value in kwargs.items():
+            if not hasattr(self, key) or key.startswith("_"):
+                raise ValueError(f"Unknown rendering option '{key}'.")
+            setattr(self, key, value)
+
+    @staticmethod
+    def load():
+        """Get the 1 minute load average per CPU (0 if unknown)."""
+        try:
+            return os.getloadavg()[0] / (os.cpu_count() or 1)
+        except OSError:
+            return 0
+
+    def choose(self, shape, viewport, pyramid: bool = False):
+        """
+        Decide how to render data.
+
+        Parameters
+        ----------
+        shape : Tuple[int, ...]
+            Shape of the data shown.
+        viewport : Tuple[int, int]
+            Width and height of the plot in pixels.
+        pyramid : bool
+            If the plot has a pyramid of the data (see `bondia.util.pyramid`).
+
+        Returns
+        -------
+        str
+            `RAW`, `RASTERIZE` or `PYRAMID`
+        """
+        pixels = int(np.prod(shape))
+        screen = viewport[0] * viewport[1]
+        if pixels <= self.raw_ratio * screen:
+            decision = RAW
+        elif pyramid:
+            decision = PYRAMID
+        elif pixels <= self.max_raw_pixels and self.load() > self.max_load:
+            decision = RAW
+        else:
+            decision = RASTERIZE
+        logger.debug(f"Rendering {shape} in {viewport} viewport: {decision}.")
+        return decision
+
+    @contextmanager
+    def timed(self, decision: str, shape):
+        """
+        Measure the latency of rendering with a decision.
+
+        Parameters
+        ----------
+        decision : str
+            See `choose`.
+        shape : Tuple[int, ...]
+            Shape of the data rendered.
+        """
+        start = time.perf_counter()
+        yield
+        self.record(decision, shape, time.perf_counter() - start)
+
+    def record(self, decision: str, shape, seconds: float):
+        """Record the latency of rendering data of a shape with a decision."""
+        entry = {
+            "time": time.time(),
+            "decision": decision,
+            "pixels": int(np.prod(shape)),
+            "load": self.load(),
+            "seconds": seconds,
+        }
+        with self._lock:
+            self._latency.setdefault(decision, deque(maxlen=HISTORY)).append(entry)
+            if self.log_file is not None:
+                try:
+                    with open(self.log_file, "a") as f:
+                        f.write(json.dumps(entry) + "\n")
+                except OSError as err:
+                    logger.error(
+                        f"Failure writing rendering log {self.log_file}: {err}"
+                    )
+
+    def stats(self):
+        """
+        Summarize the latencies recorded.
+
+        Returns
+        -------
+        Dict[str, Dict[str, float]]
+            Number, median and 95th percentile of the latencies (seconds) per decision.
+        """
+        with self._lock:
+            latency = {d: [e["seconds"] for e in l] for d, l in self._latency.items()}
+        return {
+            decision: {
+                "count": len(seconds),
+                "median": float(np.median(seconds)),
+                "p95": float(np.percentile(seconds, 95)),
+            }
+            for decision, seconds in latency.items()
+        }
+
+
+# Shared by all plots of all sessions of this process
+rendering_strategy = RenderingStrategy()
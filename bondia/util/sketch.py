@@ -0,0 +1,238 @@
+"""Quantile sketches of the validation data, used to pick colour map ranges quickly."""
+
+import h5py
+import logging
+import numpy as np
+import warnings
+
+from typing import Dict
+
+from bondia.util.files import atomic_output
+from bondia.util.kernels import nanmedian_columns
+
+logger = logging.getLogger(__name__)
+
+# Name of the sketch file in each day directory
+SKETCH_FILE_NAME = "validation_sketch_lsd_{lsd}.h5"
+
+# Percentiles stored per data plane
+PERCENTILES = np.linspace(0, 100, 201)
+
+
+def _decode(values):
+    return [v.decode() if isinstance(v, bytes) else str(v) for v in values]
+
+
+def _quantiles(values):
+    """Percentiles of the valid (finite, non-zero) values of an array."""
+    values = values[np.isfinite(values) & (values != 0)]
+    if values.size == 0:
+        return np.full(len(PERCENTILES), np.nan)
+    return np.percentile(values, PERCENTILES)
+
+
+def _mean_pol(pols):
+    """Indices of XX and YY, or None if one of them is missing."""
+    if "XX" in pols and "YY" in pols:
+        return [pols.index("XX"), pols.index("YY")]
+    return None
+
+
+def ringmap_sketch(data, mean_pol=None):
+    """
+    Sketch a ringmap container.
+
+    The map is read one (beam, pol, freq) plane at a time.
+
+    Parameters
+    ----------
+    data : h5py.Group or caput container
+        Holding the dataset `map`.
+    mean_pol : str
+        Label for the mean of XX and YY. If given, the sketch gets an extra
+        polarisation holding the mean.
+
+    Returns
+    -------
+    Dict[str, np.ndarray]
+        Labels `beam`, `pol`, `freq` (centres) and sketches `map` and
+        `map_crosstalk_removed` (median over RA subtracted) of shape
+        (beam, pol, freq, percentile).
+    """
+    rmap = data["map"]
+    beams = data["index_map/beam"][:]
+    pols = _decode(data["index_map/pol"][:])
+    freqs = np.array([f[0] for f in data["index_map/freq"][:]])
+    mean = _mean_pol(pols) if mean_pol else None
+    labels = pols + [mean_pol] if mean else pols
+
+    shape = (len(beams), len(labels), len(freqs), len(PERCENTILES))
+    raw = np.full(shape, np.nan)
+    crosstalk_removed = np.full(shape, np.nan)
+    for ibeam in range(len(beams)):
+        for ifreq in range(len(freqs)):
+            planes = {}
+            for ipol in range(len(pols)):
+                planes[ipol] = rmap[ibeam, ipol, ifreq]
+            if mean:
+                with warnings.catch_warnings():
+                    warnings.filterwarnings("ignore", r"Mean of empty slice")
+                    planes[len(pols)] = np.nanmean([planes[i] for i in mean], axis=0)
+            for ipol, plane in planes.items():
+                plane = np.where(plane == 0, np.nan, plane)
+                raw[ibeam, ipol, ifreq] = _quantiles(plane)
+                plane = plane - nanmedian_columns(plane)
+                crosstalk_removed[ibeam, ipol, ifreq] = _quantiles(plane)
+    return {
+        "beam": beams,
+        "pol": np.array(labels, dtype="S"),
+        "freq": freqs,
+        "map": raw,
+        "map_crosstalk_removed": crosstalk_removed,
+    }
+
+
+def sensitivity_sketch(data, mean_pol=None):
+    """
+    Sketch a system sensitivity container.
+
+    Parameters
+    ----------
+    data : h5py.Group or caput container
+        Holding the datasets `measured` and `radiometer`.
+    mean_pol : str
+        Label for the mean of XX and YY. If given, the sketch gets an extra
+        polarisation holding the mean.
+
+    Returns
+    -------
+    Dict[str, np.ndarray]
+        Labels `pol` and sketches `measured` and `measured_over_radiometer` of shape
+        (pol, percentile).
+    """
+    pols = _decode(data["index_map/pol"][:])
+    mean = _mean_pol(pols) if mean_pol else None
+    labels = pols + [mean_pol] if mean else pols
+
+    measured = {}
+    radiometer = {}
+    for ipol in range(len(pols)):
+        measured[ipol] = data["measured"][:, ipol]
+        radiometer[ipol] = data["radiometer"][:, ipol]
+    if mean:
+        measured[len(pols)] = np.mean([measured[i] for i in mean], axis=0)
+        radiometer[len(pols)] = np.mean([radiometer[i] for i in mean], axis=0)
+
+    shape = (len(labels), len(PERCENTILES))
+    sketch = {"measured": np.full(shape, np.nan)}
+    sketch["measured_over_radiometer"] = np.full(shape, np.nan)
+    for ipol in measured:
+        sketch["measured"][ipol] = _quantiles(measured[ipol])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratio = measured[ipol] / radiometer[ipol]
+        sketch["measured_over_radiometer"][ipol] = _quantiles(ratio)
+    sketch["pol"] = np.array(labels, dtype="S")
+    return sketch
+
+
+def delayspectrum_sketch(data):
+    """
+    Sketch a delay spectrum container per cylinder separation.
+
+    Parameters
+    ----------
+    data : h5py.Group or caput container
+        Holding the dataset `spectrum`.
+
+    Returns
+    -------
+    Dict[str, np.ndarray]
+        Labels `cylinder_separation` (E-W baseline rounded to meters) and sketch
+        `spectrum` of shape (cylinder_separation, percentile).
+    """
+    x = data["index_map/baseline"][:, 0]
+    ux, uix = np.unique(np.round(x).astype(int), return_inverse=True)
+    sketch = np.full((len(ux), len(PERCENTILES)), np.nan)
+    for pp in range(len(ux)):
+        sketch[pp] = _quantiles(data["spectrum"][np.flatnonzero(uix == pp)])
+    return {"cylinder_separation": ux, "spectrum": sketch}
+
+
+def write_sketch(path, sketches: Dict[str, Dict[str, np.ndarray]]):
+    """
+    Write the sketches of one day.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Sketch file. It gets replaced atomically.
+    sketches : Dict[str, Dict[str, np.ndarray]]
+        Sketches by file type.
+    """
+    with atomic_output(path) as tmp_file, h5py.File(tmp_file, "w") as f:
+        f.attrs["percentiles"] = PERCENTILES
+        for file_type, sketch in sketches.items():
+            group = f.create_group(file_type)
+            for key, values in sketch.items():
+                group.create_dataset(key, data=values)
+
+
+def read_sketch(path):
+    """
+    Read the sketches of one day.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Sketch file.
+
+    Returns
+    -------
+    Dict[str, Dict]
+        Sketches by file type. Polarisation labels are decoded to lists of strings.
+        Includes the `percentiles`.
+    """
+    with h5py.File(path, "r") as f:
+        sketches = {"percentiles": f.attrs["percentiles"][:]}
+        for file_type, group in f.items():
+            sketches[file_type] = {key: dset[:] for key, dset in group.items()}
+            if "pol" in sketches[file_type]:
+                sketches[file_type]["pol"] = _decode(sketches[file_type]["pol"])
+    return sketches
+
+
+def sketch_range(sketch, percentiles, limits=(1, 99), positive=False):
+    """
+    Get a robust value range from sketches.
+
+    Parameters
+    ----------
+    sketch : np.ndarray
+        One or more sketches, with the percentiles on the last axis.
+    percentiles : np.ndarray
+        The percentiles stored in the sketch.
+    limits : Tuple[float, float]
+        Percentiles to use as lower and upper limit.
+    positive : bool
+        Make the lower limit positive (e.g. for a logarithmic colour scale), using the
+        smallest positive value in the sketch if needed.
+
+    Returns
+    -------
+    Tuple[float, float] or None
+        Lower and upper limit over all sketches given. None if the sketches are empty.
+    """
+    sketch = np.asarray(sketch).reshape(-1, len(percentiles))
+    sketch = sketch[np.isfinite(sketch).all(axis=-1)]
+    if len(sketch) == 0:
+        return None
+    lower = np.array([np.interp(limits[0], percentiles, s) for s in sketch]).min()
+    upper = np.array([np.interp(limits[1], percentiles, s) for s in sketch]).max()
+    if positive and lower <= 0:
+        positive_values = sketch[sketch > 0]
+        if positive_values.size == 0:
+            return None
+        lower = positive_values.min()
+    if not lower < upper:
+        return None
+    return lower, upper
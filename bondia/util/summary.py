@@ -0,0 +1,209 @@
+"""Per-day summary statistics of the validation data, stored in one table per revision."""
+
+import h5py
+import logging
+import numpy as np
+
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+# Name of the summary table file in each revision directory
+SUMMARY_FILE_NAME = "validation_summary.h5"
+
+# Scale factor turning the median absolute deviation into a standard deviation estimate
+MAD_TO_STD = 1.4826
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+
+def sensitivity_stats(data):
+    """
+    Summarize a system sensitivity container.
+
+    Parameters
+    ----------
+    data : h5py.Group or caput container
+        Holding the datasets `measured` and `radiometer`.
+
+    Returns
+    -------
+    Dict[str, float]
+        Median of measured over radiometer sensitivity per polarisation and the
+        fraction of flagged (zero) samples.
+    """
+    stats = {}
+    num_flagged = 0
+    num_total = 0
+    for ipol, pol in enumerate(data["index_map/pol"][:]):
+        measured = data["measured"][:, ipol]
+        radiometer = data["radiometer"][:, ipol]
+        valid = (measured != 0) & (radiometer != 0)
+        valid &= np.isfinite(measured) & np.isfinite(radiometer)
+        num_flagged += np.count_nonzero(measured == 0)
+        num_total += measured.size
+        stats[f"sensitivity_ratio_median_{_decode(pol)}"] = (
+            np.median(measured[valid] / radiometer[valid]) if valid.any() else np.nan
+        )
+    stats["sensitivity_flagged_fraction"] = num_flagged / max(num_total, 1)
+    return stats
+
+
+def rfi_stats(data, invert=False):
+    """
+    Summarize an RFI mask container.
+
+    Parameters
+    ----------
+    data : h5py.Group or caput container
+        Holding the dataset `mask`.
+    invert : bool
+        Whether the mask is True for good data.
+
+    Returns
+    -------
+    Dict[str, float]
+        Fraction of data masked.
+    """
+    mask = data["mask"][:]
+    if invert:
+        mask = ~mask
+    return {"rfi_masked_fraction": np.count_nonzero(mask) / max(mask.size, 1)}
+
+
+def ringmap_stats(data, prefix="ringmap"):
+    """
+    Summarize a ringmap container.
+
+    The map is read one (beam, pol, freq) plane at a time.
+
+    Parameters
+    ----------
+    data : h5py.Group or caput container
+        Holding the dataset `map`.
+    prefix : str
+        Prefix for the names of the statistics.
+
+    Returns
+    -------
+    Dict[str, float]
+        RMS over all beams, RA and elevation per frequency and polarisation, ignoring
+        flagged (zero) data, and the fraction of flagged data.
+    """
+    rmap = data["map"]
+    freqs = data["index_map/freq"][:]
+    pols = data["index_map/pol"][:]
+    nbeam = rmap.shape[0]
+
+    stats = {}
+    num_flagged = 0
+    num_total = 0
+    for ipol, pol in enumerate(pols):
+        for ifreq, freq in enumerate(freqs):
+            sum_sq = 0.0
+            count = 0
+            for ibeam in range(nbeam):
+                plane = rmap[ibeam, ipol, ifreq]
+                valid = (plane != 0) & np.isfinite(plane)
+                num_flagged += plane.size - np.count_nonzero(valid)
+                num_total += plane.size
+                sum_sq += np.sum(np.square(plane[valid], dtype=np.float64))
+                count += np.count_nonzero(valid)
+            rms = np.sqrt(sum_sq / count) if count else np.nan
+            stats[f"{prefix}_rms_{freq[0]:.0f}MHz_{_decode(pol)}"] = rms
+    stats[f"{prefix}_flagged_fraction"] = num_flagged / max(num_total, 1)
+    return stats
+
+
+def append_summary(path, lsd: int, stats: Dict[str, float]):
+    """
+    Add statistics of one day to a summary table.
+
+    The table is an HDF5 file with one 1D dataset per column and a column `lsd`. If the
+    day is in the table already, the given columns of its row are overwritten. Columns
+    missing for a day are NaN.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Summary table file. Created if it doesn't exist.
+    lsd : int
+        Day.
+    stats : Dict[str, float]
+        Values by column name.
+    """
+    with h5py.File(path, "a") as f:
+        if "lsd" not in f:
+            f.create_dataset("lsd", shape=(0,), maxshape=(None,), dtype=np.int64)
+        lsds = f["lsd"][:]
+        row = np.flatnonzero(lsds == lsd)
+        if len(row):
+            row = row[0]
+        else:
+            row = len(lsds)
+            for dset in f.values():
+                dset.resize((row + 1,))
+                dset[row] = np.nan if dset.dtype.kind == "f" else 0
+            f["lsd"][row] = lsd
+
+        for column, value in stats.items():
+            if column not in f:
+                f.create_dataset(
+                    column,
+                    data=np.full(len(f["lsd"]), np.nan),
+                    maxshape=(None,),
+                    dtype=np.float64,
+                )
+            f[column][row] = value
+
+
+def read_summary(path):
+    """
+    Read a summary table.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        Summary table file.
+
+    Returns
+    -------
+    Dict[str, np.ndarray]
+        Columns by name, sorted by `lsd`.
+    """
+    with h5py.File(path, "r") as f:
+        table = {column: dset[:] for column, dset in f.items()}
+    order = np.argsort(table["lsd"])
+    return {column: values[order] for column, values in table.items()}
+
+
+def anomaly_scores(table: Dict[str, np.ndarray]):
+    """
+    Score how unusual each day in a summary table is.
+
+    The score of a day is the largest robust z-score (deviation from the median in units
+    of the scaled median absolute deviation) of any of its statistics.
+
+    Parameters
+    ----------
+    table : Dict[str, np.ndarray]
+        Summary table as returned by `read_summary`.
+
+    Returns
+    -------
+    Dict[int, float]
+        Anomaly score by LSD. Days without any statistics get a score of 0.
+    """
+    scores = np.zeros(len(table["lsd"]))
+    for column, values in table.items():
+        if column == "lsd" or not np.isfinite(values).any():
+            continue
+        median = np.nanmedian(values)
+        mad = np.nanmedian(np.abs(values - median)) * MAD_TO_STD
+        if mad == 0:
+            continue
+        z = np.abs(values - median) / mad
+        scores = np.fmax(scores, z)
+    return dict(zip(table["lsd"].tolist(), scores.tolist()))
@@ -32,6 +32,7 @@ setuptools.setup(
         "bondia.scripts": [
             "val_preprocess.py",
             "val_preprocess.sbatch",
+            "val_preprocess_merge.sbatch",
             "val_preprocess.sh",
         ],
     },
@@ -0,0 +1,83 @@
+import datetime
+import h5py
+import numpy as np
+import pytest
+
+from bondia.data import (
+    BUNDLE_FILE_NAME,
+    CONTAINER_TYPES,
+    LSD,
+    DataLoader,
+    close_container,
+    load_container,
+)
+from bondia.util.day import Day
+
+REV = "rev_00"
+
+
+def write_bundle(path, lsd):
+    """Write a validation bundle holding an RFI mask, like `val_preprocess.py` does."""
+    path.mkdir(parents=True)
+    freq = np.zeros(4, dtype=[("centre", np.float64), ("width", np.float64)])
+    freq["centre"] = np.linspace(800.0, 400.0, 4)
+    mask = np.arange(4 * 8).reshape(4, 8) % 3 == lsd % 3
+    with h5py.File(path / BUNDLE_FILE_NAME.format(lsd=lsd), "w") as f:
+        group = f.create_group("rfi")
+        group["index_map/freq"] = freq
+        group["index_map/time"] = np.arange(8, dtype=np.float64)
+        dset = group.create_dataset("mask", data=mask)
+        dset.attrs["axis"] = np.array(["freq", "time"], dtype="S")
+    return path / BUNDLE_FILE_NAME.format(lsd=lsd), mask
+
+
+@pytest.mark.parametrize("ondisk", [False, True])
+def test_load_container_from_bundle(tmp_path, ondisk):
+    path, mask = write_bundle(tmp_path / "1878", 1878)
+    cont = load_container(CONTAINER_TYPES["rfi"], path, group="rfi", ondisk=ondisk)
+
+    np.testing.assert_array_equal(cont.mask[:], mask)
+    np.testing.assert_array_equal(cont.freq, np.linspace(800.0, 400.0, 4))
+    np.testing.assert_array_equal(cont.index_map["time"], np.arange(8))
+
+    # Only lazily loaded containers keep the file open
+    assert isinstance(cont._data, h5py.Group) == ondisk
+    if ondisk:
+        f = cont._data.file
+        close_container(cont)
+        assert not f.id.valid
+    else:
+        close_container(cont)
+        np.testing.assert_array_equal(cont.mask[:], mask)
+
+
+@pytest.mark.parametrize("ondisk", [False, True])
+def test_evict_bundle_container(tmp_path, ondisk):
+    loader = DataLoader()
+    loader.max_days_in_memory = 1
+    loader.ondisk = ["rfi"] if ondisk else []
+    days = [
+        Day(1878, datetime.date(2019, 11, 18)),
+        Day(1879, datetime.date(2019, 11, 19)),
+    ]
+    masks = {}
+    loader._index[REV] = {}
+    for day in days:
+        path = tmp_path / REV / str(day.lsd)
+        masks[day] = write_bundle(path, day.lsd)[1]
+        loader._index[REV][day] = LSD(str(path), REV, day)
+        assert loader._index[REV][day].bundled == {"rfi"}
+
+    first = loader.load_file(REV, days[0], "rfi")
+    np.testing.assert_array_equal(first.mask[:], masks[days[0]])
+    f = first._data.file if ondisk else None
+
+    # Loading the second day drops the first one from memory
+    second = loader.load_file(REV, days[1], "rfi")
+    np.testing.assert_array_equal(second.mask[:], masks[days[1]])
+    assert not loader.is_loaded(REV, days[0], "rfi")
+    assert loader.is_loaded(REV, days[1], "rfi")
+    if ondisk:
+        assert not f.id.valid
+        assert second._data.file.id.valid
+        close_container(second)
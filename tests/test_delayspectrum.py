@@ -0,0 +1,51 @@
+import numpy as np
+
+from bondia.plot.delayspectrum import DelaySpectrumBase, baseline_layout
+
+
+class FakeSpectrum:
+    def __init__(self, baselines, spectrum):
+        self.index_map = {"baseline": baselines}
+        self.spectrum = spectrum
+
+
+def test_baseline_layout_shared():
+    baselines = np.array([[0.1, 2.0], [22.0, -1.0], [0.0, -3.0], [21.9, 4.0]])
+    layout = baseline_layout(baselines)
+
+    # Same content, different array: same layout
+    assert baseline_layout(baselines.copy()) is layout
+
+    assert [group[0] for group in layout] == [22, 0]
+    np.testing.assert_array_equal(layout[0][3], [1, 3])
+    np.testing.assert_array_equal(layout[1][2], [-3.0, 2.0])
+    np.testing.assert_array_equal(layout[1][1], [-3.0, 2.0])
+
+
+def test_cylinder_panels():
+    baselines = np.array([[0.1, 2.0], [22.0, -1.0], [0.0, -3.0], [21.9, 4.0]])
+    spectrum = np.ones((4, 3))
+    # No data for the first 0m baseline, nor the 22m separation
+    spectrum[[0, 1, 3]] = 0
+
+    panels = DelaySpectrumBase._cylinder_panels(FakeSpectrum(baselines, spectrum))
+    assert len(panels) == 1
+    pux, range_y, y, data = panels[0]
+    assert pux == 0
+    np.testing.assert_array_equal(range_y, [-3.0, 2.0])
+    np.testing.assert_array_equal(y, [-3.0])
+    np.testing.assert_array_equal(data, spectrum[[2]])
+
+
+def test_pack_mosaic():
+    panels = [
+        (22, None, np.array([-3.0, 1.0, 4.0]), np.ones((3, 5))),
+        (0, None, np.array([2.0, 5.0]), np.full((2, 5), 2.0)),
+    ]
+    mosaic, ticks, titles, zeros = DelaySpectrumBase._pack_mosaic(panels)
+
+    # Smallest separation first, separated by NaN rows
+    np.testing.assert_array_equal(mosaic[:, 0], [2, 2, np.nan, np.nan, 1, 1, 1])
+    assert ticks == [(0, "2"), (1, "5"), (4, "-3"), (6, "4")]
+    assert titles == [(0.5, "x = 0 m"), (5.0, "x = 22 m")]
+    np.testing.assert_allclose(zeros, [4.75])
@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+
+from functools import lru_cache
+
+from bondia.util import flags
+from bondia.util.flags import flag_index, flag_index_mask, get_flag_index_cached
+
+SIDEREAL_DAY = 86164.1
+
+
+def unix_to_csd(t):
+    return np.asarray(t, dtype=np.float64) / SIDEREAL_DAY
+
+
+@pytest.fixture(autouse=True)
+def csd(monkeypatch):
+    monkeypatch.setattr(flags, "unix_to_csd", unix_to_csd)
+
+
+def loop_mask(flag_time_spans, csd_arr):
+    """The mask as built with one comparison per flag."""
+    flag_mask = np.zeros_like(csd_arr, dtype=bool)
+    for type_, ca, cb in flag_time_spans:
+        flag_mask[(csd_arr > unix_to_csd(ca)) & (csd_arr < unix_to_csd(cb))] = True
+    return flag_mask
+
+
+def unix(csd):
+    return csd * SIDEREAL_DAY
+
+
+def test_flag_index_mask():
+    rng = np.random.default_rng(0)
+    starts = rng.uniform(9.5, 12.5, 50)
+    spans = [
+        ("rain", unix(s), unix(s + d))
+        for s, d in zip(starts, rng.exponential(0.05, 50))
+    ]
+    # Touching and nested flags, and flags crossing day boundaries
+    spans += [
+        ("bad_calibration", unix(10.2), unix(10.3)),
+        ("bad_calibration", unix(10.3), unix(10.4)),
+        ("misc", unix(10.9), unix(11.1)),
+        ("misc", unix(10.95), unix(11.0)),
+        ("misc", unix(11.8), unix(13.2)),
+    ]
+
+    index = flag_index(spans)
+    start, end = index
+    assert np.all(np.diff(start) > 0)
+    assert np.all(start[1:] >= end[:-1])
+
+    for lsd in [10, 11, 12]:
+        csd = lsd + np.linspace(0, 360, 4096, endpoint=False) / 360.0
+        np.testing.assert_array_equal(
+            flag_index_mask(index, csd), loop_mask(spans, csd)
+        )
+    # Samples on interval edges
+    csd = np.array([10.2, 10.3, 10.4, 10.9, 11.1])
+    np.testing.assert_array_equal(flag_index_mask(index, csd), loop_mask(spans, csd))
+
+
+def test_flag_index_empty():
+    index = flag_index([])
+    csd = 10 + np.linspace(0, 1, 16)
+    assert not flag_index_mask(index, csd).any()
+    assert flag_index_mask(flag_index([("misc", 0, 1)]), []).shape == (0,)
+
+
+def test_flag_index_open():
+    # A flag without an end is still active
+    index = flag_index([("misc", unix(10.5), None)])
+    csd = np.array([10.25, 10.75, 12.0])
+    np.testing.assert_array_equal(flag_index_mask(index, csd), [False, True, True])
+
+
+def test_get_flag_index_cached(monkeypatch):
+    db = {
+        "rain": [("rain", unix(10.1), unix(10.2)), ("rain", unix(11.9), unix(12.1))],
+        "misc": [("misc", unix(10.15), unix(10.5))],
+    }
+    queries = []
+
+    @lru_cache(maxsize=None)
+    def get_one_flag_type(flag_type):
+        queries.append(flag_type)
+        return db[flag_type]
+
+    monkeypatch.setattr(flags, "get_one_flag_type", get_one_flag_type)
+    flags._flag_index_of_types.cache_clear()
+
+    index = get_flag_index_cached(["rain", "misc"])
+    expected = flag_index(db["rain"] + db["misc"])
+    np.testing.assert_array_equal(index[0], expected[0])
+    np.testing.assert_array_equal(index[1], expected[1])
+
+    # The order of flag types doesn't matter
+    assert get_flag_index_cached(["misc", "rain"]) is index
+    assert sorted(queries) == ["misc", "rain"]
+
+    # Fresh flags after the cache reset time
+    db["misc"] = []
+    index = get_flag_index_cached(["rain", "misc"], cache_reset_time=0)
+    np.testing.assert_array_equal(index[0], unix_to_csd([unix(10.1), unix(11.9)]))
+    assert len(queries) == 4
+    flags._flag_index_of_types.cache_clear()
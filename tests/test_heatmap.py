@@ -0,0 +1,15 @@
+from bondia.plot.heatmap import _snap_viewport
+
+
+def test_snap_viewport():
+    # Similar viewports render the same tiles
+    assert _snap_viewport((10.3, 55.1), 1200) == (10.0, 56.0, 1472)
+    assert _snap_viewport((55.0, 10.5), 1199) == (10.0, 56.0, 1472)
+
+    # At least the resolution requested
+    lo, hi, pixels = _snap_viewport((0, 360), 1200)
+    assert lo <= 0 and hi >= 360
+    assert pixels / (hi - lo) >= 1200 / 360
+
+    # Empty range
+    assert _snap_viewport((5, 5), 100) == (5, 5, 100)
@@ -0,0 +1,64 @@
+import numpy as np
+import warnings
+
+from bondia.util.kernels import (
+    mask_plane,
+    mask_sensitivity,
+    nanmedian_columns,
+    subtract_plane,
+)
+
+
+def test_mask_and_subtract_plane():
+    data = np.arange(12, dtype=np.float32).reshape(4, 3)
+    row_mask = np.array([False, True, False, False])
+
+    masked = mask_plane(data, row_mask, np.empty_like(data))
+    expected = np.where(row_mask[:, np.newaxis] | (data == 0), np.nan, data)
+    assert np.array_equal(masked, expected, equal_nan=True)
+
+    offset = np.array([1.0, 2.0, 3.0])
+    template = np.ones((4, 3))
+    out = subtract_plane(masked, offset, template, np.empty_like(masked))
+    assert np.array_equal(out, masked - offset - template, equal_nan=True)
+    out = subtract_plane(masked, np.zeros(0), np.zeros((0, 0)), np.empty_like(masked))
+    assert np.array_equal(out, masked, equal_nan=True)
+
+
+def test_mask_sensitivity():
+    data = np.array([[1.0, 2.0, 0.0], [4.0, 5.0, 6.0]])
+    time_mask = np.array([True, False, False])
+    rfi = np.array([[False, False, False], [False, True, False]])
+    estimate = np.array([[1.0, 0.0, 1.0], [2.0, 2.0, 2.0]])
+
+    out = mask_sensitivity(data, time_mask, rfi, estimate, np.empty_like(data))
+    expected = np.array([[np.nan, np.nan, np.nan], [np.nan, np.nan, 3.0]])
+    assert np.array_equal(out, expected, equal_nan=True)
+
+
+def test_nanmedian_columns():
+    rng = np.random.default_rng(0)
+    data = rng.standard_normal((101, 7))
+    data[rng.random(data.shape) < 0.2] = np.nan
+    data[:, 0] = np.nan
+    data[1:, 1] = np.nan
+    data[2:, 2] = np.nan
+
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", r"All-NaN slice encountered")
+        expected = np.nanmedian(data, axis=0)
+    assert np.allclose(nanmedian_columns(data), expected, equal_nan=True)
+    assert np.allclose(
+        nanmedian_columns(data.astype(np.float32)),
+        expected.astype(np.float32),
+        equal_nan=True,
+    )
+
+    # A ringmap-like plane (RA, el) of float32 with flagged columns
+    plane = rng.standard_normal((512, 64)).astype(np.float32)
+    plane[rng.random(plane.shape) < 0.1] = np.nan
+    plane[:, :2] = np.nan
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", r"All-NaN slice encountered")
+        expected = np.nanmedian(plane, axis=0)
+    assert np.allclose(nanmedian_columns(plane), expected, equal_nan=True)
@@ -0,0 +1,55 @@
+import numpy as np
+
+from bondia.util.plotting import find_splits, pad_gaps, quantize, quantized_ticks
+
+
+def test_find_splits():
+    ax = np.array([0.0, 1.0, 2.0, 5.0, 6.0, 7.05, 9.0])
+    assert find_splits(ax) == [(0, 3), (3, 6), (6, 7)]
+    assert find_splits(ax[:1]) == [(0, 1)]
+
+    # Descending axis without gaps
+    assert find_splits(np.linspace(800, 400, 5)) == [(0, 5)]
+
+
+def test_pad_gaps():
+    x = np.array([0.0, 1.0, 2.0, 5.0, 6.0])
+    y = np.array([800.0, 799.0, 798.0])
+    z = np.arange(15.0).reshape(3, 5)
+
+    px, py, pz = pad_gaps(x, y, z)
+    np.testing.assert_array_equal(px, np.arange(7.0))
+    np.testing.assert_array_equal(py, y)
+    assert np.isnan(pz[:, 3:5]).all()
+    np.testing.assert_array_equal(pz[:, [0, 1, 2, 5, 6]], z)
+
+    # Nothing to pad
+    assert pad_gaps(px, py, pz)[2] is pz
+
+
+def test_quantize():
+    codes = quantize([np.nan, 0.0, 5.0, 10.0, 20.0, -1.0], (0, 10))
+    assert codes.dtype == np.uint8
+    np.testing.assert_array_equal(codes, [0, 1, 128, 255, 255, 1])
+
+    # Logarithmic: non-positive values are missing
+    codes = quantize([0.001, 1.0, 1000.0, 0.0], (0.001, 1000), log=True)
+    np.testing.assert_array_equal(codes, [1, 128, 255, 0])
+
+
+def test_quantized_ticks():
+    assert quantized_ticks((0, 10)) == {
+        1.0: "0",
+        64.0: "2.5",
+        128.0: "5",
+        192.0: "7.5",
+        255.0: "10",
+    }
+    assert list(quantized_ticks((0.01, 1000), log=True).values()) == [
+        "0.01",
+        "0.1",
+        "1",
+        "10",
+        "100",
+        "1e+03",
+    ]
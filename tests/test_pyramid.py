@@ -0,0 +1,37 @@
+import numpy as np
+
+from bondia.util.pyramid import Pyramid, downsample
+
+
+def test_downsample():
+    data = np.arange(12.0).reshape(3, 4)
+    data[0, 0] = np.nan
+    data[2, 2:] = np.nan
+
+    out = downsample(data, 2, 2)
+    np.testing.assert_allclose(out[0], [(1 + 4 + 5) / 3, (2 + 3 + 6 + 7) / 4])
+    # Partial block
+    assert out[1, 0] == 8.5
+    assert np.isnan(out[1, 1])
+
+
+def test_pyramid_select():
+    x = np.arange(1024.0)
+    y = np.linspace(800, 400, 512, endpoint=False)
+    data = np.ones((512, 1024))
+    pyramid = Pyramid(x, y, data, min_size=64)
+
+    # Whole image on a small screen: coarsest level that still fills it
+    px, py, pdata = pyramid.select(None, None, width=200, height=100)
+    assert pdata.shape == (128, 256)
+    assert len(px) == 256 and len(py) == 128
+    np.testing.assert_allclose(px[:2], [1.5, 5.5])
+
+    # Zoomed in: full resolution, only around the viewport
+    px, py, pdata = pyramid.select((0, 100), (700, 600), width=200, height=100)
+    assert pdata.shape == (len(py), len(px))
+    assert px[0] == 0 and px[-1] < 200
+    assert py.max() <= 800 and py.min() > 500
+
+    # Can't go below the minimum size
+    assert pyramid.level(100)[2].shape == (64, 64)
@@ -0,0 +1,41 @@
+import json
+import pytest
+
+from bondia.util.rendering import PYRAMID, RASTERIZE, RAW, RenderingStrategy
+
+
+def test_choose(monkeypatch):
+    strategy = RenderingStrategy(raw_ratio=2, max_raw_pixels=1000, max_load=0.5)
+    monkeypatch.setattr(RenderingStrategy, "load", staticmethod(lambda: 0.1))
+
+    # Small enough to send
+    assert strategy.choose((20, 10), (10, 10)) == RAW
+    assert strategy.choose((30, 10), (10, 10)) == RASTERIZE
+    assert strategy.choose((30, 10), (10, 10), pyramid=True) == PYRAMID
+
+    # Don't add aggregation to a loaded server, unless the data is too large
+    monkeypatch.setattr(RenderingStrategy, "load", staticmethod(lambda: 0.9))
+    assert strategy.choose((30, 10), (10, 10)) == RAW
+    assert strategy.choose((300, 10), (10, 10)) == RASTERIZE
+
+
+def test_record(tmp_path):
+    log_file = tmp_path / "rendering.jsonl"
+    strategy = RenderingStrategy()
+    strategy.configure(log_file=log_file)
+    with pytest.raises(ValueError):
+        strategy.configure(thresholds=1)
+
+    for seconds in [0.1, 0.2, 0.3]:
+        strategy.record(RAW, (10, 20), seconds)
+    with strategy.timed(RASTERIZE, (5,)):
+        pass
+
+    stats = strategy.stats()
+    assert stats[RAW]["count"] == 3
+    assert stats[RAW]["median"] == pytest.approx(0.2)
+    assert stats[RASTERIZE]["count"] == 1
+
+    entries = [json.loads(line) for line in log_file.read_text().splitlines()]
+    assert len(entries) == 4
+    assert entries[0]["pixels"] == 200
@@ -0,0 +1,153 @@
+import datetime
+import functools
+import numpy as np
+import pytest
+
+from bondia.plot.ringmap import RingMapPlot
+from bondia.util.day import Day
+
+PERCENTILES = np.linspace(0, 100, 201)
+
+
+class FakeRingMap:
+    def __init__(self, freqs, beams, nra=8, nel=4):
+        self.index_map = {
+            "freq": np.array(
+                [(f, 0.39) for f in freqs],
+                dtype=[("centre", np.float64), ("width", np.float64)],
+            ),
+            "beam": np.array(beams),
+            "pol": np.array(["XX", "XY", "YX", "YY"]),
+            "ra": np.linspace(0, 360, nra, endpoint=False),
+            "el": np.linspace(-1, 1, nel),
+        }
+        rng = np.random.default_rng(0)
+        self.map = rng.standard_normal((len(beams), 4, len(freqs), nra, nel)) + 1
+
+
+class FakeData:
+    def __init__(self):
+        self.loaded = 0
+        self.containers = {}
+
+    def load_file(self, revision, lsd, file_type):
+        self.loaded += 1
+        if lsd.lsd not in self.containers:
+            self.containers[lsd.lsd] = FakeRingMap(
+                [400.0 + lsd.lsd, 600.0 + lsd.lsd], [0, 1, 2, 3]
+            )
+        return self.containers[lsd.lsd]
+
+    def is_loaded(self, revision, lsd, file_type):
+        return True
+
+    def load_generation(self, revision, lsd, file_type):
+        return lsd.lsd if lsd.lsd in self.containers else 0
+
+    def read_preview(self, revision, lsd, file_type, read):
+        container = self.load_file(revision, lsd, file_type)
+        group = {"map": container.map}
+        group.update({f"index_map/{k}": v for k, v in container.index_map.items()})
+        return read(group)
+
+    def sketch(self, revision, lsd, file_type):
+        sketch = np.broadcast_to(np.linspace(-2, 2, len(PERCENTILES)), (4, 5, 2, 201))
+        return {
+            "percentiles": PERCENTILES,
+            "beam": np.array([0, 1, 2, 3]),
+            "pol": ["XX", "XY", "YX", "YY", RingMapPlot.mean_pol_text],
+            "freq": np.array([400.0 + lsd.lsd, 600.0 + lsd.lsd]),
+            "map": sketch,
+            "map_crosstalk_removed": sketch / 2,
+        }
+
+
+def day(lsd):
+    return Day(lsd, datetime.date(2020, 1, lsd))
+
+
+def counting(calls, method):
+    """Wrap a method counting its calls (keeping its param dependencies)."""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        calls.append(method.__name__)
+        return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+def test_day_switch_renders_once(monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        RingMapPlot, "update_data", counting(calls, RingMapPlot.update_data)
+    )
+    monkeypatch.setattr(RingMapPlot, "view", counting(calls, RingMapPlot.view))
+
+    data = FakeData()
+    plot = RingMapPlot(data, {})
+    plot.serverside_rendering = None
+    plot.flag_mask = False
+    plot.weight_mask = False
+
+    # Rerun the view when its dependencies change, like panel does
+    deps = [dep.name for dep in plot.param.method_dependencies("view")]
+    plot.param.watch(lambda *events: plot.view(), deps)
+
+    plot.update_day("rev_00", day(1))
+    plot.view()
+    assert plot.frequency == 401.0
+    assert plot.polarization == plot.mean_pol_text
+
+    # Same selections on another day: only new data, no new figure
+    plot.beam = 2
+    calls.clear()
+    plot.update_day("rev_00", day(2))
+    assert calls == ["update_data"]
+    assert plot.frequency == 402.0
+    assert plot._pipe.data["z"].shape == (4, 8)
+
+    # Changing a selection directly updates the data too
+    calls.clear()
+    plot.beam = 1
+    assert calls == ["update_data"]
+
+    # Structural changes rebuild the figure
+    calls.clear()
+    plot.transpose = False
+    assert calls == ["view"]
+
+
+def test_colormap_auto():
+    data = FakeData()
+    plot = RingMapPlot(data, {})
+    plot.flag_mask = False
+    plot.weight_mask = False
+    plot.update_day("rev_00", day(1))
+    plot.colormap_auto = True
+
+    # Range from the sketch of the selected plane (with crosstalk removed)
+    image = plot._image_data()
+    assert image["clim"] == pytest.approx((-0.98, 0.98))
+    preview = plot._preview_data("ringmap")
+    assert preview["clim"] == pytest.approx((-0.98, 0.98))
+    assert preview["z"].shape == image["z"].shape
+
+    # Without a sketch, from the data
+    data.sketch = lambda *args: None
+    rmap = plot._image_data()["z"]
+    clim = plot._image_data()["clim"]
+    assert clim == pytest.approx(tuple(np.nanpercentile(rmap, (1, 99))))
+
+
+def test_missing_selection():
+    data = FakeData()
+    plot = RingMapPlot(data, {})
+    plot.flag_mask = False
+    plot.weight_mask = False
+    plot.update_day("rev_00", day(1))
+
+    # The file got replaced by one without the selected frequency
+    data.containers[1] = FakeRingMap([500.0], [0, 1, 2, 3])
+    data.load_generation = lambda *args: -1
+    assert plot._image_data().startswith("Error: ringmap file for rev_00")
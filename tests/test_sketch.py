@@ -0,0 +1,28 @@
+import numpy as np
+
+from bondia.util.sketch import PERCENTILES, read_sketch, sketch_range, write_sketch
+
+
+def test_sketch_range(tmp_path):
+    values = np.linspace(-1, 9, 1001)
+    sketches = {
+        "sensitivity": {
+            "pol": np.array(["XX", "YY"], dtype="S"),
+            "measured": np.array([np.percentile(values, PERCENTILES)] * 2),
+        }
+    }
+    write_sketch(tmp_path / "sketch.h5", sketches)
+    sketch = read_sketch(tmp_path / "sketch.h5")
+    assert sketch["sensitivity"]["pol"] == ["XX", "YY"]
+
+    lower, upper = sketch_range(
+        sketch["sensitivity"]["measured"], sketch["percentiles"], (1, 99)
+    )
+    assert np.isclose(lower, np.percentile(values, 1))
+    assert np.isclose(upper, np.percentile(values, 99))
+
+    lower, _ = sketch_range(
+        sketch["sensitivity"]["measured"], sketch["percentiles"], positive=True
+    )
+    assert lower > 0
+    assert sketch_range(np.full(len(PERCENTILES), np.nan), PERCENTILES) is None
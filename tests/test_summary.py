@@ -0,0 +1,26 @@
+import numpy as np
+
+from bondia.util.summary import append_summary, anomaly_scores, read_summary
+
+
+def test_append_summary(tmp_path):
+    path = tmp_path / "summary.h5"
+    append_summary(path, 2402, {"a": 1.0})
+    append_summary(path, 2401, {"a": 2.0, "b": 3.0})
+    append_summary(path, 2402, {"b": 4.0})
+
+    table = read_summary(path)
+    assert list(table["lsd"]) == [2401, 2402]
+    assert list(table["a"]) == [2.0, 1.0]
+    assert list(table["b"]) == [3.0, 4.0]
+
+
+def test_anomaly_scores():
+    table = {
+        "lsd": np.array([1, 2, 3, 4, 5]),
+        "a": np.array([1.0, 1.1, 0.9, 1.0, 10.0]),
+        "b": np.array([np.nan, 2.0, 2.0, 2.0, 2.0]),
+    }
+    scores = anomaly_scores(table)
+    assert max(scores, key=scores.get) == 5
+    assert scores[1] < 1
@@ -0,0 +1,62 @@
+import h5py
+import numpy as np
+import pytest
+
+from bondia.scripts.val_preprocess import copy_group
+
+
+@pytest.fixture
+def ringmap_file(tmp_path):
+    rng = np.random.default_rng(0)
+    path = tmp_path / "ringmap.h5"
+    with h5py.File(path, "w") as f:
+        f.attrs["lsd"] = 1878
+        f.create_group("index_map")
+        f["index_map/freq"] = np.linspace(800.0, 400.0, 16)
+        f["index_map/beam"] = np.arange(4)
+        dset = f.create_dataset("map", data=rng.standard_normal((4, 3, 16, 32)))
+        dset.attrs["axis"] = np.array(["beam", "pol", "freq", "ra"], dtype="S")
+        f["scalar"] = 1.5
+    return path
+
+
+@pytest.mark.parametrize("max_block_bytes", [8, 100, 2**20])
+@pytest.mark.parametrize(
+    "selections",
+    [
+        {},
+        {"freq": slice(2, 15, 5)},
+        {"freq": [1, 4, 5, 12], "ra": slice(3, None, 2)},
+        {"beam": [0, 2, 3], "freq": [1, 4, 5, 12]},
+    ],
+)
+def test_copy_group(ringmap_file, tmp_path, selections, max_block_bytes):
+    out_path = tmp_path / "out.h5"
+    with h5py.File(ringmap_file, "r") as fin, h5py.File(out_path, "w") as fout:
+        copy_group(fin, fout, selections, "ringmap", "default", max_block_bytes)
+
+    with h5py.File(ringmap_file, "r") as fin, h5py.File(out_path, "r") as fout:
+        # Apply the selections to the full arrays in memory
+        full = fin["map"][:]
+        index = [
+            np.arange(n)[selections.get(ax, slice(None))]
+            for n, ax in zip(full.shape, ["beam", "pol", "freq", "ra"])
+        ]
+        np.testing.assert_array_equal(fout["map"][:], full[np.ix_(*index)])
+        assert list(fout["map"].attrs["axis"]) == list(fin["map"].attrs["axis"])
+        np.testing.assert_array_equal(
+            fout["index_map/freq"][:], fin["index_map/freq"][:][index[2]]
+        )
+        np.testing.assert_array_equal(
+            fout["index_map/beam"][:], fin["index_map/beam"][:][index[0]]
+        )
+        assert fout["scalar"][()] == 1.5
+        assert fout.attrs["lsd"] == 1878
+
+
+def test_copy_group_unsorted(ringmap_file, tmp_path):
+    with h5py.File(ringmap_file, "r") as fin, h5py.File(
+        tmp_path / "out.h5", "w"
+    ) as fout:
+        with pytest.raises(ValueError):
+            copy_group(fin, fout, {"freq": [4, 1]}, "ringmap", "default", 2**20)